@@ -4,10 +4,11 @@ Admin for core..
 
 from django.contrib import admin
 
-from .models import Event
+from .models import ArchivedEvent, Event
 
 
 admin.site.register(Event)
+admin.site.register(ArchivedEvent)
 # from import_export.admin import ImportExportModelAdmin
 
 # @admin.register(Event)
@@ -0,0 +1,124 @@
+"""
+Load testing of the event list endpoints.
+
+`generate_events` builds a reproducible dataset of events around a few
+cities, `run_load` drives one endpoint with a given number of concurrent
+clients and `summarize` reports its throughput and latency percentiles.
+The `seed_events`, `upstream_stub` and `benchmark` management commands are
+built on them.
+"""
+import asyncio
+import math
+import random
+import time
+from datetime import date, time as day_time, timedelta
+from decimal import Decimal
+
+import httpx
+
+from .geo import geo_cell
+from .models import Event
+
+# City centres the generated events and benchmark users are spread around.
+CITIES = [
+    ('Paris', 48.8566, 2.3522),
+    ('London', 51.5072, -0.1276),
+    ('New York', 40.7128, -74.0060),
+    ('Mumbai', 19.0760, 72.8777),
+    ('Tokyo', 35.6762, 139.6503),
+    ('Sydney', -33.8688, 151.2093),
+    ('Sao Paulo', -23.5558, -46.6396),
+    ('Nairobi', -1.2921, 36.8219),
+]
+SPREAD_DEGREES = 0.5
+
+
+def _around(rng, latitude, longitude):
+    return (
+        round(latitude + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES), 6),
+        round(longitude + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES), 6),
+    )
+
+
+def generate_events(count, seed=0, start=None, days=21):
+    """Return `count` unsaved events dated over `days` days from `start`, the same for a given seed."""
+    rng = random.Random(seed)
+    start = start or date.today()
+    events = []
+    for index in range(count):
+        city, latitude, longitude = rng.choice(CITIES)
+        latitude, longitude = _around(rng, latitude, longitude)
+        events.append(Event(
+            event_name=f'Event {index}',
+            city_name=city,
+            date=start + timedelta(days=rng.randrange(days)),
+            time=day_time(rng.randrange(24), rng.choice([0, 15, 30, 45])),
+            latitude=Decimal(str(latitude)),
+            longitude=Decimal(str(longitude)),
+            geo_cell=geo_cell(latitude, longitude),
+        ))
+    return events
+
+
+def user_locations(count, seed=0):
+    """Return `count` user (latitude, longitude) pairs around the dataset's cities."""
+    rng = random.Random(seed)
+    return [_around(rng, *rng.choice(CITIES)[1:]) for _ in range(count)]
+
+
+def percentile(values, q):
+    """Nearest-rank `q` percentile of `values`, None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """Throughput and latency percentiles, in ms, of a load run."""
+    requests = len(latencies) + errors
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput': round(requests / elapsed, 1) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+    }
+
+
+async def run_load(base_url, path, concurrency, requests, locations, timeout=30.0):
+    """
+    Send `requests` GETs of `path` for the user `locations` in turn, from
+    `concurrency` concurrent clients, and summarize them. Requests failing or
+    answering an error status count as errors, not in the latencies.
+    """
+    latencies = []
+    errors = 0
+    sent = iter(range(requests))
+
+    async def worker(client):
+        nonlocal errors
+        for index in sent:
+            latitude, longitude = locations[index % len(locations)]
+            started = time.perf_counter()
+            try:
+                response = await client.get(path, params={'latitude': latitude, 'longitude': longitude})
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
@@ -0,0 +1,315 @@
+"""
+Caching of event listings.
+
+Every event date has a generation counter in the cache. A listing's cache key
+embeds the generations of the dates of its window, so writing an event only
+invalidates the listings whose window contains the event's date; everything
+else, weather included, survives the write.
+
+Listings are served stale-while-revalidate: past `LIST_CACHE_SOFT_TTL` an
+entry is still returned while a background task recomputes it, and only past
+`LIST_CACHE_HARD_TTL` does a request wait for the computation. Listings
+missing weather because the upstream failed go stale after
+`LIST_CACHE_DEGRADED_TTL` already.
+
+Hot entries are also kept in a bounded in-process LRU in front of Redis. Its
+entries live at most `LOCAL_CACHE_TIMEOUT` and never past the point their
+Redis copy goes stale, and generations are always read from Redis, so a
+worker never serves data older than its Redis tier.
+
+Entries carry a digest of their listing and the time it was computed, the
+validators of conditional requests on listings.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import orjson
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count
+
+from .metrics import cache_requests, stage
+from .models import Event
+from .singleflight import acache_get_or_compute, cache_get_or_compute
+from .upstream import is_persistent_loop
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe in-process cache bounded by size and entry age, with hit/miss counters."""
+
+    instances = []
+
+    def __init__(self, name, max_entries, timeout):
+        self.name = name
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        LRUCache.instances.append(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] <= time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Size and hit/miss counters of the cache."""
+        return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+local_listings = LRUCache('listings', settings.LIST_LOCAL_CACHE_MAX_ENTRIES, settings.LOCAL_CACHE_TIMEOUT)
+
+
+def generation_key(day):
+    """Cache key of the generation counter of a date."""
+    return f'gen:date:{day}'
+
+
+def window_generations(start, end):
+    """Return the generation of every date in [start, end], as a `{date: generation}` dict."""
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    generations = cache.get_many([generation_key(day) for day in days])
+    return {day: generations.get(generation_key(day), 0) for day in days}
+
+
+def window_generation(start, end):
+    """Return a token that changes whenever an event dated in [start, end] is written."""
+    token = ':'.join(str(generation) for generation in window_generations(start, end).values())
+    return hashlib.md5(token.encode(), usedforsecurity=False).hexdigest()[:16]
+
+
+def bump_generation(*days):
+    """Invalidate the listings whose window contains any of `days`."""
+    for day in set(days):
+        key = generation_key(day)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Start from the clock rather than 1 so a counter lost to eviction
+            # never comes back to a value an old listing key was built with.
+            if not cache.add(key, time.time_ns(), timeout=None):
+                cache.incr(key)
+
+
+def count_key(day):
+    """Cache key of the number of events on a date."""
+    return f'count:date:{day}'
+
+
+def window_count(start, end):
+    """
+    Return the number of events dated in [start, end] from per-date counters,
+    counting only the dates missing from the cache.
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    counts = cache.get_many([count_key(day) for day in days])
+    missing = [day for day in days if count_key(day) not in counts]
+    if missing:
+        found = dict.fromkeys(missing, 0)
+        found.update(
+            Event.objects.filter(date__in=missing).order_by().values('date')
+            .annotate(total=Count('id')).values_list('date', 'total'))
+        fresh = {count_key(day): total for day, total in found.items()}
+        cache.set_many(fresh, timeout=settings.COUNT_CACHE_TIMEOUT)
+        counts.update(fresh)
+    return sum(counts.values())
+
+
+def adjust_counts(deltas):
+    """Apply `{date: delta}` to the cached per-date counters that exist."""
+    for day, delta in deltas.items():
+        if delta:
+            try:
+                cache.incr(count_key(day), delta)
+            except ValueError:
+                # Not cached, it will be counted on next use.
+                pass
+
+
+def list_cache_key(name, start, end, location, page):
+    """
+    Cache key of a listing response: its window, bound to the generation of
+    the window, the location it was computed for and the page within it.
+    """
+    page = hashlib.md5(page.encode(), usedforsecurity=False).hexdigest()
+    return f'events:{name}:{start}:{end}:{window_generation(start, end)}:{location}:{page}'
+
+
+_refresh_executor = ThreadPoolExecutor(
+    max_workers=settings.LIST_CACHE_REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+_refresh_tasks = set()
+
+
+def _is_fresh(entry):
+    return entry is not None and entry['fresh_until'] > time.time()
+
+
+def _is_degraded(data):
+    """Whether a listing was built while the weather upstream failed."""
+    events = data.get('events') if isinstance(data, dict) else None
+    return bool(events) and any(event.get('weather') is None for event in events)
+
+
+def content_digest(data):
+    """Digest of a listing, the same for listings of the same content."""
+    return hashlib.md5(orjson.dumps(data, default=str), usedforsecurity=False).hexdigest()
+
+
+def entry_digest(entry):
+    """Digest of the listing of an entry, entries cached before digests were kept included."""
+    return entry.get('digest') or content_digest(entry['data'])
+
+
+def _entry(data):
+    # A degraded listing is served while it is recomputed, but soon.
+    ttl = settings.LIST_CACHE_DEGRADED_TTL if _is_degraded(data) else settings.LIST_CACHE_SOFT_TTL
+    now = time.time()
+    return {'data': data, 'fresh_until': now + ttl, 'digest': content_digest(data), 'modified': now}
+
+
+def _remember(key, entry):
+    """Keep a fresh entry in the local tier until it goes stale."""
+    if _is_fresh(entry):
+        local_listings.set(key, entry, timeout=entry['fresh_until'] - time.time())
+    return entry
+
+
+def _get_entry(key):
+    """Read an entry from the local tier, falling back to Redis."""
+    entry = local_listings.get(key)
+    if entry is None:
+        with stage('cache'):
+            entry = cache.get(key)
+        if entry is not None:
+            _remember(key, entry)
+    cache_requests.inc(cache='listings', result='miss' if entry is None else 'hit' if _is_fresh(entry) else 'stale')
+    return entry
+
+
+async def _aget_entry(key):
+    """Asynchronous version of `_get_entry`."""
+    entry = local_listings.get(key)
+    if entry is None:
+        with stage('cache'):
+            entry = await cache.aget(key)
+        if entry is not None:
+            _remember(key, entry)
+    cache_requests.inc(cache='listings', result='miss' if entry is None else 'hit' if _is_fresh(entry) else 'stale')
+    return entry
+
+
+def _claim(key):
+    """Whether this caller should start the refresh of `key`."""
+    with _refreshing_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+        return True
+
+
+def _release(key):
+    with _refreshing_lock:
+        _refreshing.discard(key)
+
+
+def _refresh_in_thread(key, refresh):
+    def run():
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Refreshing %s failed", key)
+        finally:
+            _release(key)
+            connections.close_all()
+    _refresh_executor.submit(run)
+
+
+def _refresh_task_done(key):
+    def done(task):
+        _refresh_tasks.discard(task)
+        _release(key)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Refreshing %s failed", key, exc_info=task.exception())
+    return done
+
+
+def _refresh(key, compute):
+    return _remember(key, cache_get_or_compute(
+        key, lambda: _entry(compute()), settings.LIST_CACHE_HARD_TTL, is_valid=_is_fresh))
+
+
+async def _arefresh(key, compute):
+    async def compute_entry():
+        return _entry(await compute())
+    return _remember(key, await acache_get_or_compute(
+        key, compute_entry, settings.LIST_CACHE_HARD_TTL, is_valid=_is_fresh))
+
+
+def get_entry_or_revalidate(key, compute):
+    """
+    Return the entry cached under `key`, computing it with `compute()` on a
+    miss and refreshing it in a worker thread once it is stale.
+    """
+    entry = _get_entry(key)
+    if entry is None:
+        entry = _refresh(key, compute)
+    elif not _is_fresh(entry) and _claim(key):
+        _refresh_in_thread(key, lambda: _refresh(key, compute))
+    return entry
+
+
+async def aget_entry_or_revalidate(key, compute):
+    """
+    Asynchronous version of `get_entry_or_revalidate`, `compute` is a
+    coroutine function. The refresh runs as a task of a long-lived server
+    loop, or in a worker thread when the loop ends with the request.
+    """
+    entry = await _aget_entry(key)
+    if entry is None:
+        entry = await _arefresh(key, compute)
+    elif not _is_fresh(entry) and _claim(key):
+        loop = asyncio.get_running_loop()
+        if is_persistent_loop(loop):
+            task = loop.create_task(_arefresh(key, compute))
+            _refresh_tasks.add(task)
+            task.add_done_callback(_refresh_task_done(key))
+        else:
+            _refresh_in_thread(key, lambda: asyncio.run(_arefresh(key, compute)))
+    return entry
@@ -0,0 +1,51 @@
+"""
+Great-circle distance helpers for event finder.
+"""
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Return the great-circle distance in km between two points."""
+    return haversine_many(latitude1, longitude1, [latitude2], [longitude2])[0]
+
+
+def haversine_many(latitude, longitude, latitudes, longitudes):
+    """
+    Return the distances in km from one point to every point of the given
+    coordinate arrays, computed in a single pass.
+    """
+    lat1 = math.radians(float(latitude))
+    lon1 = math.radians(float(longitude))
+    cos_lat1 = math.cos(lat1)
+    sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+
+    distances = []
+    append = distances.append
+    for lat2, lon2 in zip(latitudes, longitudes):
+        lat2 = radians(float(lat2))
+        half_dlat = (lat2 - lat1) * 0.5
+        half_dlon = (radians(float(lon2)) - lon1) * 0.5
+        a = sin(half_dlat) ** 2 + cos_lat1 * cos(lat2) * sin(half_dlon) ** 2
+        append(2 * EARTH_RADIUS_KM * asin(sqrt(min(1.0, a))))
+    return distances
+
+
+def verify_distance(event, remote_distance, tolerance_km):
+    """Log a warning when the remote distance disagrees with the local one."""
+    try:
+        difference = abs(float(remote_distance) - event['distance_km'])
+    except (TypeError, ValueError):
+        logger.warning("Invalid remote distance %r for %s", remote_distance, event['event_name'])
+        return False
+    if difference > tolerance_km:
+        logger.warning(
+            "Distance mismatch for %s: local %.3f km, remote %s km",
+            event['event_name'], event['distance_km'], remote_distance,
+        )
+        return False
+    return True
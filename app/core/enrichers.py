@@ -0,0 +1,213 @@
+"""
+Enrichment of listed events with data from other sources.
+
+An enricher computes one field for every event of a page, `distance_km`
+and `weather` for the built-in ones, or only has side effects like the
+remote distance check; `settings.EVENT_ENRICHERS` lists the enrichers to
+run. The enrichers of a page run concurrently under one deadline, so a page
+takes as long as its slowest enricher rather than the sum of them; an
+enricher failing or missing the deadline leaves its `default` in its field.
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import httpx
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import resilience
+from .distance import haversine_many, verify_distance
+from .metrics import carry_timings
+from .upstream import distance_url
+from .weather import alookup_weather, lookup_weather
+
+logger = logging.getLogger(__name__)
+
+# Enrichers of the thread backend run here and fan their calls out to the
+# context's executor; a separate pool so they never wait on their own queue.
+_stage_executor = ThreadPoolExecutor(thread_name_prefix='enricher')
+
+
+class EnrichContext:
+    """The user the events are enriched for, and the clients to use."""
+
+    def __init__(self, latitude, longitude, client, executor=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.client = client
+        self.executor = executor
+
+
+class Enricher:
+    """
+    Base class of enrichers. `enrich` returns the values of `field` for the
+    events, in order; `aenrich` is its asynchronous version.
+    """
+    field = None
+    default = None
+
+    def enrich(self, events, context):
+        raise NotImplementedError
+
+    async def aenrich(self, events, context):
+        return self.enrich(events, context)
+
+
+def _parse_distance(response):
+    return response.json()["distance"]
+
+
+def verify_remote_distance(client, latitude, longitude, event):
+    """Check the local distance of an event against the remote distance API, if it answers."""
+    url = distance_url(latitude, longitude, event['latitude'], event['longitude'])
+    try:
+        remote_distance = resilience.get(client, url, resilience.distance_circuit, parse=_parse_distance)
+    except httpx.HTTPError as ex:
+        logger.warning("Distance check of %s skipped: %s", event['event_name'], ex)
+        return None
+    return verify_distance(event, remote_distance, settings.DISTANCE_VERIFY_TOLERANCE_KM)
+
+
+async def averify_remote_distance(client, latitude, longitude, event):
+    """Check the local distance of an event against the remote distance API asynchronously, if it answers."""
+    url = distance_url(latitude, longitude, event['latitude'], event['longitude'])
+    try:
+        remote_distance = await resilience.aget(client, url, resilience.distance_circuit, parse=_parse_distance)
+    except httpx.HTTPError as ex:
+        logger.warning("Distance check of %s skipped: %s", event['event_name'], ex)
+        return None
+    return verify_distance(event, remote_distance, settings.DISTANCE_VERIFY_TOLERANCE_KM)
+
+
+class DistanceEnricher(Enricher):
+    """Great-circle distance to the user."""
+    field = 'distance_km'
+
+    def enrich(self, events, context):
+        return haversine_many(
+            context.latitude, context.longitude,
+            [event['latitude'] for event in events],
+            [event['longitude'] for event in events],
+        )
+
+
+class DistanceCheckEnricher(DistanceEnricher):
+    """
+    Check of the local distances against the remote distance API when
+    `DISTANCE_VERIFY_REMOTE` is set; mismatches are logged, no field is set.
+    """
+    field = None
+
+    def _checked(self, events, context):
+        distances = super().enrich(events, context)
+        return [{**event, 'distance_km': distance} for event, distance in zip(events, distances)]
+
+    def enrich(self, events, context):
+        if settings.DISTANCE_VERIFY_REMOTE:
+            mapper = context.executor.map if context.executor is not None else map
+            list(mapper(
+                carry_timings(
+                    lambda event: verify_remote_distance(context.client, context.latitude, context.longitude, event)),
+                self._checked(events, context)))
+
+    async def aenrich(self, events, context):
+        if settings.DISTANCE_VERIFY_REMOTE:
+            await asyncio.gather(*(
+                averify_remote_distance(context.client, context.latitude, context.longitude, event)
+                for event in self._checked(events, context)))
+
+
+class WeatherEnricher(Enricher):
+    """Weather of the event's city on its date, see `core.weather`."""
+    field = 'weather'
+
+    def _pairs(self, events):
+        return [(event['city_name'], str(event['date'])) for event in events]
+
+    def enrich(self, events, context):
+        pairs = self._pairs(events)
+        weather = lookup_weather(list(dict.fromkeys(pairs)), context.client, context.executor)
+        return [weather.get(pair) for pair in pairs]
+
+    async def aenrich(self, events, context):
+        pairs = self._pairs(events)
+        weather = await alookup_weather(list(dict.fromkeys(pairs)), context.client)
+        return [weather.get(pair) for pair in pairs]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_enrichers(paths):
+    return [import_string(path)() for path in paths]
+
+
+def get_enrichers():
+    """Return the enrichers listed in `settings.EVENT_ENRICHERS`."""
+    return _load_enrichers(tuple(settings.EVENT_ENRICHERS))
+
+
+def _apply(events, enricher, values):
+    if enricher.field is None:
+        return
+    if values is None:
+        values = [enricher.default] * len(events)
+    for event, value in zip(events, values):
+        event[enricher.field] = value
+
+
+def enrich(events, context, enrichers=None):
+    """
+    Set the fields of `enrichers` on `events`. Without an executor in the
+    context the enrichers run one after the other; with one they run
+    concurrently until `ENRICH_DEADLINE`. Either way a failing enricher
+    leaves its default.
+    """
+    enrichers = get_enrichers() if enrichers is None else enrichers
+    if context.executor is None:
+        for enricher in enrichers:
+            try:
+                values = enricher.enrich(events, context)
+            except Exception:
+                logger.error("%s failed", type(enricher).__name__, exc_info=True)
+                values = None
+            _apply(events, enricher, values)
+        return events
+
+    futures = {
+        _stage_executor.submit(carry_timings(enricher.enrich), events, context): enricher
+        for enricher in enrichers
+    }
+    done, _ = wait(futures, timeout=settings.ENRICH_DEADLINE)
+    for future, enricher in futures.items():
+        values = None
+        if future not in done:
+            logger.warning("%s missed the deadline", type(enricher).__name__)
+        elif future.exception() is not None:
+            logger.error("%s failed", type(enricher).__name__, exc_info=future.exception())
+        else:
+            values = future.result()
+        _apply(events, enricher, values)
+    return events
+
+
+async def aenrich(events, context, enrichers=None):
+    """Asynchronous version of `enrich`, the enrichers always run concurrently."""
+    enrichers = get_enrichers() if enrichers is None else enrichers
+    tasks = {asyncio.ensure_future(enricher.aenrich(events, context)): enricher for enricher in enrichers}
+    done, pending = await asyncio.wait(tasks, timeout=settings.ENRICH_DEADLINE)
+    for task in pending:
+        task.cancel()
+    for task, enricher in tasks.items():
+        values = None
+        if task not in done:
+            logger.warning("%s missed the deadline", type(enricher).__name__)
+        elif task.cancelled():
+            logger.warning("%s was cancelled", type(enricher).__name__)
+        elif task.exception() is not None:
+            logger.error("%s failed", type(enricher).__name__, exc_info=task.exception())
+        else:
+            values = task.result()
+        _apply(events, enricher, values)
+    return events
@@ -0,0 +1,227 @@
+"""
+Grid-cell spatial index and "near me" queries for events.
+
+Every event stores the id of the fixed size lat/lon grid cell it falls in
+(`Event.geo_cell`). Radius queries read only the cells overlapping the
+bounding box of the search circle and then check the exact distance.
+
+Listings ordered by distance rank the whole window and select each page
+with a partial sort (`RankedRows`).
+
+Users are grouped in location buckets, geohash or grid cells, so that
+listings computed for the centre of a bucket serve everyone inside it.
+"""
+import heapq
+import math
+
+from django.db.models import Q
+
+from .distance import EARTH_RADIUS_KM, haversine_many
+
+CELL_SIZE_DEGREES = 0.5
+ROWS = int(180 / CELL_SIZE_DEGREES)
+COLUMNS = int(360 / CELL_SIZE_DEGREES)
+# Above this many grid rows a plain latitude range is cheaper than the OR of cell ranges.
+MAX_CELL_ROWS = 64
+HALF_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+NEAREST_INITIAL_RADIUS_KM = 50.0
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Orders of a listing: by date, by distance from the user, or by distance within each date.
+ORDERINGS = ('date', 'distance', 'date,distance')
+
+
+def _row(latitude):
+    return min(ROWS - 1, max(0, int(math.floor((float(latitude) + 90) / CELL_SIZE_DEGREES))))
+
+
+def _column(longitude):
+    return int(math.floor((float(longitude) + 180) / CELL_SIZE_DEGREES)) % COLUMNS
+
+
+def geo_cell(latitude, longitude):
+    """Return the grid cell id of a coordinate."""
+    return _row(latitude) * COLUMNS + _column(longitude)
+
+
+def geohash(latitude, longitude, precision):
+    """Return the geohash of a coordinate with `precision` characters."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_center(code):
+    """Return the (latitude, longitude) centre of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in code:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            interval[0 if value >> shift & 1 else 1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def geohash_bucket(latitude, longitude, precision):
+    """Return the key and centre of the geohash cell of a coordinate."""
+    code = geohash(latitude, longitude, precision)
+    return (f'gh:{code}', *geohash_center(code))
+
+
+def grid_bucket(latitude, longitude, size_degrees):
+    """Return the key and centre of the `size_degrees` grid cell of a coordinate."""
+    row = math.floor((min(90.0, max(-90.0, float(latitude))) + 90) / size_degrees)
+    column = math.floor((float(longitude) + 180) / size_degrees)
+    center_lat = min(90.0, (row + 0.5) * size_degrees - 90)
+    center_lon = ((column + 0.5) * size_degrees) % 360 - 180
+    return f'grid{size_degrees}:{row}:{column}', center_lat, center_lon
+
+
+def bounding_boxes(latitude, longitude, radius_km):
+    """
+    Return the (min_lat, max_lat, min_lon, max_lon) boxes covering the circle
+    of `radius_km` around a point. A circle crossing the antimeridian is split
+    in two boxes, one containing a pole spans every longitude.
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    angular = radius_km / EARTH_RADIUS_KM
+    delta_lat = math.degrees(angular)
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(latitude)))))
+    min_lon, max_lon = longitude - delta_lon, longitude + delta_lon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def bounding_box_q(latitude, longitude, radius_km):
+    """Return a filter selecting the events inside the circle's bounding boxes."""
+    query = Q()
+    for min_lat, max_lat, min_lon, max_lon in bounding_boxes(latitude, longitude, radius_km):
+        box = Q(latitude__range=[min_lat, max_lat], longitude__range=[min_lon, max_lon])
+        first_row, last_row = _row(min_lat), _row(max_lat)
+        if last_row - first_row < MAX_CELL_ROWS:
+            first_column, last_column = _column(min_lon), _column(max_lon)
+            if max_lon >= 180:
+                last_column = COLUMNS - 1
+            cells = Q()
+            for row in range(first_row, last_row + 1):
+                cells |= Q(geo_cell__range=[row * COLUMNS + first_column, row * COLUMNS + last_column])
+            box &= cells
+        query |= box
+    return query
+
+
+def _with_distances(events, latitude, longitude):
+    distances = haversine_many(
+        latitude, longitude,
+        [event['latitude'] for event in events],
+        [event['longitude'] for event in events],
+    )
+    return zip(distances, events)
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    Return the events of `queryset` within `radius_km`, keeping its order.
+    `queryset` yields `values()` rows with `id`, `latitude` and `longitude`.
+    """
+    candidates = list(queryset.filter(bounding_box_q(latitude, longitude, radius_km)))
+    return [event for distance, event in _with_distances(candidates, latitude, longitude) if distance <= radius_km]
+
+
+def nearest(queryset, latitude, longitude, k, max_radius_km=HALF_CIRCUMFERENCE_KM):
+    """
+    Return the `k` events of `queryset` closest to a point, closest first.
+
+    The search radius starts small and doubles until it holds `k` events, so
+    only the rows around the point are read.
+    """
+    radius_km = min(NEAREST_INITIAL_RADIUS_KM, max_radius_km)
+    while True:
+        found = [
+            (distance, event['id'], event)
+            for distance, event in _with_distances(
+                list(queryset.filter(bounding_box_q(latitude, longitude, radius_km))), latitude, longitude)
+            if distance <= radius_km
+        ]
+        if len(found) >= k or radius_km >= max_radius_km:
+            break
+        radius_km = min(radius_km * 2, max_radius_km)
+    return [event for _, _, event in heapq.nsmallest(k, found)]
+
+
+def near_events(queryset, latitude, longitude, radius_km=None, nearest_k=None):
+    """Apply the optional `radius_km` and `nearest` filters to `queryset`."""
+    if nearest_k:
+        return nearest(queryset, latitude, longitude, nearest_k, radius_km or HALF_CIRCUMFERENCE_KM)
+    if radius_km:
+        return within_radius(queryset, latitude, longitude, radius_km)
+    return queryset
+
+
+class RankedRows:
+    """
+    Rows ranked on sort keys ending with the row's index, read by slices.
+
+    A slice is cut from the `stop` smallest keys, selected with a heap in
+    O(n log stop): a page never sorts the whole window. The selected prefix
+    is kept, and grown at least twofold, for the next slices.
+    """
+
+    def __init__(self, rows, keys):
+        self.rows = rows
+        self.keys = keys
+        self._ranked = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            index = range(len(self))[index]
+            return self[index:index + 1][0]
+        start, stop, step = index.indices(len(self))
+        if stop > len(self._ranked):
+            self._ranked = heapq.nsmallest(max(stop, 2 * len(self._ranked)), self.keys)
+        return [self.rows[key[-1]] for key in self._ranked[start:stop:step]]
+
+
+def sort_keys(order, distances, ids, dates):
+    """Sort keys of rows for `order`, 'distance' or 'date,distance', ties broken on id."""
+    if order == 'distance':
+        return [(distance, pk, index) for index, (distance, pk) in enumerate(zip(distances, ids))]
+    return [
+        (day, distance, pk, index)
+        for index, (day, distance, pk) in enumerate(zip(dates, distances, ids))
+    ]
+
+
+def rank_rows(rows, latitude, longitude, order):
+    """Rank `values()` rows, a queryset or list, by their distance to a point for `order`."""
+    rows = list(rows)
+    distances = haversine_many(
+        latitude, longitude, [row['latitude'] for row in rows], [row['longitude'] for row in rows])
+    return RankedRows(rows, sort_keys(order, distances, [row['id'] for row in rows], [row['date'] for row in rows]))
@@ -0,0 +1,183 @@
+"""
+Bulk ingestion of event feeds.
+
+Feeds are parsed as streams (JSON arrays, NDJSON or CSV), validated row by
+row with `EventSerializer` and written with chunked `bulk_create`. Bulk
+inserts skip the model signals, so every batch bumps the generations and
+counters of its dates once instead.
+"""
+import codecs
+import csv
+import io
+import json
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import adjust_counts, bump_generation
+from .geo import geo_cell
+from .models import Event
+from .serializers import EventSerializer
+
+CHUNK_SIZE = 64 * 1024
+FORMATS = ('json', 'ndjson', 'csv')
+
+_WHITESPACE = re.compile(r'\s*')
+
+
+class IngestError(ValueError):
+    """The feed cannot be parsed any further."""
+
+
+def _text_chunks(stream, chunk_size=CHUNK_SIZE):
+    """Read a binary or text stream as decoded text chunks."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    while chunk := stream.read(chunk_size):
+        yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+    yield decoder.decode(b'', final=True)
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Yield the items of a JSON array one at a time, without loading the whole array."""
+    decoder = json.JSONDecoder()
+    chunks = _text_chunks(stream, chunk_size)
+    buffer, position, state, eof = '', 0, '[', False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                if state != 'end':
+                    raise IngestError("Unexpected end of the JSON array.")
+                return
+            chunk = next(chunks, None)
+            eof = chunk is None
+            buffer, position = buffer[position:] + (chunk or ''), 0
+            continue
+        char = buffer[position]
+        if state == '[':
+            if char != '[':
+                raise IngestError("Expected a JSON array.")
+            position, state = position + 1, 'first'
+        elif state in ('first', 'next') and char == ']':
+            position, state = position + 1, 'end'
+        elif state == 'next':
+            if char != ',':
+                raise IngestError(f"Expected ',' or ']' at {char!r}.")
+            position, state = position + 1, 'item'
+        elif state in ('first', 'item'):
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as ex:
+                item, end = ex, None
+            if (end is None or end == len(buffer)) and not eof:
+                # The item may be cut by the chunk boundary, read on.
+                chunk = next(chunks, None)
+                eof = chunk is None
+                buffer, position = buffer[position:] + (chunk or ''), 0
+                continue
+            if end is None:
+                raise IngestError(f"Invalid JSON: {item}")
+            yield item
+            buffer, position, state = buffer[end:], 0, 'next'
+        else:
+            raise IngestError(f"Unexpected data after the JSON array at {char!r}.")
+
+
+def iter_ndjson(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield the objects of a newline delimited JSON stream. A malformed line is
+    yielded as an `IngestError` so it is reported as a row error.
+    """
+    pending = ''
+    for chunk in _text_chunks(stream, chunk_size):
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        yield from _ndjson_lines(lines)
+    yield from _ndjson_lines([pending])
+
+
+def _ndjson_lines(lines):
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as ex:
+                yield IngestError(f"Invalid JSON: {ex}")
+
+
+def iter_csv(stream):
+    """
+    Yield the rows of a CSV stream with a header line as dicts. Binary streams
+    are decoded by a stream reader, which needs `read` only, as request bodies
+    are not full file objects.
+    """
+    if isinstance(stream, io.TextIOBase):
+        return csv.DictReader(stream)
+    return csv.DictReader(codecs.getreader('utf-8-sig')(stream))
+
+
+def iter_records(stream, format):
+    """Yield the records of a feed in one of `FORMATS`."""
+    if format == 'json':
+        return iter_json_array(stream)
+    if format == 'ndjson':
+        return iter_ndjson(stream)
+    if format == 'csv':
+        return iter_csv(stream)
+    raise IngestError(f"Unsupported format {format!r}.")
+
+
+def build_event(record):
+    """Return an unsaved event and None for a valid record, or None and its errors."""
+    if isinstance(record, IngestError):
+        return None, {'non_field_errors': [str(record)]}
+    if not isinstance(record, dict):
+        return None, {'non_field_errors': ["Expected an object."]}
+    serializer = EventSerializer(data=record)
+    if not serializer.is_valid():
+        return None, serializer.errors
+    data = serializer.validated_data
+    return Event(**data, geo_cell=geo_cell(data['latitude'], data['longitude'])), None
+
+
+def save_batch(events):
+    """Insert a batch of events and invalidate the listings of their dates once."""
+    with transaction.atomic():
+        Event.objects.bulk_create(events)
+    counts = Counter(event.date for event in events)
+    bump_generation(*counts)
+    adjust_counts(counts)
+
+
+def ingest(records, batch_size=None, max_errors=None):
+    """
+    Validate and insert `records`, returning the number of created and
+    failed rows and the errors of the first `max_errors` failed rows.
+    Rows are numbered from 1. When the feed cannot be parsed any further,
+    the rows read so far are still saved and `error` tells why it stopped.
+    """
+    batch_size = batch_size or settings.INGEST_BATCH_SIZE
+    max_errors = settings.INGEST_MAX_ERRORS if max_errors is None else max_errors
+    result = {'created': 0, 'failed': 0, 'errors': [], 'error': None}
+    batch = []
+    try:
+        for row, record in enumerate(records, 1):
+            event, errors = build_event(record)
+            if errors:
+                result['failed'] += 1
+                if len(result['errors']) < max_errors:
+                    result['errors'].append({'row': row, 'errors': errors})
+                continue
+            batch.append(event)
+            if len(batch) >= batch_size:
+                save_batch(batch)
+                result['created'] += len(batch)
+                batch = []
+    except IngestError as ex:
+        result['error'] = str(ex)
+    if batch:
+        save_batch(batch)
+        result['created'] += len(batch)
+    return result
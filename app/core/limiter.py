@@ -0,0 +1,196 @@
+"""
+Adaptive concurrency limit of the calls to the upstream.
+
+Threads and event loop tasks of a worker share one limit on the calls in
+flight. Callers over the limit queue up in FIFO order, for at most the
+deadline of their call. The limit adapts AIMD style: it grows by about one
+per round of calls answered under `UPSTREAM_LATENCY_TARGET`, and is cut when
+the upstream answers 429 or slowly, at most once per `decrease_interval`.
+
+With `UPSTREAM_RATE_LIMIT` set, workers also share a calls per second budget
+counted in the cache (Redis), which holds when the fleet scales out.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import httpx
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class LimitExceededError(httpx.TimeoutException):
+    """No upstream call slot was free before the deadline."""
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter shared by threads and event loops, with queue statistics."""
+
+    instances = []
+
+    def __init__(self, name, initial, minimum, maximum, latency_target, decrease_interval=1.0):
+        self.name = name
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self.max_waiting = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        AdaptiveLimiter.instances.append(self)
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    def _admit(self):
+        """Take a slot for the caller if one is free and nobody queues before it; lock held."""
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _queue(self, wake):
+        waiter = [wake]
+        self._waiters.append(waiter)
+        self.max_waiting = max(self.max_waiting, len(self._waiters))
+        return waiter
+
+    def _wake(self):
+        """Hand the free slots over to the waiters in turn; lock held."""
+        while self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            if self._waiters.popleft()[0]() is False:
+                # The waiter's event loop is gone, take the slot back.
+                self.in_flight -= 1
+
+    def _give_up(self, waiter):
+        """Leave the queue, returning False if a slot was handed over meanwhile."""
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self.timeouts += 1
+                return True
+            return False
+
+    def acquire(self, timeout):
+        """Wait up to `timeout` seconds for a call slot."""
+        with self._lock:
+            if self._admit():
+                return
+            event = threading.Event()
+            waiter = self._queue(event.set)
+        if not event.wait(timeout) and self._give_up(waiter):
+            raise LimitExceededError(f"No {self.name} call slot within {timeout}s.")
+
+    async def aacquire(self, timeout):
+        """Asynchronous version of `acquire`."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+            except RuntimeError:
+                return False
+
+        with self._lock:
+            if self._admit():
+                return
+            waiter = self._queue(wake)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as ex:
+            if self._give_up(waiter):
+                if isinstance(ex, asyncio.CancelledError):
+                    raise
+                raise LimitExceededError(f"No {self.name} call slot within {timeout}s.") from None
+            # The slot was handed over while giving up.
+            if isinstance(ex, asyncio.CancelledError):
+                self.release()
+                raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.decrease_interval:
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * factor)
+
+    def record(self, latency, throttled=False):
+        """Adapt the limit to the outcome of a call."""
+        with self._lock:
+            if throttled:
+                self.throttled += 1
+                self._decrease(0.5)
+            elif latency > self.latency_target:
+                self._decrease(0.9)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self._wake()
+
+    def stats(self):
+        """Current limit, calls in flight and queue depth of the limiter."""
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'throttled': self.throttled,
+            'timeouts': self.timeouts,
+        }
+
+
+upstream_limiter = AdaptiveLimiter(
+    'upstream',
+    initial=settings.UPSTREAM_CONCURRENCY,
+    minimum=settings.UPSTREAM_CONCURRENCY_MIN,
+    maximum=settings.UPSTREAM_CONCURRENCY_MAX,
+    latency_target=settings.UPSTREAM_LATENCY_TARGET,
+)
+
+
+def _rate_wait():
+    """Count a call against the shared per second budget, returning how long to wait if it is spent."""
+    second = int(time.time())
+    key = f'ratelimit:upstream:{second}'
+    cache.add(key, 0, timeout=2)
+    try:
+        calls = cache.incr(key)
+    except ValueError:
+        # Expired between add and incr, the next second starts anyway.
+        return 0
+    return 0 if calls <= settings.UPSTREAM_RATE_LIMIT else second + 1 - time.time()
+
+
+def wait_for_rate(timeout):
+    """Wait for the shared rate budget to allow a call, for at most `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while settings.UPSTREAM_RATE_LIMIT and (delay := _rate_wait()) > 0:
+        if time.monotonic() + delay > deadline:
+            raise LimitExceededError("Upstream rate limit reached.")
+        time.sleep(delay)
+
+
+async def await_rate(timeout):
+    """
+    Asynchronous version of `wait_for_rate`. The cache calls run in a thread:
+    `cache.aincr` is a get and a set, not the atomic Redis INCR.
+    """
+    deadline = time.monotonic() + timeout
+    while settings.UPSTREAM_RATE_LIMIT and (delay := await sync_to_async(_rate_wait)()) > 0:
+        if time.monotonic() + delay > deadline:
+            raise LimitExceededError("Upstream rate limit reached.")
+        await asyncio.sleep(delay)
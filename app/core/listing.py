@@ -0,0 +1,265 @@
+"""
+The event listing engine behind the sync, async and thread list views.
+
+A listing is the page of events of the next `LIST_WINDOW_DAYS` days around
+the user, enriched and paginated. Parsing, the window query, pagination and
+the cache key are the same for every view; a backend only decides how the
+page is enriched: on the request thread, fanned out to the upstream thread
+pool, or on the event loop. The window is read from the worker's in-memory
+snapshot of it (see `core.snapshot`) rather than queried per request.
+
+The cache key of a listing is made of its backend, its date window with the
+window's generation, the user's location bucket and the page parameters.
+The listing of a bucket is computed for its centre and shared by the users
+inside it: each response gets its own `next`/`previous` links and, with
+`LOCATION_EXACT_DISTANCES`, distances recomputed for the user. The radius
+and nearest filters stay those of the centre, off by at most the bucket's
+half diagonal.
+
+Listing responses are conditional: their strong ETag is derived from the
+cache key, so from the window's generation, the bucket and the page, from
+the digest of the cached listing, which changes when a refresh brings new
+weather, and from the request's URL and format, which the per user body is
+made of. A client's matching `If-None-Match` is answered 304 from the cache
+entry alone, before any query or upstream call.
+"""
+import hashlib
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import aget_entry_or_revalidate, entry_digest, get_entry_or_revalidate, list_cache_key
+from .distance import haversine_many
+from .enrichers import EnrichContext, aenrich, enrich
+from .geo import ORDERINGS, geohash_bucket, grid_bucket, near_events, rank_rows
+from .metrics import stage, timed
+from .models import Event
+from .pagination import get_paginator
+from .serializers import EVENT_LIST_FIELDS, event_rows, list_item
+from .snapshot import snapshots
+from .upstream import async_client, get_client, get_executor
+
+LIST_WINDOW_DAYS = 14
+
+# Query parameters selecting the page of a listing, part of its cache key.
+PAGE_PARAMS = ('pagination', 'cursor', 'page')
+
+
+class ListingParamsError(ValueError):
+    """The query parameters of a listing request are missing or invalid."""
+
+
+def parse_near_params(query_params):
+    """Parse the optional `radius_km` and `nearest` query parameters."""
+    radius_km = query_params.get('radius_km', None)
+    nearest_k = query_params.get('nearest', None)
+    radius_km = float(radius_km) if radius_km else None
+    nearest_k = int(nearest_k) if nearest_k else None
+    if radius_km is not None and not radius_km > 0:
+        raise ValueError("radius_km must be positive.")
+    if nearest_k is not None and not 0 < nearest_k <= settings.NEAREST_MAX:
+        raise ValueError(f"nearest must be between 1 and {settings.NEAREST_MAX}.")
+    return radius_km, nearest_k
+
+
+def location_bucket(latitude, longitude):
+    """Return the key and centre of the `LOCATION_BUCKET` bucket of a location."""
+    if settings.LOCATION_BUCKET == 'geohash':
+        return geohash_bucket(latitude, longitude, settings.LOCATION_GEOHASH_PRECISION)
+    if settings.LOCATION_BUCKET == 'grid':
+        return grid_bucket(latitude, longitude, settings.LOCATION_GRID_DEGREES)
+    return f'{latitude.normalize()},{longitude.normalize()}', latitude, longitude
+
+
+class EventListing:
+    """A listing request: the user's location and filters, its window and its page."""
+
+    def __init__(self, request, latitude, longitude, radius_km=None, nearest_k=None, today=None, order='date'):
+        self.request = request
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_km = radius_km
+        self.nearest_k = nearest_k
+        self.order = order
+        self.start = today or date.today()
+        self.end = self.start + timedelta(days=LIST_WINDOW_DAYS)
+        self.bucket, self.bucket_latitude, self.bucket_longitude = location_bucket(latitude, longitude)
+
+    @classmethod
+    def from_request(cls, request):
+        """Parse the listing parameters of `request`, raising `ListingParamsError`."""
+        latitude = request.query_params.get('latitude', None)
+        longitude = request.query_params.get('longitude', None)
+        if not all([latitude, longitude]):
+            raise ListingParamsError("Latitude and Longitude parameters are required.")
+        try:
+            latitude = Decimal(latitude)
+            longitude = Decimal(longitude)
+            radius_km, nearest_k = parse_near_params(request.query_params)
+        except (InvalidOperation, ValueError):
+            raise ListingParamsError("Invalid paramters.")
+        if not latitude.is_finite() or not longitude.is_finite():
+            raise ListingParamsError("Invalid paramters.")
+        if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+            raise ListingParamsError("Latitude must be between -90 and 90 and longitude between -180 and 180.")
+        order = request.query_params.get('order') or 'date'
+        if order not in ORDERINGS:
+            raise ListingParamsError(f"order must be one of {', '.join(ORDERINGS)}.")
+        return cls(request, latitude, longitude, radius_km, nearest_k, order=order)
+
+    def rows(self, ordered=False):
+        """
+        The events of the window around the bucket: the worker's snapshot of
+        the window with `LIST_SNAPSHOT`, else `values()` rows, or a list of
+        rows once filtered. Ordered by distance, the rows are ranked from the
+        bucket's centre like the filters.
+        """
+        if settings.LIST_SNAPSHOT:
+            snapshot = snapshots.get(self.start, self.end)
+            rows = snapshot.near_events(self.bucket_latitude, self.bucket_longitude, self.radius_km, self.nearest_k)
+            if rows is snapshot and self.order != 'date':
+                return snapshot.ranked(self.bucket_latitude, self.bucket_longitude, self.order)
+        else:
+            queryset = Event.objects.filter(date__range=[self.start, self.end])
+            if ordered:
+                queryset = queryset.order_by('date', 'id')
+            rows = near_events(
+                queryset.values(*EVENT_LIST_FIELDS),
+                self.bucket_latitude, self.bucket_longitude, self.radius_km, self.nearest_k)
+        if self.order != 'date':
+            return rank_rows(rows, self.bucket_latitude, self.bucket_longitude, self.order)
+        return rows
+
+    def page(self):
+        """Return the paginator and the event dicts of the requested page."""
+        paginator = get_paginator(self.request, self.start, self.end)
+        return paginator, event_rows(paginator.paginate_queryset(self.rows(), self.request))
+
+    @timed('serialize')
+    def body(self, paginator, events):
+        """Body of the enriched events of a page, to cache for the bucket."""
+        items = [
+            {**list_item(event), 'latitude': event['latitude'], 'longitude': event['longitude']}
+            for event in events
+        ]
+        return paginator.get_paginated_response(items).data
+
+    def context(self, client, executor=None):
+        return EnrichContext(self.bucket_latitude, self.bucket_longitude, client, executor)
+
+    def _link(self, link):
+        """The page link of the bucket's body, for this request."""
+        if link is None:
+            return None
+        params = parse_qs(urlsplit(link).query)
+        url = self.request.build_absolute_uri()
+        for name in ('page', 'cursor'):
+            url = replace_query_param(url, name, params[name][0]) if name in params else remove_query_param(url, name)
+        return url
+
+    @timed('serialize')
+    def respond(self, body):
+        """The response body for this user from the cached body of the bucket."""
+        events = body['events']
+        if settings.LOCATION_EXACT_DISTANCES:
+            distances = haversine_many(
+                self.latitude, self.longitude,
+                [event['latitude'] for event in events],
+                [event['longitude'] for event in events],
+            )
+        else:
+            distances = [event['distance_km'] for event in events]
+        events = [
+            {**list_item(event), 'distance_km': distance}
+            for event, distance in zip(events, distances)
+        ]
+        return {**body, 'events': events, 'next': self._link(body['next']), 'previous': self._link(body['previous'])}
+
+    def etag(self, key, entry):
+        """Strong ETag of this user's response from the cached `entry` of the bucket under `key`."""
+        token = '|'.join([
+            key, entry_digest(entry), self.request.build_absolute_uri(), self.request.accepted_renderer.format])
+        return '"%s"' % hashlib.md5(token.encode(), usedforsecurity=False).hexdigest()
+
+    def response(self, key, entry):
+        """
+        The response of this user from the cached `entry` of the bucket, or
+        304 Not Modified when the client holds it already.
+        """
+        etag = self.etag(key, entry)
+        modified = int(entry['modified']) if 'modified' in entry else None
+        response = get_conditional_response(self.request, etag=etag, last_modified=modified)
+        if response is None:
+            response = Response(self.respond(entry['data']))
+        response['ETag'] = etag
+        if modified is not None:
+            response['Last-Modified'] = http_date(modified)
+        response['Cache-Control'] = settings.LIST_CACHE_CONTROL
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def page_key(self):
+        """The filters and page parameters of the request, in a canonical order."""
+        params = self.request.query_params
+        page = [f'{name}={params.get(name, "")}' for name in PAGE_PARAMS]
+        if params.get('page') in (None, ''):
+            page[-1] = 'page=1'
+        return '&'.join([f'radius_km={self.radius_km}', f'nearest={self.nearest_k}', f'order={self.order}', *page])
+
+    def cache_key(self, name):
+        return list_cache_key(name, self.start, self.end, self.bucket, self.page_key())
+
+
+class BlockingBackend:
+    """Enriches the page on the request thread, one enricher after the other."""
+    name = 'sync'
+
+    def executor(self):
+        return None
+
+    def compute(self, listing):
+        paginator, events = listing.page()
+        with stage('enrich'):
+            enrich(events, listing.context(get_client(), self.executor()))
+        return listing.body(paginator, events)
+
+    def get(self, listing):
+        """The response to `listing`, from the cached listing of its bucket."""
+        key = listing.cache_key(self.name)
+        return listing.response(key, get_entry_or_revalidate(key, lambda: self.compute(listing)))
+
+
+class ThreadBackend(BlockingBackend):
+    """Enriches the page with concurrent enrichers fanning out to the upstream thread pool."""
+    name = 'thread'
+
+    def executor(self):
+        return get_executor()
+
+
+class AsyncioBackend:
+    """Enriches the page on the event loop with the asynchronous upstream client."""
+    name = 'async'
+
+    async def compute(self, listing):
+        paginator, events = await sync_to_async(listing.page)()
+        with stage('enrich'):
+            async with async_client() as client:
+                await aenrich(events, listing.context(client))
+        return listing.body(paginator, events)
+
+    async def aget(self, listing):
+        """The response to `listing`, from the cached listing of its bucket."""
+        key = await sync_to_async(listing.cache_key)(self.name)
+        return listing.response(key, await aget_entry_or_revalidate(key, lambda: self.compute(listing)))
+
+
+BACKENDS = {backend.name: backend for backend in (BlockingBackend(), ThreadBackend(), AsyncioBackend())}
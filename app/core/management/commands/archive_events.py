@@ -0,0 +1,50 @@
+"""
+Django command to move past events out of the event table.
+"""
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.cache import bump_generation, count_key
+from core.models import ArchivedEvent, Event
+
+FIELDS = ['id', 'event_name', 'city_name', 'date', 'time', 'latitude', 'longitude']
+
+
+class Command (BaseCommand):
+    """Django command to archive past events."""
+
+    help = "Move events older than the retention period to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.EVENT_RETENTION_DAYS,
+            help="Keep events of the last DAYS days in the event table.")
+        parser.add_argument(
+            '--batch-size', type=int, default=5000, help="Events moved per transaction.")
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command."""
+        cutoff = datetime.now().date() - timedelta(days=options['days'])
+        archived = 0
+        dates = set()
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    Event.objects.filter(date__lt=cutoff).order_by('date', 'id')
+                    .values(*FIELDS)[:options['batch_size']])
+                if not rows:
+                    break
+                ArchivedEvent.objects.bulk_create(
+                    [ArchivedEvent(**row) for row in rows], ignore_conflicts=True)
+                Event.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            archived += len(rows)
+            dates.update(row['date'] for row in rows)
+        # Once the batches are committed, invalidate the archived dates and
+        # have their counters recounted from the table.
+        bump_generation(*dates)
+        cache.delete_many([count_key(day) for day in dates])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} events dated before {cutoff}."))
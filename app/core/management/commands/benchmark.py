@@ -0,0 +1,148 @@
+"""
+Django command to load test the event list endpoints.
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import run_load, user_locations
+from core.upstream_stub import UpstreamServer
+
+ENDPOINTS = {
+    'sync': '/api/event/sync/',
+    'async': '/api/event/async/',
+    'thread': '/api/event/thread/',
+}
+
+
+def server_command(server, port, workers):
+    """Command line serving the project under WSGI (gunicorn) or ASGI (uvicorn)."""
+    if server == 'wsgi':
+        return [
+            sys.executable, '-m', 'gunicorn', 'efinder.wsgi', '--bind', f'127.0.0.1:{port}',
+            '--workers', str(workers), '--threads', '8', '--log-level', 'warning',
+        ]
+    return [
+        sys.executable, '-m', 'uvicorn', 'efinder.asgi:application', '--host', '127.0.0.1',
+        '--port', str(port), '--workers', str(workers), '--log-level', 'warning', '--no-access-log',
+    ]
+
+
+class Command (BaseCommand):
+    """Django command to benchmark the list endpoints."""
+
+    help = (
+        "Drive the sync, async and thread list endpoints at increasing concurrency and report "
+        "throughput and p50/p95/p99 latencies. Serves the project itself under WSGI and ASGI "
+        "against a local upstream stub, unless --base-url points at a running server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--server', action='append', choices=['wsgi', 'asgi'],
+            help="Server to benchmark under, repeat for both (default).")
+        parser.add_argument('--base-url', help="Benchmark an already running server instead.")
+        parser.add_argument('--port', type=int, default=8100, help="Port of the benchmarked server.")
+        parser.add_argument('--workers', type=int, default=2, help="Worker processes of the benchmarked server.")
+        parser.add_argument(
+            '--endpoint', action='append', choices=list(ENDPOINTS), help="Endpoint to drive, repeat for several.")
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[1, 8, 32], help="Concurrent clients of each run.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests of each run.")
+        parser.add_argument('--warmup', type=int, default=20, help="Requests sent before each run, not measured.")
+        parser.add_argument('--locations', type=int, default=50, help="Distinct user locations requested.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the user locations and upstream stub.")
+        parser.add_argument('--upstream-latency', type=float, default=0.05, help="Seconds every upstream answer takes.")
+        parser.add_argument('--upstream-jitter', type=float, default=0.02, help="Extra random upstream seconds.")
+        parser.add_argument('--upstream-error-rate', type=float, default=0.0, help="Share of upstream calls failing.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--max-p95', type=float, help="Fail when a run's p95 exceeds this many ms.")
+        parser.add_argument('--max-error-rate', type=float, help="Fail when a run's error share exceeds this.")
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command."""
+        endpoints = options['endpoint'] or list(ENDPOINTS)
+        locations = user_locations(options['locations'], options['seed'])
+        results = []
+        if options['base_url']:
+            results += self.bench(None, options['base_url'], endpoints, locations, options)
+        else:
+            stub = UpstreamServer(
+                delay=options['upstream_latency'], jitter=options['upstream_jitter'],
+                error_rate=options['upstream_error_rate'], seed=options['seed'])
+            with stub:
+                for server in options['server'] or ['wsgi', 'asgi']:
+                    with self.serve(server, options['port'], options['workers'], stub.url) as base_url:
+                        results += self.bench(server, base_url, endpoints, locations, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        self.check_thresholds(results, options['max_p95'], options['max_error_rate'])
+
+    @contextmanager
+    def serve(self, server, port, workers, upstream_url):
+        """Run the project under `server` for the duration of the block, yielding its URL."""
+        env = {**os.environ, 'UPSTREAM_BASE_URL': upstream_url}
+        process = subprocess.Popen(server_command(server, port, workers), cwd=settings.BASE_DIR, env=env)
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            self.wait_ready(process, base_url)
+            yield base_url
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def wait_ready(self, process, base_url, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f"The server exited with status {process.returncode}.")
+            try:
+                httpx.get(base_url + ENDPOINTS['sync'], timeout=1)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise CommandError(f"The server did not answer within {timeout}s.")
+
+    def bench(self, server, base_url, endpoints, locations, options):
+        """Drive every endpoint at every concurrency level, printing a line per run."""
+        results = []
+        for endpoint in endpoints:
+            path = ENDPOINTS[endpoint]
+            for concurrency in options['concurrency']:
+                if options['warmup']:
+                    asyncio.run(run_load(base_url, path, concurrency, options['warmup'], locations))
+                result = asyncio.run(run_load(base_url, path, concurrency, options['requests'], locations))
+                result = {'server': server, 'endpoint': endpoint, 'concurrency': concurrency, **result}
+                results.append(result)
+                self.stdout.write(
+                    f"{server or base_url:>6} {endpoint:>6} c={concurrency:<4} "
+                    f"{result['throughput']} req/s  p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                    f"p99={result['p99_ms']}ms errors={result['errors']}/{result['requests']}")
+        return results
+
+    def check_thresholds(self, results, max_p95, max_error_rate):
+        """Raise a CommandError listing the runs over the thresholds."""
+        failures = []
+        for result in results:
+            name = f"{result['server'] or ''} {result['endpoint']} c={result['concurrency']}".strip()
+            p95 = result['p95_ms']
+            if max_p95 is not None and (p95 is None or p95 > max_p95):
+                failures.append(f"{name}: p95 {p95}ms over {max_p95}ms")
+            if max_error_rate is not None and result['errors'] > max_error_rate * result['requests']:
+                failures.append(f"{name}: {result['errors']}/{result['requests']} errors")
+        if failures:
+            raise CommandError("Benchmark thresholds exceeded:\n" + "\n".join(failures))
@@ -0,0 +1,47 @@
+"""
+Django command to bulk import events from CSV, NDJSON or JSON files.
+"""
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ingest import FORMATS, ingest, iter_records
+
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.json': 'json'}
+
+
+class Command (BaseCommand):
+    """Django command to import event feeds."""
+
+    help = "Import events from CSV, NDJSON or JSON array files, '-' reads stdin."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Feed files to import.")
+        parser.add_argument(
+            '--format', choices=FORMATS, help="Format of the feeds, guessed from the file extension by default.")
+        parser.add_argument('--batch-size', type=int, help="Events inserted per bulk insert.")
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command."""
+        failed = False
+        for path in options['paths']:
+            format = options['format'] or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+            if format is None:
+                raise CommandError(f"Cannot guess the format of {path}, use --format.")
+            if path == '-':
+                result = ingest(iter_records(sys.stdin.buffer, format), options['batch_size'])
+            else:
+                with open(path, 'rb') as stream:
+                    result = ingest(iter_records(stream, format), options['batch_size'])
+
+            for error in result['errors']:
+                self.stderr.write(f"{path}: row {error['row']}: {json.dumps(error['errors'])}")
+            if result['error']:
+                self.stderr.write(f"{path}: {result['error']}")
+            failed = failed or result['failed'] or result['error']
+            self.stdout.write(self.style.SUCCESS(
+                f"{path}: imported {result['created']} events, {result['failed']} rows failed."))
+        if failed:
+            raise CommandError("Some rows were not imported.")
@@ -0,0 +1,71 @@
+"""
+Django command to prefetch weather for the upcoming events window.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Event
+from core.upstream import async_client
+from core.weather import afetch_weather, expiring_pairs, store_weather
+
+
+class Command (BaseCommand):
+    """Django command to keep the weather cache warm."""
+
+    help = "Fetch weather for every (city, date) of the upcoming events and cache it."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true', help="Run a single pass instead of looping.")
+        parser.add_argument(
+            '--interval', type=int, default=settings.WEATHER_PREFETCH_INTERVAL,
+            help="Seconds between two passes.")
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.WEATHER_PREFETCH_CONCURRENCY,
+            help="Maximum number of concurrent upstream calls.")
+        parser.add_argument(
+            '--days', type=int, default=14, help="Size of the upcoming window in days.")
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command."""
+        while True:
+            self.prefetch(options['days'], options['interval'], options['concurrency'])
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def prefetch(self, days, interval, concurrency):
+        """Fetch the weather that is missing or expires before the next pass."""
+        current_date = datetime.now().date()
+        end_date = current_date + timedelta(days=days)
+        pairs = [
+            (city, str(date)) for city, date in Event.objects.filter(
+                date__range=[current_date, end_date],
+            ).order_by().values_list('city_name', 'date').distinct()
+        ]
+        # Refresh anything that would expire before the pass after next.
+        pairs = expiring_pairs(pairs, 2 * interval)
+        fetched, failed = asyncio.run(self.fetch_all(pairs, concurrency))
+        self.stdout.write(f"Prefetched weather for {fetched} (city, date) pairs, {failed} failed.")
+
+    async def fetch_all(self, pairs, concurrency):
+        """Fetch and cache the weather of `pairs`, `concurrency` at a time."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(client, city, date):
+            async with semaphore:
+                try:
+                    weather = await afetch_weather(client, city, date)
+                except Exception as ex:
+                    self.stderr.write(f"Weather for {city} on {date} failed: {ex}")
+                    return False
+            store_weather(city, date, weather)
+            return True
+
+        async with async_client() as client:
+            results = await asyncio.gather(*(fetch(client, city, date) for city, date in pairs))
+        return results.count(True), results.count(False)
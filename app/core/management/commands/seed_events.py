@@ -0,0 +1,30 @@
+"""
+Django command to seed the event table with a reproducible dataset.
+"""
+from django.core.management.base import BaseCommand
+
+from core.benchmark import generate_events
+from core.ingest import save_batch
+from core.models import Event
+
+
+class Command (BaseCommand):
+    """Django command to generate benchmark events."""
+
+    help = "Insert generated events around a few cities over the coming weeks, the same for a given seed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000, help="Number of events to insert.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the generated dataset.")
+        parser.add_argument('--days', type=int, default=21, help="Days from today the events are spread over.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Events inserted per bulk insert.")
+        parser.add_argument('--clear', action='store_true', help="Delete every event first.")
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command."""
+        if options['clear']:
+            Event.objects.all().delete()
+        events = generate_events(options['count'], options['seed'], days=options['days'])
+        for start in range(0, len(events), options['batch_size']):
+            save_batch(events[start:start + options['batch_size']])
+        self.stdout.write(self.style.SUCCESS(f"Seeded {len(events)} events."))
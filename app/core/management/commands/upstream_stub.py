@@ -0,0 +1,33 @@
+"""
+Django command to serve a local stand-in of the weather/distance upstream.
+"""
+from django.core.management.base import BaseCommand
+
+from core.upstream_stub import UpstreamServer
+
+
+class Command (BaseCommand):
+    """Django command to run the upstream stub."""
+
+    help = "Answer like the weather and distance APIs, with injected latency and errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help="Address to listen on.")
+        parser.add_argument('--port', type=int, default=8001, help="Port to listen on.")
+        parser.add_argument('--latency', type=float, default=0.05, help="Seconds every answer takes.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Extra random seconds, up to this many.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered 503.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed of the jitter and errors.")
+
+    def handle(self, *args, **options):
+        """Entrypoint for the command."""
+        server = UpstreamServer(
+            options['host'], options['port'], options['latency'], options['jitter'],
+            options['error_rate'], seed=options['seed'])
+        self.stdout.write(f"Upstream stub listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,360 @@
+"""
+Instrumentation of the request hot path.
+
+`stage(name)` times a block, and `timed(name)` a function, into the
+`efinder_stage_seconds` histogram and into the timings of the current
+request, which `MetricsMiddleware` sends back as a `Server-Timing` header.
+Database queries are timed as the `db` stage on every connection. Counters
+track cache hits and upstream outcomes; the `/metrics` view exposes them
+with request latencies in the Prometheus text format.
+
+Metrics live in the worker process, like the caches, circuits and limiters
+they sit next to; Prometheus aggregates the workers it scrapes.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    """Prometheus label set of a `{name: value}` dict."""
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    """A metric family whose samples are keyed by the values of its labels."""
+
+    kind = None
+    instances = []
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        Metric.instances.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """Yield the (name, labels, value) samples of the family."""
+        raise NotImplementedError
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{format_labels(labels)} {value}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonic count."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, dict(zip(self.labels, key)), value
+
+
+class Histogram(Metric):
+    """Distribution of observations over cumulative `le` buckets, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def count(self, **labels):
+        counts = self._values.get(self._key(labels))
+        return counts[-2] if counts else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        for key, counts in values:
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, counts):
+                yield f'{self.name}_bucket', {**labels, 'le': bound}, count
+            yield f'{self.name}_bucket', {**labels, 'le': '+Inf'}, counts[-2]
+            yield f'{self.name}_count', labels, counts[-2]
+            yield f'{self.name}_sum', labels, round(counts[-1], 6)
+
+
+request_seconds = Histogram(
+    'efinder_request_seconds', "Time to answer a request, by view and status.", ['view', 'method', 'status'])
+stage_seconds = Histogram(
+    'efinder_stage_seconds', "Time spent in a stage of a request: db, cache, upstream calls, enrichment, rendering.",
+    ['stage'])
+cache_requests = Counter(
+    'efinder_cache_requests_total', "Cache lookups by cache and result.", ['cache', 'result'])
+upstream_requests = Counter(
+    'efinder_upstream_requests_total', "Upstream calls by API and outcome.", ['api', 'outcome'])
+
+
+class Trace:
+    """
+    Timeline of the stages and SQL queries of a profiled request, and the
+    threads working for it at the moment.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timeline = []
+        self.queries = []
+        self.threads = {}
+        self._lock = threading.Lock()
+
+    def _offset(self, started):
+        return round((started - self.started) * 1000, 3)
+
+    def add(self, name, started, seconds):
+        self.timeline.append({
+            'stage': name,
+            'start_ms': self._offset(started),
+            'duration_ms': round(seconds * 1000, 3),
+            'thread': threading.current_thread().name,
+        })
+
+    def add_query(self, sql, many, started, seconds):
+        self.queries.append({
+            'sql': sql,
+            'many': many,
+            'start_ms': self._offset(started),
+            'duration_ms': round(seconds * 1000, 3),
+        })
+
+    def enter(self):
+        """Count the current thread as working for the request until `exit`."""
+        ident = threading.get_ident()
+        with self._lock:
+            self.threads[ident] = self.threads.get(ident, 0) + 1
+
+    def exit(self):
+        ident = threading.get_ident()
+        with self._lock:
+            if self.threads.get(ident, 0) > 1:
+                self.threads[ident] -= 1
+            else:
+                self.threads.pop(ident, None)
+
+
+class Timings:
+    """Total time and count per stage of one request, and its trace when profiled."""
+
+    def __init__(self):
+        self.stages = {}
+        self.trace = None
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            total, count = self.stages.get(name, (0.0, 0))
+            self.stages[name] = (total + seconds, count + 1)
+
+    def header(self, total):
+        """`Server-Timing` value of the stages, and of the whole request as `total`."""
+        entries = [
+            f'{name};dur={seconds * 1000:.1f}' + (f';desc="{count}x"' if count > 1 else '')
+            for name, (seconds, count) in self.stages.items()
+        ]
+        return ', '.join(entries + [f'total;dur={total * 1000:.1f}'])
+
+
+def current_timings():
+    """Timings of the current request, None outside of one."""
+    return _timings.get()
+
+
+def use_timings(timings):
+    """Make `timings` those of the current context, returning the token to reset it with."""
+    return _timings.set(timings)
+
+
+def reset_timings(token):
+    _timings.reset(token)
+
+
+def _trace():
+    timings = _timings.get()
+    return timings.trace if timings is not None else None
+
+
+def record_stage(name, seconds):
+    stage_seconds.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time the block as the `name` stage of the current request."""
+    trace = _trace()
+    if trace is not None:
+        trace.enter()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        record_stage(name, seconds)
+        if trace is not None:
+            trace.exit()
+            trace.add(name, started, seconds)
+
+
+def timed(name):
+    """Decorator timing every call of a function, or coroutine function, as the `name` stage."""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def carry_timings(function):
+    """Wrap `function` to record its stages in the current request when run in a pool thread."""
+    timings = _timings.get()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _timings.set(timings)
+        trace = _trace()
+        if trace is not None:
+            trace.enter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if trace is not None:
+                trace.exit()
+            _timings.reset(token)
+    return wrapper
+
+
+def _time_query(execute, sql, params, many, context):
+    trace = _trace()
+    started = time.perf_counter()
+    try:
+        with stage('db'):
+            return execute(sql, params, many, context)
+    finally:
+        if trace is not None:
+            trace.add_query(sql, many, started, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    """Time every query of a new database connection."""
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class MetricsMiddleware:
+    """Record the latency of every request and answer its stage timings in `Server-Timing`."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, started = Timings(), time.perf_counter()
+        token = _timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings, started = Timings(), time.perf_counter()
+        token = _timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    def finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        match = request.resolver_match
+        request_seconds.observe(
+            total, view=(match.url_name or match.view_name) if match else 'unmatched',
+            method=request.method, status=response.status_code)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timings.header(total)
+        return response
+
+
+def gauge_family(name, help, samples):
+    """Prometheus text of a gauge family from its (labels, value) samples, read at scrape time."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+    lines += [f'{name}{format_labels(labels)} {value}' for labels, value in samples]
+    return '\n'.join(lines)
+
+
+def exposition(extra=()):
+    """The Prometheus text exposition of every metric, followed by the `extra` families."""
+    return '\n'.join([metric.exposition() for metric in Metric.instances] + list(extra)) + '\n'
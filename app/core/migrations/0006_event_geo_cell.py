@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:17
+
+import math
+
+from django.db import migrations, models
+
+# The grid of core.geo when this migration was written: 0.5 degree cells.
+CELL_SIZE_DEGREES = 0.5
+ROWS = int(180 / CELL_SIZE_DEGREES)
+COLUMNS = int(360 / CELL_SIZE_DEGREES)
+BATCH_SIZE = 1000
+
+
+def geo_cell(latitude, longitude):
+    row = min(ROWS - 1, max(0, int(math.floor((float(latitude) + 90) / CELL_SIZE_DEGREES))))
+    column = int(math.floor((float(longitude) + 180) / CELL_SIZE_DEGREES)) % COLUMNS
+    return row * COLUMNS + column
+
+
+def fill_geo_cell(apps, schema_editor):
+    Event = apps.get_model('core', 'Event')
+    batch = []
+    for event in Event.objects.only('latitude', 'longitude').iterator(chunk_size=BATCH_SIZE):
+        event.geo_cell = geo_cell(event.latitude, event.longitude)
+        batch.append(event)
+        if len(batch) >= BATCH_SIZE:
+            Event.objects.bulk_update(batch, ['geo_cell'])
+            batch = []
+    if batch:
+        Event.objects.bulk_update(batch, ['geo_cell'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_event_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='geo_cell',
+            field=models.IntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_geo_cell, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_event_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedEvent',
+            fields=[
+                ('event_name', models.CharField(max_length=254)),
+                ('city_name', models.CharField(max_length=254)),
+                ('time', models.TimeField()),
+                ('latitude', models.DecimalField(decimal_places=15, max_digits=20)),
+                ('longitude', models.DecimalField(decimal_places=15, max_digits=20)),
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='geo_cell',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['geo_cell', 'date'], name='event_geo_cell_date_idx'),
+        ),
+    ]
@@ -4,9 +4,11 @@ Models for Event Mangement System.
 
 from django.db import models
 
+from .geo import geo_cell
 
-class Event(models.Model):
-    """model for event."""
+
+class BaseEvent(models.Model):
+    """Fields shared by live and archived events."""
     event_name = models.CharField(max_length=254)
     city_name = models.CharField(max_length=254)
     date = models.DateField()
@@ -17,5 +19,39 @@ class Event(models.Model):
     def __str__(self):
         return self.event_name
 
+    class Meta:
+        abstract = True
+
+
+class Event(BaseEvent):
+    """model for event."""
+    # Indexed together with date by event_geo_cell_date_idx.
+    geo_cell = models.IntegerField(editable=False, default=0)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored date, an update invalidates both old and new dates.
+        instance._loaded_date = instance.__dict__.get('date')
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.geo_cell = geo_cell(self.latitude, self.longitude)
+        super().save(*args, **kwargs)
+
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+            models.Index(fields=['geo_cell', 'date'], name='event_geo_cell_date_idx'),
+        ]
+
+
+class ArchivedEvent(BaseEvent):
+    """model for a past event moved out of the event table."""
+    id = models.BigIntegerField(primary_key=True)
+    date = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
     class Meta:
         ordering = ['date']
@@ -1,7 +1,19 @@
+import json
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import OrderedDict
+from datetime import date
 
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import window_count
+from .geo import RankedRows
+from .snapshot import EventSnapshot
 
 
 class CustomPagination(PageNumberPagination):
@@ -16,3 +28,136 @@ class CustomPagination(PageNumberPagination):
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
         ]))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination of `values()` rows ordered on (date, id), backed by the (date, id) index,
+    with totals read from the cached per-date counters of the window.
+    Results already in memory (radius/nearest queries, distance orders) keep
+    their order and are paged by position; the events snapshot is paged on (date, id) like
+    the table.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def cursor_key(self, cursor):
+        """The (date, id) of a keyset cursor, validated before it reaches a query."""
+        if cursor is None:
+            return None
+        try:
+            return date.fromisoformat(cursor['d']), int(cursor['i'])
+        except (KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        encoded = urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = remove_query_param(request.build_absolute_uri(), 'page')
+        cursor = self.decode_cursor(request)
+        if isinstance(queryset, (list, RankedRows)):
+            return self.paginate_list(queryset, cursor)
+        if isinstance(queryset, EventSnapshot):
+            return self.paginate_snapshot(queryset, cursor)
+        self.count = None
+        self.total = window_count(self.start, self.end)
+        reverse = bool(cursor and cursor.get('r'))
+        queryset = queryset.order_by('date', 'id')
+        key = self.cursor_key(cursor)
+        if key and reverse:
+            queryset = queryset.filter(Q(date__lt=key[0]) | Q(date=key[0], id__lt=key[1])).reverse()
+        elif key:
+            queryset = queryset.filter(Q(date__gt=key[0]) | Q(date=key[0], id__gt=key[1]))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.rows = rows
+        return rows
+
+    def paginate_list(self, rows, cursor):
+        try:
+            offset = max(0, int(cursor['o'])) if cursor else 0
+        except (KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        self.count = self.total = len(rows)
+        self.offset = offset
+        self.has_next = offset + self.page_size < len(rows)
+        self.has_previous = offset > 0
+        self.rows = rows[offset:offset + self.page_size]
+        return self.rows
+
+    def paginate_snapshot(self, snapshot, cursor):
+        self.count = None
+        self.total = len(snapshot)
+        reverse = bool(cursor and cursor.get('r'))
+        key = self.cursor_key(cursor)
+        position = snapshot.position(*key) if key else 0
+        if reverse:
+            # The cursor is the first event of the next page, itself excluded.
+            end = position - 1 if position and snapshot.ids[position - 1] == key[1] else position
+            start = max(0, end - self.page_size)
+            self.has_next, self.has_previous = True, start > 0
+        else:
+            start, end = position, position + self.page_size
+            self.has_next, self.has_previous = end < len(snapshot), cursor is not None
+        self.rows = snapshot[start:end]
+        return self.rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.count is not None:
+            return self.encode_cursor({'o': self.offset + self.page_size})
+        last = self.rows[-1]
+        return self.encode_cursor({'d': str(last['date']), 'i': last['id']})
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.count is not None:
+            return self.encode_cursor({'o': max(0, self.offset - self.page_size)})
+        if not self.rows:
+            return None
+        first = self.rows[0]
+        return self.encode_cursor({'d': str(first['date']), 'i': first['id'], 'r': 1})
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('events', data),
+            ('pageSize', self.page_size),
+            ('totalEvents', self.total),
+            ('totalPages', math.ceil(self.total / self.page_size)),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ]))
+
+
+def get_paginator(request, start, end):
+    """Paginator for an events listing of the [start, end] window."""
+    if 'cursor' in request.query_params or request.query_params.get('pagination') == 'cursor':
+        return KeysetPagination(start, end)
+    return CustomPagination()
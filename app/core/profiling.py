@@ -0,0 +1,240 @@
+"""
+On demand profiling of single list requests.
+
+A list request carrying an `X-Profile` header, from a staff user or with
+`PROFILING_TOKEN` as its value, is profiled: a sampling profiler records the
+stacks of the threads working for the request every `PROFILING_INTERVAL`
+seconds, and the stage timeline and SQL queries of the request are traced
+(see `core.metrics`). The report is kept in the cache for
+`PROFILING_REPORT_TIMEOUT` seconds under the id answered in `X-Profile-Id`.
+
+On the asyncio path the request's tasks are sampled instead of the event
+loop thread, which is shared with every other request: the stack of a task
+is its chain of awaiting coroutines, so a sample shows where the request is
+waiting, not only what the loop happens to run. Tasks are attributed to the
+request through a task factory installed on the loop while it is profiled.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import BasePermission
+
+from . import metrics
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+_profile = contextvars.ContextVar('profile', default=None)
+# Event loops with the profiling task factory: loop -> [previous factory, profiles].
+_loop_factories = {}
+
+
+def may_profile(request):
+    """Whether the request may profile: staff users, or the profiling token in `X-Profile`."""
+    if not settings.PROFILING_ENABLED:
+        return False
+    if settings.PROFILING_TOKEN and request.headers.get(PROFILE_HEADER) == settings.PROFILING_TOKEN:
+        return True
+    return bool(request.user and request.user.is_staff)
+
+
+def can_profile(request):
+    """Whether the request asks for a profile and may have it."""
+    return bool(request.headers.get(PROFILE_HEADER)) and may_profile(request)
+
+
+class CanProfile(BasePermission):
+    """Allow staff users and requests carrying the profiling token."""
+
+    def has_permission(self, request, view):
+        return may_profile(request)
+
+
+def report_key(profile_id):
+    return f'profile:{profile_id}'
+
+
+def get_report(profile_id):
+    """The stored report of a profile, None once expired."""
+    return cache.get(report_key(profile_id))
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}'
+
+
+def thread_stack(frame):
+    """Frames of a thread stack from its top frame, outermost first."""
+    frames = []
+    while frame is not None:
+        frames.append(_frame_name(frame))
+        frame = frame.f_back
+    return frames[::-1]
+
+
+def task_stack(task):
+    """Frames of the coroutines a task awaits through, outermost first."""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append(_frame_name(frame))
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    return frames
+
+
+def _install_task_factory(loop, profile):
+    """Attribute the tasks created in the context of `profile` to it."""
+    if loop in _loop_factories:
+        _loop_factories[loop][1].add(profile)
+        return
+    previous = loop.get_task_factory()
+
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        current = _profile.get()
+        if current is not None:
+            current.tasks.append(task)
+        return task
+
+    _loop_factories[loop] = [previous, {profile}]
+    loop.set_task_factory(factory)
+
+
+def _uninstall_task_factory(loop, profile):
+    previous, profiles = _loop_factories[loop]
+    profiles.discard(profile)
+    if not profiles:
+        del _loop_factories[loop]
+        loop.set_task_factory(previous)
+
+
+class Profile:
+    """Sampling profile and trace of one request, for the duration of a `with` block."""
+
+    def __init__(self, request, interval=None):
+        self.request = request
+        self.interval = interval or settings.PROFILING_INTERVAL
+        self.id = uuid.uuid4().hex
+        self.tasks = []
+        self.stacks = Counter()
+        self.samples = 0
+        self.loop = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.timings = metrics.current_timings()
+        self._timings_token = None
+        if self.timings is None:
+            self.timings = metrics.Timings()
+            self._timings_token = metrics.use_timings(self.timings)
+        self.trace = self.timings.trace = metrics.Trace()
+        self.started_at = datetime.now(timezone.utc)
+        self._profile_token = _profile.set(self)
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.trace.enter()
+        else:
+            self.tasks.append(asyncio.current_task())
+            _install_task_factory(self.loop, self)
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.trace.started
+        if self.loop is None:
+            self.trace.exit()
+        else:
+            _uninstall_task_factory(self.loop, self)
+        _profile.reset(self._profile_token)
+        self.timings.trace = None
+        if self._timings_token is not None:
+            metrics.reset_timings(self._timings_token)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = [thread_stack(frames[ident]) for ident in list(self.trace.threads) if ident in frames]
+            for task in list(self.tasks):
+                if task is not None and not task.done():
+                    try:
+                        stacks.append(['<task>'] + task_stack(task))
+                    except (AttributeError, RuntimeError):
+                        # The task moved on while it was walked.
+                        continue
+            self.samples += 1
+            self.stacks.update(';'.join(stack) for stack in stacks if stack)
+
+    def report(self, status_code):
+        """The report of the profile, see the module docstring."""
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            functions[stack.rsplit(';', 1)[-1]] += count
+        limit = settings.PROFILING_MAX_STACKS
+        return {
+            'id': self.id,
+            'method': self.request.method,
+            'path': self.request.get_full_path(),
+            'status': status_code,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(self.duration * 1000, 3),
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'stacks': [{'stack': stack, 'samples': count} for stack, count in self.stacks.most_common(limit)],
+            'functions': [{'function': name, 'samples': count} for name, count in functions.most_common(limit)],
+            'timeline': sorted(self.trace.timeline, key=lambda entry: entry['start_ms']),
+            'sql': self.trace.queries,
+        }
+
+    def save(self, response):
+        """Store the report and tell its id in the response."""
+        cache.set(report_key(self.id), self.report(response.status_code), settings.PROFILING_REPORT_TIMEOUT)
+        response[PROFILE_ID_HEADER] = self.id
+        # The id is of this request only, shared caches must not hand it out.
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+
+def profiled(method):
+    """Decorator profiling the requests to a view method, synchronous or not, that ask for it."""
+    if iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(view, request, *args, **kwargs):
+            # Authenticating may read the session, off the loop and only when asked.
+            if not (request.headers.get(PROFILE_HEADER) and await sync_to_async(may_profile)(request)):
+                return await method(view, request, *args, **kwargs)
+            with Profile(request) as profile:
+                response = await method(view, request, *args, **kwargs)
+            return profile.save(response)
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        if not can_profile(request):
+            return method(view, request, *args, **kwargs)
+        with Profile(request) as profile:
+            response = method(view, request, *args, **kwargs)
+        return profile.save(response)
+    return wrapper
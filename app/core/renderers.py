@@ -0,0 +1,56 @@
+"""
+Renderers for event finder APIs.
+"""
+from decimal import Decimal
+
+import orjson
+from rest_framework.renderers import BaseRenderer
+
+from .metrics import timed
+
+
+def _default(obj):
+    """Encode the types orjson does not know natively."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    # Lazy translation strings of error messages, among others.
+    return str(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    """JSON renderer backed by orjson, dates, datetimes and UUIDs are encoded natively."""
+    media_type = 'application/json'
+    format = 'json'
+    charset = None
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        option = orjson.OPT_NON_STR_KEYS
+        if renderer_context and renderer_context.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+
+
+def ndjson_line(data):
+    """Encode one object as a line of newline delimited JSON."""
+    return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline delimited JSON renderer, one line per event of a listing or a
+    single line for any other response.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    @timed('render')
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and isinstance(data.get('events'), list):
+            return b''.join(ndjson_line(event) for event in data['events'])
+        return ndjson_line(data)
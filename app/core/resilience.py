@@ -0,0 +1,278 @@
+"""
+Resilience of the calls to the weather/distance upstream.
+
+Every call has a deadline and goes through the circuit breaker of its API:
+after `CIRCUIT_FAILURE_THRESHOLD` consecutive failures the circuit opens and
+calls fail at once for `CIRCUIT_RESET_TIMEOUT` seconds, then a single trial
+call decides whether it closes again. A body that cannot be parsed counts as
+a failure like an error status. With `UPSTREAM_HEDGE_AFTER` set, a call
+still unanswered after that many seconds is sent a second time and the first
+answer wins. Every request sent, hedges included, takes a slot of the
+adaptive upstream limiter (see `core.limiter`).
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+from django.conf import settings
+
+from .limiter import LimitExceededError, await_rate, upstream_limiter, wait_for_rate
+from .metrics import stage, upstream_requests
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The circuit of the upstream API is open, the call was not sent."""
+
+
+class MalformedResponseError(httpx.DecodingError):
+    """The upstream answered with a body that cannot be parsed."""
+
+
+class CircuitBreaker:
+    """Consecutive failure counting circuit breaker, shared by the threads and tasks of a worker."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    instances = []
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.changed_at = time.monotonic()
+        self._lock = threading.Lock()
+        CircuitBreaker.instances.append(self)
+
+    @property
+    def failure_threshold(self):
+        return self._failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+
+    @property
+    def reset_timeout(self):
+        return self._reset_timeout or settings.CIRCUIT_RESET_TIMEOUT
+
+    def _set_state(self, state):
+        self.state = state
+        self.changed_at = time.monotonic()
+
+    def allow(self):
+        """Whether a call may be sent now; lets one trial call through once the circuit cools down."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if time.monotonic() - self.changed_at < self.reset_timeout:
+                return False
+            # Open long enough, or a trial call that never reported back.
+            self._set_state(self.HALF_OPEN)
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self._set_state(self.CLOSED)
+
+    def stats(self):
+        """State and consecutive failures of the circuit."""
+        return {'state': self.state, 'failures': self.failures}
+
+
+weather_circuit = CircuitBreaker('weather')
+distance_circuit = CircuitBreaker('distance')
+
+_hedge_executor = ThreadPoolExecutor(thread_name_prefix='upstream-hedge')
+
+
+def _is_failure(ex):
+    """Whether an error tells the upstream is unhealthy, client errors and local queueing do not."""
+    if isinstance(ex, LimitExceededError):
+        return False
+    return not isinstance(ex, httpx.HTTPStatusError) or ex.response.status_code >= 500
+
+
+def _deadline_exceeded(deadline):
+    return httpx.TimeoutException(f"No answer from the upstream within {deadline}s.")
+
+
+def _remaining(started, deadline):
+    return max(0.001, deadline - (time.monotonic() - started))
+
+
+def _send(client, url, timeout):
+    sent = time.monotonic()
+    try:
+        response = client.get(url, timeout=timeout)
+    except httpx.TimeoutException:
+        upstream_limiter.record(time.monotonic() - sent)
+        raise
+    upstream_limiter.record(time.monotonic() - sent, throttled=response.status_code == 429)
+    return response
+
+
+async def _asend(client, url, timeout):
+    sent = time.monotonic()
+    try:
+        response = await client.get(url, timeout=timeout)
+    except httpx.TimeoutException:
+        upstream_limiter.record(time.monotonic() - sent)
+        raise
+    upstream_limiter.record(time.monotonic() - sent, throttled=response.status_code == 429)
+    return response
+
+
+def _get(client, url, deadline):
+    started = time.monotonic()
+    upstream_limiter.acquire(deadline)
+    try:
+        wait_for_rate(_remaining(started, deadline))
+        response = _send(client, url, _remaining(started, deadline))
+    finally:
+        upstream_limiter.release()
+    response.raise_for_status()
+    return response
+
+
+async def _aget(client, url, deadline):
+    started = time.monotonic()
+    await upstream_limiter.aacquire(deadline)
+    try:
+        await await_rate(_remaining(started, deadline))
+        response = await _asend(client, url, _remaining(started, deadline))
+    finally:
+        upstream_limiter.release()
+    response.raise_for_status()
+    return response
+
+
+def _hedge_after(deadline):
+    hedge_after = settings.UPSTREAM_HEDGE_AFTER
+    return hedge_after if hedge_after and hedge_after < deadline else None
+
+
+def _hedged_get(client, url, deadline):
+    hedge_after = _hedge_after(deadline)
+    if hedge_after is None:
+        return _get(client, url, deadline)
+    started = time.monotonic()
+    pending = {_hedge_executor.submit(_get, client, url, deadline)}
+    done, pending = wait(pending, timeout=hedge_after)
+    if not done:
+        pending.add(_hedge_executor.submit(_get, client, url, deadline - hedge_after))
+    error = None
+    while True:
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        remaining = deadline - (time.monotonic() - started)
+        if not pending or remaining <= 0:
+            raise error or _deadline_exceeded(deadline)
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+
+async def _ahedged_get(client, url, deadline):
+    hedge_after = _hedge_after(deadline)
+    started = time.monotonic()
+    pending = {asyncio.ensure_future(_aget(client, url, deadline))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after or deadline)
+        if not done and hedge_after is not None:
+            pending.add(asyncio.ensure_future(_aget(client, url, deadline - hedge_after)))
+        error = None
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            remaining = deadline - (time.monotonic() - started)
+            if not pending or remaining <= 0:
+                raise error or _deadline_exceeded(deadline)
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _parse(response, parse):
+    if parse is None:
+        return response
+    try:
+        return parse(response)
+    except (ValueError, KeyError, TypeError) as ex:
+        raise MalformedResponseError(
+            f"Malformed answer from {response.request.url}: {ex!r}", request=response.request) from ex
+
+
+def _outcome(ex):
+    if isinstance(ex, LimitExceededError):
+        return 'limited'
+    if isinstance(ex, MalformedResponseError):
+        return 'malformed'
+    if isinstance(ex, httpx.TimeoutException):
+        return 'timeout'
+    if isinstance(ex, httpx.HTTPStatusError):
+        return f'{ex.response.status_code // 100}xx'
+    return 'error'
+
+
+def get(client, url, circuit, deadline=None, parse=None):
+    """
+    GET `url` through `circuit` within `deadline` seconds, raising an
+    `httpx.HTTPError` on failure, error status and open circuit included.
+    Returns the response, or `parse(response)` when given, a `ValueError`,
+    `KeyError` or `TypeError` of which is raised as `MalformedResponseError`.
+    """
+    deadline = deadline or settings.UPSTREAM_DEADLINE
+    if not circuit.allow():
+        upstream_requests.inc(api=circuit.name, outcome='circuit_open')
+        raise CircuitOpenError(f"The {circuit.name} circuit is open.")
+    try:
+        with stage(f'upstream_{circuit.name}'):
+            response = _hedged_get(client, url, deadline)
+        result = _parse(response, parse)
+    except httpx.HTTPError as ex:
+        upstream_requests.inc(api=circuit.name, outcome=_outcome(ex))
+        if _is_failure(ex):
+            circuit.record_failure()
+        raise
+    upstream_requests.inc(api=circuit.name, outcome='ok')
+    circuit.record_success()
+    return result
+
+
+async def aget(client, url, circuit, deadline=None, parse=None):
+    """Asynchronous version of `get`."""
+    deadline = deadline or settings.UPSTREAM_DEADLINE
+    if not circuit.allow():
+        upstream_requests.inc(api=circuit.name, outcome='circuit_open')
+        raise CircuitOpenError(f"The {circuit.name} circuit is open.")
+    try:
+        with stage(f'upstream_{circuit.name}'):
+            response = await _ahedged_get(client, url, deadline)
+        result = _parse(response, parse)
+    except httpx.HTTPError as ex:
+        upstream_requests.inc(api=circuit.name, outcome=_outcome(ex))
+        if _is_failure(ex):
+            circuit.record_failure()
+        raise
+    upstream_requests.inc(api=circuit.name, outcome='ok')
+    circuit.record_success()
+    return result
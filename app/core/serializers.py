@@ -11,3 +11,26 @@ class EventSerializer(serializers.ModelSerializer):
     class Meta:
         model = Event
         fields = ['event_name', 'city_name', 'date', 'time', 'latitude', 'longitude',]
+
+
+# Columns read by the list views, with `values()` rather than model instances.
+EVENT_LIST_FIELDS = ('id', 'event_name', 'city_name', 'date', 'latitude', 'longitude')
+
+
+def event_rows(rows):
+    """Copy `values()` rows into dicts with float coordinates for computation."""
+    return [
+        {**row, 'latitude': float(row['latitude']), 'longitude': float(row['longitude'])}
+        for row in rows
+    ]
+
+
+def list_item(event):
+    """Shape an enriched event row into an item of a listing response."""
+    return {
+        'event_name': event['event_name'],
+        'city_name': event['city_name'],
+        'date': event['date'],
+        'weather': event['weather'],
+        'distance_km': event['distance_km'],
+    }
@@ -0,0 +1,31 @@
+"""
+Signals keeping cached listings coherent with event writes.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from collections import Counter
+
+from .cache import adjust_counts, bump_generation
+from .models import Event
+
+
+@receiver(post_save, sender=Event)
+def event_saved(sender, instance, created, **kwargs):
+    """Invalidate the listings of the event's date, and of its old date on update."""
+    old_date = getattr(instance, '_loaded_date', None)
+    bump_generation(*filter(None, [instance.date, old_date]))
+    deltas = Counter()
+    if created or old_date != instance.date:
+        deltas[instance.date] += 1
+        if not created and old_date is not None:
+            deltas[old_date] -= 1
+    adjust_counts(deltas)
+    instance._loaded_date = instance.date
+
+
+@receiver(post_delete, sender=Event)
+def event_deleted(sender, instance, **kwargs):
+    """Invalidate the listings of the deleted event's date."""
+    bump_generation(instance.date)
+    adjust_counts({instance.date: -1})
@@ -0,0 +1,194 @@
+"""
+Request coalescing (single-flight) for expensive computations.
+
+Concurrent calls for the same key wait on one computation and share its
+result: threads of a worker through `SingleFlight`, tasks of an event loop
+through `AsyncSingleFlight`, and workers through a Redis lock taken around
+the computation with a re-check of the cache once it is held.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import stage
+
+
+class _Call:
+    """A computation in flight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key across threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Return `fn()`, running it only once for concurrent callers of `key`."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _LeaderCancelled(Exception):
+    """The task computing a key was cancelled, its followers compute it again."""
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent calls with the same key across tasks of an event loop.
+    The cancellation of the computing task, say at its request's deadline, is
+    its own: a waiting task takes over the computation.
+    """
+
+    def __init__(self):
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, fn):
+        """Return `await fn()`, running it only once for concurrent callers of `key`."""
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        while (future := calls.get(key)) is not None:
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                continue
+        future = calls[key] = loop.create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as ex:
+            future.set_exception(ex)
+            # Mark the exception retrieved, the followers re-raise it themselves.
+            future.exception()
+            raise
+        finally:
+            del calls[key]
+
+
+flight = SingleFlight()
+async_flight = AsyncSingleFlight()
+
+
+def _redis_lock(key):
+    if not settings.SINGLE_FLIGHT_DISTRIBUTED or not hasattr(cache, 'lock'):
+        return None
+    return cache.lock(
+        f'lock:{key}',
+        timeout=settings.SINGLE_FLIGHT_LOCK_TIMEOUT,
+        blocking_timeout=settings.SINGLE_FLIGHT_LOCK_WAIT,
+        thread_local=False,
+    )
+
+
+def _release(lock):
+    try:
+        lock.release()
+    except Exception:
+        # The lock expired while computing; another worker may hold it now.
+        pass
+
+
+@contextmanager
+def distributed_lock(key):
+    """
+    Hold the Redis lock of `key` while computing it. The lock is best effort:
+    without Redis, or when waiting for it times out, the block runs anyway.
+    """
+    lock = _redis_lock(key)
+    acquired = lock is not None and lock.acquire()
+    try:
+        yield
+    finally:
+        if acquired:
+            _release(lock)
+
+
+@asynccontextmanager
+async def adistributed_lock(key):
+    """
+    Asynchronous version of `distributed_lock`, polling without blocking the
+    loop; the Redis calls run in a thread like those of `cache.aget`.
+    """
+    lock = _redis_lock(key)
+    acquired = False
+    if lock is not None:
+        deadline = time.monotonic() + settings.SINGLE_FLIGHT_LOCK_WAIT
+        while not (acquired := await sync_to_async(lock.acquire)(blocking=False)) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    try:
+        yield
+    finally:
+        if acquired:
+            await sync_to_async(_release)(lock)
+
+
+def _is_set(value):
+    return value is not None
+
+
+def cache_get_or_compute(key, compute, timeout, is_valid=_is_set):
+    """
+    Compute and cache the value of `key` after a cache miss, once for all the
+    threads of this worker and, through Redis, for all workers. A cached value
+    failing `is_valid` is recomputed.
+    """
+    def locked():
+        with distributed_lock(key):
+            with stage('cache'):
+                value = cache.get(key)
+            if not is_valid(value):
+                value = compute()
+                with stage('cache'):
+                    cache.set(key, value, timeout)
+            return value
+    return flight.do(key, locked)
+
+
+async def acache_get_or_compute(key, compute, timeout, is_valid=_is_set):
+    """Asynchronous version of `cache_get_or_compute`, `compute` is a coroutine function."""
+    async def locked():
+        async with adistributed_lock(key):
+            with stage('cache'):
+                value = await cache.aget(key)
+            if not is_valid(value):
+                value = await compute()
+                with stage('cache'):
+                    await cache.aset(key, value, timeout)
+            return value
+    return await async_flight.do(key, locked)
@@ -0,0 +1,199 @@
+"""
+In-process columnar snapshot of the events of the listing window.
+
+Every worker keeps the events of the current window in arrays: ids, date
+ordinals and float coordinates, with interned names. Listings are filtered,
+ranked by distance and paginated against it without a database round trip.
+
+A snapshot remembers the generation of every date it was loaded at (see
+`core.cache`). Before use the generations are read again, the dates written
+since are reloaded alone and merged into a new snapshot; a new window, at
+day rollover, is loaded whole. Snapshots are never modified, a refresh swaps
+in a new one, so requests read them without locking.
+"""
+import heapq
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+from django.conf import settings
+
+from .cache import window_generations
+from .distance import haversine_many
+from .geo import RankedRows, sort_keys
+from .models import Event
+
+
+def _load(days=None, start=None, end=None):
+    """Yield the (ordinal, id, latitude, longitude, name, city) records of the given dates, in order."""
+    queryset = Event.objects.filter(date__in=days) if days is not None else Event.objects.filter(
+        date__range=[start, end])
+    rows = queryset.order_by('date', 'id').values_list(
+        'date', 'id', 'latitude', 'longitude', 'event_name', 'city_name')
+    for day, pk, latitude, longitude, name, city in rows.iterator():
+        yield day.toordinal(), pk, float(latitude), float(longitude), sys.intern(name), sys.intern(city)
+
+
+class EventSnapshot:
+    """The events dated in [start, end] as columns ordered on (date, id)."""
+
+    def __init__(self, start, end, generations, records):
+        self.start = start
+        self.end = end
+        self.generations = generations
+        self.loaded_at = time.monotonic()
+        self.dates = array('l')
+        self.ids = array('q')
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.names = []
+        self.cities = []
+        for ordinal, pk, latitude, longitude, name, city in records:
+            self.dates.append(ordinal)
+            self.ids.append(pk)
+            self.latitudes.append(latitude)
+            self.longitudes.append(longitude)
+            self.names.append(name)
+            self.cities.append(city)
+        self._days = {}
+
+    @classmethod
+    def load(cls, start, end, generations):
+        return cls(start, end, generations, _load(start=start, end=end))
+
+    def records(self, exclude=()):
+        """Yield the records of the snapshot, but those of the `exclude` date ordinals."""
+        for index in range(len(self)):
+            if self.dates[index] not in exclude:
+                yield (self.dates[index], self.ids[index], self.latitudes[index], self.longitudes[index],
+                       self.names[index], self.cities[index])
+
+    def refreshed(self, generations):
+        """A snapshot at `generations`, reloading only the dates whose generation changed."""
+        changed = [day for day, generation in generations.items() if self.generations.get(day) != generation]
+        ordinals = {day.toordinal() for day in changed}
+        snapshot = EventSnapshot(
+            self.start, self.end, generations, heapq.merge(self.records(exclude=ordinals), _load(days=changed)))
+        # Age from the last full load, which also picks up writes made without signals.
+        snapshot.loaded_at = self.loaded_at
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _date(self, ordinal):
+        day = self._days.get(ordinal)
+        if day is None:
+            day = self._days[ordinal] = date.fromordinal(ordinal)
+        return day
+
+    def row(self, index):
+        """The event at `index` as a `values()` row of `EVENT_LIST_FIELDS`."""
+        return {
+            'id': self.ids[index],
+            'event_name': self.names[index],
+            'city_name': self.cities[index],
+            'date': self._date(self.dates[index]),
+            'latitude': self.latitudes[index],
+            'longitude': self.longitudes[index],
+        }
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(position) for position in range(*index.indices(len(self)))]
+        return self.row(index)
+
+    def position(self, day, pk):
+        """Index of the first event after (day, pk) in the (date, id) order."""
+        ordinal = day.toordinal()
+        low = bisect_left(self.dates, ordinal)
+        high = bisect_right(self.dates, ordinal, low)
+        return bisect_right(self.ids, pk, low, high)
+
+    def distances(self, latitude, longitude):
+        return haversine_many(latitude, longitude, self.latitudes, self.longitudes)
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """Rows of the events within `radius_km` of a point, in the snapshot's order."""
+        return [
+            self.row(index) for index, distance in enumerate(self.distances(latitude, longitude))
+            if distance <= radius_km
+        ]
+
+    def nearest(self, latitude, longitude, k, max_radius_km=None):
+        """Rows of the `k` events closest to a point within `max_radius_km`, closest first."""
+        candidates = (
+            (distance, self.ids[index], index)
+            for index, distance in enumerate(self.distances(latitude, longitude))
+            if max_radius_km is None or distance <= max_radius_km
+        )
+        return [self.row(index) for _, _, index in heapq.nsmallest(k, candidates)]
+
+    def ranked(self, latitude, longitude, order):
+        """The events ranked for `order` on their distance to a point, see `geo.RankedRows`."""
+        return RankedRows(self, sort_keys(order, self.distances(latitude, longitude), self.ids, self.dates))
+
+    def near_events(self, latitude, longitude, radius_km=None, nearest_k=None):
+        """Apply the optional `radius_km` and `nearest` filters, like `geo.near_events`."""
+        if nearest_k:
+            return self.nearest(latitude, longitude, nearest_k, radius_km)
+        if radius_km:
+            return self.within_radius(latitude, longitude, radius_km)
+        return self
+
+
+class SnapshotStore:
+    """The current snapshot of a worker, refreshed on use."""
+
+    instances = []
+
+    def __init__(self, name):
+        self.name = name
+        self.builds = 0
+        self.refreshes = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+        SnapshotStore.instances.append(self)
+
+    def get(self, start, end):
+        """The snapshot of the [start, end] window, up to date with the generations of its dates."""
+        generations = window_generations(start, end)
+        snapshot = self._snapshot
+        if self._is_current(snapshot, start, end, generations):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if self._is_current(snapshot, start, end, generations):
+                return snapshot
+            if snapshot is None or (snapshot.start, snapshot.end) != (start, end) or self._expired(snapshot):
+                snapshot = EventSnapshot.load(start, end, generations)
+                self.builds += 1
+            else:
+                snapshot = snapshot.refreshed(generations)
+                self.refreshes += 1
+            self._snapshot = snapshot
+            return snapshot
+
+    def _expired(self, snapshot):
+        return time.monotonic() - snapshot.loaded_at > settings.LIST_SNAPSHOT_MAX_AGE
+
+    def _is_current(self, snapshot, start, end, generations):
+        return (
+            snapshot is not None and (snapshot.start, snapshot.end) == (start, end)
+            and snapshot.generations == generations and not self._expired(snapshot)
+        )
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+
+    def stats(self):
+        """Size of the current snapshot and build/refresh counters."""
+        snapshot = self._snapshot
+        return {'events': len(snapshot) if snapshot else 0, 'builds': self.builds, 'refreshes': self.refreshes}
+
+
+snapshots = SnapshotStore('events')
@@ -0,0 +1,62 @@
+"""
+Streaming of enriched event listings as newline delimited JSON.
+
+Events are read from the database in chunks and every chunk is enriched
+with distances and weather as soon as it is read, a few chunks at a time,
+so the first events are sent after one chunk whatever the size of the
+listing and memory stays bounded by the chunks in flight.
+"""
+import asyncio
+from collections import deque
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from .enrichers import EnrichContext, aenrich
+from .renderers import ndjson_line
+from .serializers import event_rows, list_item
+from .upstream import async_client
+
+
+async def _chunks(rows, size):
+    """Group the rows of a queryset, a list or a snapshot into lists of `size` rows."""
+    chunk = []
+    if not isinstance(rows, QuerySet):
+        for start in range(0, len(rows), size):
+            yield rows[start:start + size]
+        return
+    async for row in rows.aiterator(chunk_size=size):
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def _enrich(rows, latitude, longitude, client):
+    events = await aenrich(event_rows(rows), EnrichContext(latitude, longitude, client))
+    return b''.join(ndjson_line(list_item(event)) for event in events)
+
+
+async def stream_events(rows, latitude, longitude, chunk_size=None, max_in_flight=None):
+    """
+    Yield the enriched events of `rows`, a `values()` queryset, list or snapshot, as
+    NDJSON lines in their order.
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    max_in_flight = max_in_flight or settings.STREAM_MAX_IN_FLIGHT
+    pending = deque()
+    try:
+        async with async_client() as client:
+            async for chunk in _chunks(rows, chunk_size):
+                pending.append(asyncio.ensure_future(_enrich(chunk, latitude, longitude, client)))
+                if len(pending) >= max_in_flight:
+                    yield await pending.popleft()
+                while pending and pending[0].done():
+                    yield pending.popleft().result()
+            while pending:
+                yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
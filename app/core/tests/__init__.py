@@ -0,0 +1,37 @@
+"""
+Tests for the core app.
+"""
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+
+from core import weather
+from core.cache import local_listings
+from core.models import Event
+from core.snapshot import snapshots
+
+# Tests swap the Redis cache for this in-process one.
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def reset_caches():
+    """Empty the cache and every in-process cache of the worker, so no test reads another's entries."""
+    cache.clear()
+    local_listings.clear()
+    weather.local_cache.clear()
+    snapshots.clear()
+
+
+def create_events(count, days=1, cities=('Paris',)):
+    """
+    Create `count` events at the same place in Paris from today on, the n-th
+    one dated n % `days` days later in the city n % len(`cities`).
+    """
+    today = datetime.now().date()
+    return [
+        Event.objects.create(
+            event_name=f'Event {index}', city_name=cities[index % len(cities)],
+            date=today + timedelta(days=index % days), time='10:00', latitude=48.85, longitude=2.35,
+        )
+        for index in range(count)
+    ]
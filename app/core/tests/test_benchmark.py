@@ -0,0 +1,103 @@
+"""
+Tests for the benchmark suite.
+"""
+import asyncio
+import json
+import os
+import tempfile
+from io import StringIO
+
+import httpx
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, override_settings
+
+from core.benchmark import generate_events, percentile, run_load, summarize, user_locations
+from core.models import Event
+from core.upstream_stub import UpstreamServer
+from core.tests import LOCMEM_CACHE
+
+
+class BenchmarkHelperTests(SimpleTestCase):
+    """Test the dataset generator and the load statistics."""
+
+    def test_generate_events_reproducible(self):
+        """Test a seed always generates the same events."""
+        first = [(event.city_name, event.date, event.latitude) for event in generate_events(20, seed=3)]
+        second = [(event.city_name, event.date, event.latitude) for event in generate_events(20, seed=3)]
+        other = [(event.city_name, event.date, event.latitude) for event in generate_events(20, seed=4)]
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(user_locations(5, seed=1), user_locations(5, seed=1))
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles."""
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        """Test throughput counts errors and latencies are reported in ms."""
+        result = summarize([0.1, 0.2, 0.3], errors=1, elapsed=2)
+
+        self.assertEqual(result['requests'], 4)
+        self.assertEqual(result['throughput'], 2.0)
+        self.assertEqual(result['p50_ms'], 200.0)
+        self.assertEqual(result['p99_ms'], 300.0)
+
+    def test_stub_injects_errors(self):
+        """Test the upstream stub answers errors at the configured rate."""
+        with UpstreamServer(error_rate=1) as server:
+            res = httpx.get(server.url + '/api/Weather', params={'city': 'Paris', 'date': '2024-04-04'})
+
+        self.assertEqual(res.status_code, 503)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SeedEventsTests(TestCase):
+    """Test the seed_events command."""
+
+    def test_seed(self):
+        """Test the requested number of events is inserted, replacing the old ones with --clear."""
+        call_command('seed_events', count=30, batch_size=7, stdout=StringIO())
+        call_command('seed_events', count=12, clear=True, stdout=StringIO())
+
+        self.assertEqual(Event.objects.count(), 12)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LoadTests(LiveServerTestCase):
+    """Test driving a running server."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_run_load(self):
+        """Test every request is sent and measured."""
+        result = asyncio.run(run_load(self.live_server_url, '/api/event/sync/', 3, 10, user_locations(4)))
+
+        self.assertEqual((result['requests'], result['errors']), (10, 0))
+        self.assertIsNotNone(result['p95_ms'])
+
+    def test_benchmark_command(self):
+        """Test the command reports every run and fails over the thresholds."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            options = {
+                'base_url': self.live_server_url, 'endpoint': ['sync', 'thread'], 'concurrency': [1, 2],
+                'requests': 4, 'warmup': 0, 'output': path, 'stdout': StringIO(),
+            }
+
+            call_command('benchmark', **options)
+            with open(path) as output:
+                results = json.load(output)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', max_p95=0, **options)
+
+        self.assertEqual([(result['endpoint'], result['concurrency']) for result in results],
+                         [('sync', 1), ('sync', 2), ('thread', 1), ('thread', 2)])
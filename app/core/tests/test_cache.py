@@ -0,0 +1,210 @@
+"""
+Tests for generational cache invalidation.
+"""
+import asyncio
+import threading
+import time
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import weather
+from core.cache import (
+    LRUCache,
+    aget_entry_or_revalidate,
+    bump_generation,
+    get_entry_or_revalidate,
+    local_listings,
+    window_generation,
+)
+from core.models import Event
+from core.weather import alookup_weather
+from core.tests import LOCMEM_CACHE, reset_caches
+
+CREATE_URL = reverse('event-create')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class GenerationTests(TestCase):
+    """Test listing invalidation by date generation."""
+
+    def setUp(self):
+        reset_caches()
+        self.start = date(2024, 4, 1)
+        self.end = self.start + timedelta(days=14)
+
+    def test_bump_inside_window(self):
+        """Test writing an event inside the window changes its generation."""
+        before = window_generation(self.start, self.end)
+
+        bump_generation(self.start + timedelta(days=3))
+
+        self.assertNotEqual(window_generation(self.start, self.end), before)
+
+    def test_bump_outside_window(self):
+        """Test writing an event outside the window keeps its generation."""
+        before = window_generation(self.start, self.end)
+
+        bump_generation(self.end + timedelta(days=1), self.start - timedelta(days=1))
+
+        self.assertEqual(window_generation(self.start, self.end), before)
+
+    def test_create_event_keeps_other_entries(self):
+        """Test creating an event does not clear unrelated cache entries."""
+        cache.set('weather:Paris:2024-04-05', 'Sunny 20C')
+        before = window_generation(self.start, self.end)
+        payload = {
+            'event_name': 'Sample Event',
+            'city_name': 'Sample City',
+            'date': '2024-04-05',
+            'time': '10:00:00',
+            'latitude': 40.7128,
+            'longitude': -74.0060,
+        }
+
+        res = APIClient().post(CREATE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(cache.get('weather:Paris:2024-04-05'), 'Sunny 20C')
+        self.assertNotEqual(window_generation(self.start, self.end), before)
+
+    def test_update_invalidates_old_and_new_date(self):
+        """Test moving an event invalidates both its old and new dates."""
+        event = Event.objects.create(
+            event_name='Moving', city_name='City', date=self.start, time='10:00',
+            latitude=0, longitude=0,
+        )
+        event = Event.objects.get(pk=event.pk)
+        old_window = window_generation(self.start, self.start)
+        new_day = self.end + timedelta(days=30)
+        new_window = window_generation(new_day, new_day)
+
+        event.date = new_day
+        event.save()
+
+        self.assertNotEqual(window_generation(self.start, self.start), old_window)
+        self.assertNotEqual(window_generation(new_day, new_day), new_window)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, LIST_CACHE_SOFT_TTL=60, LIST_CACHE_HARD_TTL=120)
+class StaleWhileRevalidateTests(TestCase):
+    """Test serving stale listings while they are refreshed."""
+
+    def setUp(self):
+        reset_caches()
+
+    def test_miss_computes(self):
+        """Test a missing listing is computed by the request."""
+        self.assertEqual(get_entry_or_revalidate('key', lambda: 'fresh')['data'], 'fresh')
+        self.assertEqual(get_entry_or_revalidate('key', lambda: 'recomputed')['data'], 'fresh')
+
+    def test_stale_is_served_and_refreshed(self):
+        """Test a stale listing is returned while a thread refreshes it."""
+        cache.set('key', {'data': 'stale', 'fresh_until': time.time() - 1})
+        refreshed = threading.Event()
+
+        def compute():
+            refreshed.set()
+            return 'fresh'
+
+        self.assertEqual(get_entry_or_revalidate('key', compute)['data'], 'stale')
+        self.assertTrue(refreshed.wait(5))
+        for _ in range(50):
+            if cache.get('key')['data'] == 'fresh':
+                break
+            time.sleep(0.01)
+        self.assertEqual(get_entry_or_revalidate('key', lambda: 'recomputed')['data'], 'fresh')
+
+    def test_async_stale_is_served_and_refreshed(self):
+        """Test the asynchronous version refreshes stale listings too."""
+        cache.set('key', {'data': 'stale', 'fresh_until': time.time() - 1})
+        refreshed = threading.Event()
+
+        async def compute():
+            refreshed.set()
+            return 'fresh'
+
+        self.assertEqual(asyncio.run(aget_entry_or_revalidate('key', compute))['data'], 'stale')
+        self.assertTrue(refreshed.wait(5))
+
+    def test_async_cache_io_off_the_loop(self):
+        """Test the asynchronous path reads and writes the cache outside of the event loop."""
+        on_loop = []
+
+        def track(method):
+            def wrapper(*args, **kwargs):
+                on_loop.append(asyncio._get_running_loop() is not None)
+                return method(*args, **kwargs)
+            return wrapper
+
+        async def compute():
+            found = await alookup_weather([('Paris', '2024-04-04')], None)
+            return {'events': [{'city_name': 'Paris', 'weather': found[('Paris', '2024-04-04')]}]}
+
+        weather.store_weather('Paris', '2024-04-04', 'Sunny 20C')
+        weather.local_cache.clear()
+        with patch.object(LocMemCache, 'get', track(LocMemCache.get)), \
+                patch.object(LocMemCache, 'get_many', track(LocMemCache.get_many)), \
+                patch.object(LocMemCache, 'set', track(LocMemCache.set)):
+            asyncio.run(aget_entry_or_revalidate('key', compute))
+
+        self.assertTrue(on_loop)
+        self.assertFalse(any(on_loop))
+
+    @override_settings(LIST_CACHE_SOFT_TTL=900, LIST_CACHE_DEGRADED_TTL=30)
+    def test_degraded_goes_stale_sooner(self):
+        """Test a listing missing weather is kept fresh for the degraded TTL only."""
+        get_entry_or_revalidate('key', lambda: {'events': [{'weather': None}]})
+
+        self.assertLess(cache.get('key')['fresh_until'], time.time() + 31)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, LIST_CACHE_SOFT_TTL=60, LIST_CACHE_HARD_TTL=120)
+class LocalTierTests(SimpleTestCase):
+    """Test the in-process tier in front of Redis."""
+
+    def setUp(self):
+        reset_caches()
+
+    def test_local_hit_skips_redis(self):
+        """Test a listing read once is served from the worker's memory."""
+        get_entry_or_revalidate('key', lambda: 'fresh')
+        cache.delete('key')
+
+        self.assertEqual(get_entry_or_revalidate('key', lambda: 'recomputed')['data'], 'fresh')
+
+    def test_redis_hit_fills_local_tier(self):
+        """Test a listing computed by another worker is kept locally."""
+        cache.set('key', {'data': 'from redis', 'fresh_until': time.time() + 60})
+
+        self.assertEqual(get_entry_or_revalidate('key', lambda: 'recomputed')['data'], 'from redis')
+        self.assertEqual(local_listings.get('key')['data'], 'from redis')
+
+
+class LRUCacheTests(SimpleTestCase):
+    """Test the bounded in-process cache."""
+
+    def test_evicts_least_recently_used(self):
+        """Test the oldest unused entry is evicted when full."""
+        lru = LRUCache('test', max_entries=2, timeout=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(lru.stats(), {'entries': 2, 'hits': 3, 'misses': 1})
+
+    def test_expires(self):
+        """Test entries older than the timeout are dropped."""
+        lru = LRUCache('test', max_entries=2, timeout=0)
+        lru.set('a', 1)
+
+        self.assertIsNone(lru.get('a'))
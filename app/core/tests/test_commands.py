@@ -1,8 +1,16 @@
+from datetime import datetime, timedelta
+from io import StringIO
 from unittest.mock import patch
 from psycopg2 import OperationalError as Psycopg2Error
+from django.core.cache import cache
 from django.core.management import call_command
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core import weather
+from core.cache import count_key, window_generation
+from core.models import ArchivedEvent, Event
+from core.tests import LOCMEM_CACHE, reset_caches
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -28,3 +36,90 @@ class CommandTests (SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PrefetchWeatherTests(TestCase):
+    """Test the weather prefetcher."""
+
+    def setUp(self):
+        reset_caches()
+        today = datetime.now().date()
+        for days, city in [(1, 'Paris'), (1, 'Paris'), (2, 'Paris'), (3, 'Rome'), (30, 'Oslo')]:
+            Event.objects.create(
+                event_name='Event', city_name=city, date=today + timedelta(days=days),
+                time='10:00', latitude=0, longitude=0,
+            )
+        self.today = today
+
+    def test_prefetch_window(self):
+        """Test every (city, date) of the window is fetched once and cached."""
+        async def fake_fetch(client, city, date):
+            return f'Sunny in {city}'
+
+        with patch('core.management.commands.prefetch_weather.afetch_weather', side_effect=fake_fetch) as fetch:
+            call_command('prefetch_weather', '--once', stdout=StringIO())
+
+        self.assertEqual(fetch.call_count, 3)
+        day = str(self.today + timedelta(days=3))
+        self.assertEqual(cache.get(weather.weather_key('Rome', day)), 'Sunny in Rome')
+
+    def test_cached_pairs_are_skipped(self):
+        """Test weather already in the cache is not fetched again."""
+        for days, city in [(1, 'Paris'), (2, 'Paris'), (3, 'Rome')]:
+            weather.store_weather(city, str(self.today + timedelta(days=days)), 'Cloudy')
+
+        with patch('core.management.commands.prefetch_weather.afetch_weather') as fetch:
+            call_command('prefetch_weather', '--once', stdout=StringIO())
+
+        fetch.assert_not_called()
+
+    def test_failures_are_reported(self):
+        """Test a failing pair does not stop the others."""
+        async def fake_fetch(client, city, date):
+            if city == 'Rome':
+                raise ValueError('boom')
+            return 'Sunny'
+        out = StringIO()
+
+        with patch('core.management.commands.prefetch_weather.afetch_weather', side_effect=fake_fetch):
+            call_command('prefetch_weather', '--once', stdout=out, stderr=StringIO())
+
+        self.assertIn('2 (city, date) pairs, 1 failed', out.getvalue())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ArchiveEventsTests(TestCase):
+    """Test archiving past events."""
+
+    def test_archive_past_events(self):
+        """Test events before the retention window move to the archive."""
+        today = datetime.now().date()
+        for days in [-30, -10, -2, 0, 3]:
+            Event.objects.create(
+                event_name=f'Event {days}', city_name='City', date=today + timedelta(days=days),
+                time='10:00', latitude='1.5', longitude='2.5',
+            )
+        old = Event.objects.get(event_name='Event -30')
+
+        call_command('archive_events', '--days', '1', '--batch-size', '2', stdout=StringIO())
+
+        self.assertEqual(
+            sorted(Event.objects.values_list('event_name', flat=True)), ['Event 0', 'Event 3'])
+        self.assertEqual(ArchivedEvent.objects.count(), 3)
+        archived = ArchivedEvent.objects.get(pk=old.pk)
+        self.assertEqual((archived.event_name, archived.date), (old.event_name, old.date))
+        self.assertEqual(archived.latitude, old.latitude)
+
+    def test_archive_invalidates_dates(self):
+        """Test the archived dates get new generations and lose their counters."""
+        day = datetime.now().date() - timedelta(days=30)
+        Event.objects.create(
+            event_name='Old', city_name='City', date=day, time='10:00', latitude='1.5', longitude='2.5')
+        cache.set(count_key(day), 1)
+        generation = window_generation(day, day)
+
+        call_command('archive_events', '--days', '1', stdout=StringIO())
+
+        self.assertNotEqual(window_generation(day, day), generation)
+        self.assertIsNone(cache.get(count_key(day)))
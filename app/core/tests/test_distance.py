@@ -0,0 +1,58 @@
+"""
+Tests for the local distance engine.
+"""
+from django.test import SimpleTestCase
+
+from core.distance import haversine, haversine_many, verify_distance
+from core.enrichers import DistanceEnricher, EnrichContext, enrich
+
+
+class DistanceTests(SimpleTestCase):
+    """Test haversine distances."""
+
+    def test_same_point_is_zero(self):
+        """Test the distance from a point to itself is zero."""
+        self.assertAlmostEqual(haversine(23.3232, -65.42342, 23.3232, -65.42342), 0.0)
+
+    def test_known_distance(self):
+        """Test the distance between London and Paris."""
+        distance = haversine(51.5074, -0.1278, 48.8566, 2.3522)
+
+        self.assertAlmostEqual(distance, 343.5, delta=1.0)
+
+    def test_antipodes(self):
+        """Test antipodal points are half the circumference apart."""
+        distance = haversine(0, 0, 0, 180)
+
+        self.assertAlmostEqual(distance, 20015.1, delta=1.0)
+
+    def test_many_matches_single(self):
+        """Test the batched pass matches point by point distances."""
+        latitudes = ['40.712800000000000', '-33.8688', 35.6762]
+        longitudes = ['-74.006000000000000', '151.2093', 139.6503]
+
+        distances = haversine_many(51.5074, -0.1278, latitudes, longitudes)
+
+        self.assertEqual(len(distances), 3)
+        for distance, lat, lon in zip(distances, latitudes, longitudes):
+            self.assertAlmostEqual(distance, haversine(51.5074, -0.1278, lat, lon))
+
+    def test_enricher(self):
+        """Test the distance enricher sets distances on serialized events."""
+        events = [
+            {'event_name': 'A', 'latitude': '48.8566', 'longitude': '2.3522'},
+            {'event_name': 'B', 'latitude': '51.5074', 'longitude': '-0.1278'},
+        ]
+
+        enrich(events, EnrichContext(51.5074, -0.1278, None), [DistanceEnricher()])
+
+        self.assertAlmostEqual(events[0]['distance_km'], 343.5, delta=1.0)
+        self.assertAlmostEqual(events[1]['distance_km'], 0.0)
+
+    def test_verify_distance(self):
+        """Test remote distances are checked against the local ones."""
+        event = {'event_name': 'A', 'distance_km': 343.5}
+
+        with self.assertLogs('core.distance', level='WARNING'):
+            self.assertFalse(verify_distance(event, "350.1", 1.0))
+        self.assertTrue(verify_distance(event, "343.9", 1.0))
@@ -0,0 +1,181 @@
+"""
+Tests for the enricher pipeline.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.test import SimpleTestCase, override_settings
+
+from core.enrichers import (
+    DistanceCheckEnricher,
+    DistanceEnricher,
+    EnrichContext,
+    Enricher,
+    WeatherEnricher,
+    aenrich,
+    enrich,
+)
+from core.upstream_stub import UpstreamServer
+from core.tests import LOCMEM_CACHE, reset_caches
+
+
+class SlowEnricher(Enricher):
+    """Enricher answering after `delay` seconds."""
+    default = 'late'
+
+    def __init__(self, field, delay):
+        self.field = field
+        self.delay = delay
+
+    def enrich(self, events, context):
+        time.sleep(self.delay)
+        return [self.field] * len(events)
+
+    async def aenrich(self, events, context):
+        await asyncio.sleep(self.delay)
+        return [self.field] * len(events)
+
+
+class FailingEnricher(Enricher):
+    """Enricher raising an error."""
+    field = 'failing'
+
+    def enrich(self, events, context):
+        raise ValueError("Broken")
+
+
+class CancelledEnricher(Enricher):
+    """Asynchronous enricher whose task ends cancelled."""
+    field = 'cancelled'
+
+    async def aenrich(self, events, context):
+        raise asyncio.CancelledError()
+
+
+def make_events():
+    """Two events around London."""
+    return [
+        {'event_name': 'One', 'latitude': 51.5074, 'longitude': -0.1278},
+        {'event_name': 'Two', 'latitude': 48.8566, 'longitude': 2.3522},
+    ]
+
+
+@override_settings(ENRICH_DEADLINE=0.5)
+class EnrichTests(SimpleTestCase):
+    """Test running enrichers."""
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_sequential(self):
+        """Test enrichers set their fields one after the other without an executor."""
+        events = enrich(make_events(), EnrichContext(51.5074, -0.1278, None), [DistanceEnricher()])
+
+        self.assertAlmostEqual(events[0]['distance_km'], 0.0)
+        self.assertAlmostEqual(events[1]['distance_km'], 343.5, delta=1)
+
+    def test_concurrent(self):
+        """Test enrichers run concurrently with an executor."""
+        started = time.monotonic()
+
+        events = enrich(
+            make_events(), EnrichContext(0, 0, None, self.executor),
+            [SlowEnricher('a', 0.2), SlowEnricher('b', 0.2)])
+
+        self.assertLess(time.monotonic() - started, 0.35)
+        self.assertEqual((events[0]['a'], events[0]['b']), ('a', 'b'))
+
+    def test_deadline_and_failure(self):
+        """Test late and failing enrichers leave their default."""
+        events = enrich(
+            make_events(), EnrichContext(0, 0, None, self.executor),
+            [SlowEnricher('fast', 0), SlowEnricher('slow', 2), FailingEnricher()])
+
+        self.assertEqual(events[0]['fast'], 'fast')
+        self.assertEqual(events[0]['slow'], 'late')
+        self.assertIsNone(events[0]['failing'])
+
+    def test_sequential_failure(self):
+        """Test a failing enricher leaves its default without an executor too."""
+        events = enrich(
+            make_events(), EnrichContext(51.5074, -0.1278, None), [FailingEnricher(), DistanceEnricher()])
+
+        self.assertIsNone(events[0]['failing'])
+        self.assertAlmostEqual(events[0]['distance_km'], 0.0)
+
+    def test_async(self):
+        """Test asynchronous enrichers run concurrently under the deadline."""
+        started = time.monotonic()
+
+        events = asyncio.run(aenrich(
+            make_events(), EnrichContext(0, 0, None),
+            [SlowEnricher('a', 0.2), SlowEnricher('b', 0.2), SlowEnricher('slow', 2)]))
+
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual((events[1]['a'], events[1]['b'], events[1]['slow']), ('a', 'b', 'late'))
+
+    def test_async_cancelled(self):
+        """Test an enricher whose task is cancelled leaves its default."""
+        events = asyncio.run(aenrich(
+            make_events(), EnrichContext(0, 0, None), [CancelledEnricher(), SlowEnricher('a', 0)]))
+
+        self.assertIsNone(events[0]['cancelled'])
+        self.assertEqual(events[0]['a'], 'a')
+
+
+class DistanceCheckTests(SimpleTestCase):
+    """Test checking distances against the remote API."""
+
+    def setUp(self):
+        self.server = UpstreamServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def test_check(self):
+        """Test one remote call per event, without setting any field."""
+        with override_settings(DISTANCE_VERIFY_REMOTE=True, UPSTREAM_BASE_URL=self.server.url), \
+                httpx.Client() as client:
+            events = enrich(make_events(), EnrichContext(51.5, -0.12, client), [DistanceCheckEnricher()])
+
+        self.assertEqual(self.server.requests, 2)
+        self.assertNotIn('distance_km', events[0])
+
+    def test_disabled(self):
+        """Test no remote call is made unless enabled."""
+        with override_settings(DISTANCE_VERIFY_REMOTE=False):
+            asyncio.run(aenrich(make_events(), EnrichContext(51.5, -0.12, None), [DistanceCheckEnricher()]))
+
+        self.assertEqual(self.server.requests, 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, ENRICH_DEADLINE=2)
+class WeatherEnricherTests(SimpleTestCase):
+    """Test the weather enricher."""
+
+    def setUp(self):
+        reset_caches()
+        self.server = UpstreamServer(delay=0.2).__enter__()
+        self.addCleanup(self.server.__exit__)
+        settings = override_settings(UPSTREAM_BASE_URL=self.server.url, UPSTREAM_HTTP2=False, UPSTREAM_HEDGE_AFTER=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_cancelled_request_leaves_others_their_weather(self):
+        """Test a request cancelled while fetching a city's weather does not fail another waiting on it."""
+        events = [{'city_name': 'Paris', 'date': '2024-04-04'}]
+
+        async def run():
+            async with httpx.AsyncClient() as client:
+                context = EnrichContext(0, 0, client)
+                first = asyncio.ensure_future(
+                    asyncio.wait_for(WeatherEnricher().aenrich(events, context), timeout=0.05))
+                await asyncio.sleep(0.01)
+                second = await aenrich([dict(event) for event in events], context, [WeatherEnricher()])
+                return await asyncio.gather(first, return_exceptions=True), second
+
+        (first,), second = asyncio.run(run())
+
+        self.assertIsInstance(first, asyncio.TimeoutError)
+        self.assertEqual(second[0]['weather'], 'Sunny in Paris')
@@ -0,0 +1,174 @@
+"""
+Tests for the spatial index and near me queries.
+"""
+from decimal import Decimal
+from datetime import date, time
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core import geo
+from core.models import Event
+from core.tests import LOCMEM_CACHE
+
+
+def create_event(name, latitude, longitude):
+    """Create and return an event at the given coordinates."""
+    return Event.objects.create(
+        event_name=name,
+        city_name="Test City",
+        date=date(2024, 4, 4),
+        time=time(15, 30),
+        latitude=Decimal(str(latitude)),
+        longitude=Decimal(str(longitude)),
+    )
+
+
+def rows():
+    """Return the events as the `values()` rows the list views query."""
+    return Event.objects.values('id', 'latitude', 'longitude')
+
+
+def ids(events):
+    """Return the ids of event rows."""
+    return [event['id'] for event in events]
+
+
+class GridTests(SimpleTestCase):
+    """Test grid cells and bounding boxes."""
+
+    def test_geo_cell_bounds(self):
+        """Test the corners of the world map to the first and last cells."""
+        self.assertEqual(geo.geo_cell(-90, -180), 0)
+        self.assertEqual(geo.geo_cell(90, 180), (geo.ROWS - 1) * geo.COLUMNS)
+        self.assertEqual(geo.geo_cell(89.9, 179.9), geo.ROWS * geo.COLUMNS - 1)
+
+    def test_bounding_box_contains_circle(self):
+        """Test the bounding box is wide enough for the radius."""
+        [(min_lat, max_lat, min_lon, max_lon)] = geo.bounding_boxes(45, 10, 100)
+
+        self.assertAlmostEqual(max_lat - 45, 100 / 111.195, places=2)
+        self.assertGreater(max_lon - 10, max_lat - 45)
+        self.assertAlmostEqual(min_lat + max_lat, 90)
+        self.assertAlmostEqual(min_lon + max_lon, 20)
+
+    def test_bounding_box_antimeridian(self):
+        """Test a circle crossing the antimeridian is split in two boxes."""
+        boxes = geo.bounding_boxes(0, 179.9, 100)
+
+        self.assertEqual(len(boxes), 2)
+        self.assertEqual(boxes[0][3], 180.0)
+        self.assertEqual(boxes[1][2], -180.0)
+
+    def test_bounding_box_pole(self):
+        """Test a circle containing a pole spans every longitude."""
+        [(min_lat, max_lat, min_lon, max_lon)] = geo.bounding_boxes(89.5, 0, 100)
+
+        self.assertEqual((max_lat, min_lon, max_lon), (90.0, -180.0, 180.0))
+
+
+class BucketTests(SimpleTestCase):
+    """Test location buckets."""
+
+    def test_geohash(self):
+        """Test geohashes match the reference encoding and decode to their cell."""
+        self.assertEqual(geo.geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        latitude, longitude = geo.geohash_center('u4pruydqqvj')
+
+        self.assertAlmostEqual(latitude, 57.64911, places=4)
+        self.assertAlmostEqual(longitude, 10.40744, places=4)
+
+    def test_geohash_bucket_shared(self):
+        """Test nearby coordinates share a bucket whose centre is close to both."""
+        key, latitude, longitude = geo.geohash_bucket(Decimal('23.3232'), Decimal('85.3094'), 6)
+
+        self.assertEqual(geo.geohash_bucket(Decimal('23.32321'), Decimal('85.30941'), 6)[0], key)
+        self.assertLess(geo.haversine_many(latitude, longitude, [23.3232], [85.3094])[0], 0.7)
+
+    def test_grid_bucket(self):
+        """Test grid buckets are centred in their cell, across the antimeridian too."""
+        key, latitude, longitude = geo.grid_bucket(48.853, 2.349, 0.01)
+
+        self.assertEqual(geo.grid_bucket(48.859, 2.341, 0.01)[0], key)
+        self.assertAlmostEqual(latitude, 48.855)
+        self.assertAlmostEqual(longitude, 2.345)
+        self.assertAlmostEqual(geo.grid_bucket(0, 179.999, 0.01)[2], 179.995)
+
+
+class RankedRowsTests(SimpleTestCase):
+    """Test ranking rows with partial sorts."""
+
+    def setUp(self):
+        self.rows = [
+            {'id': index, 'date': date(2024, 4, 1 + index % 3), 'latitude': index * 7 % 11, 'longitude': 0}
+            for index in range(30)
+        ]
+
+    def test_slices_follow_the_full_sort(self):
+        """Test every slice matches the same slice of the fully sorted rows."""
+        ranked = geo.rank_rows(self.rows, 0, 0, 'distance')
+        expected = sorted(self.rows, key=lambda row: (row['latitude'], row['id']))
+
+        self.assertEqual(len(ranked), 30)
+        self.assertEqual(ranked[10:20], expected[10:20])
+        self.assertEqual(ranked[0:5], expected[0:5])
+        self.assertEqual(ranked[25:40], expected[25:])
+        self.assertEqual(ranked[-1], expected[-1])
+
+    def test_date_then_distance(self):
+        """Test `date,distance` ranks by distance within each date."""
+        ranked = geo.rank_rows(self.rows, 0, 0, 'date,distance')
+
+        self.assertEqual(ranked[:], sorted(self.rows, key=lambda row: (row['date'], row['latitude'], row['id'])))
+
+    def test_only_selects_the_prefix(self):
+        """Test a page selects the keys up to its end, not the whole window."""
+        ranked = geo.rank_rows(self.rows, 0, 0, 'distance')
+        ranked[0:10]
+
+        self.assertEqual(len(ranked._ranked), 10)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class NearQueryTests(TestCase):
+    """Test radius and k nearest queries."""
+
+    def setUp(self):
+        self.paris = create_event("Paris", 48.8566, 2.3522)
+        self.versailles = create_event("Versailles", 48.8049, 2.1204)
+        self.london = create_event("London", 51.5074, -0.1278)
+        self.fiji = create_event("Fiji", -17.7134, 178.0650)
+        self.samoa = create_event("Samoa", -13.7590, -172.1046)
+
+    def test_geo_cell_saved(self):
+        """Test the grid cell is stored when saving an event."""
+        self.assertEqual(self.paris.geo_cell, geo.geo_cell(48.8566, 2.3522))
+
+    def test_within_radius(self):
+        """Test only the events inside the radius are returned."""
+        events = geo.within_radius(rows(), 48.85, 2.35, 50)
+
+        self.assertCountEqual(ids(events), [self.paris.id, self.versailles.id])
+
+    def test_within_radius_across_antimeridian(self):
+        """Test radius queries crossing the antimeridian."""
+        events = geo.within_radius(rows(), -15.5, 179.9, 1200)
+
+        self.assertCountEqual(ids(events), [self.fiji.id, self.samoa.id])
+
+    def test_nearest(self):
+        """Test the k nearest events are returned closest first."""
+        events = geo.nearest(rows(), 51.0, 0.0, 3)
+
+        self.assertEqual(ids(events), [self.london.id, self.versailles.id, self.paris.id])
+
+    def test_nearest_expands_to_whole_world(self):
+        """Test nearest keeps searching until it has k events."""
+        events = geo.nearest(rows(), 0.0, 0.0, 10)
+
+        self.assertEqual(len(events), 5)
+
+    def test_near_events_without_filters(self):
+        """Test the queryset is untouched without radius and nearest."""
+        queryset = rows()
+
+        self.assertIs(geo.near_events(queryset, 0, 0), queryset)
@@ -0,0 +1,200 @@
+"""
+Tests for bulk ingestion.
+"""
+import os
+import tempfile
+from datetime import date
+from io import BytesIO, StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import geo
+from core.cache import count_key, window_count, window_generation
+from core.ingest import IngestError, ingest, iter_json_array, iter_ndjson
+from core.models import Event
+from core.tests import LOCMEM_CACHE
+
+BULK_URL = reverse('event-bulk-create')
+
+
+def record(name, day=4, latitude='48.8566', longitude='2.3522'):
+    """Return an event record of the feed."""
+    return {
+        'event_name': name,
+        'city_name': 'Paris',
+        'date': f'2024-04-0{day}',
+        'time': '10:00:00',
+        'latitude': latitude,
+        'longitude': longitude,
+    }
+
+
+class ParserTests(SimpleTestCase):
+    """Test the streaming feed parsers."""
+
+    def test_json_array_across_chunks(self):
+        """Test items cut by chunk boundaries are decoded whole."""
+        feed = b' [ {"a": "x,]"} , {"b": [1, 2]},3 ] '
+
+        items = list(iter_json_array(BytesIO(feed), chunk_size=4))
+
+        self.assertEqual(items, [{'a': 'x,]'}, {'b': [1, 2]}, 3])
+
+    def test_json_array_empty(self):
+        """Test an empty array has no items."""
+        self.assertEqual(list(iter_json_array(BytesIO(b'[]'))), [])
+
+    def test_json_array_invalid(self):
+        """Test a truncated or non array feed raises."""
+        for feed in [b'{"a": 1}', b'[{"a": 1}', b'[{"a": 1} {"b": 2}]', b'[1] 2']:
+            with self.assertRaises(IngestError):
+                list(iter_json_array(BytesIO(feed), chunk_size=3))
+
+    def test_ndjson(self):
+        """Test NDJSON lines are decoded, malformed lines yield an error."""
+        feed = b'{"a": 1}\n\n{"a": \n{"b": 2}'
+
+        items = list(iter_ndjson(BytesIO(feed), chunk_size=5))
+
+        self.assertEqual(items[0], {'a': 1})
+        self.assertIsInstance(items[1], IngestError)
+        self.assertEqual(items[2], {'b': 2})
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class IngestTests(TestCase):
+    """Test validating and inserting feeds."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ingest(self):
+        """Test valid rows are inserted in batches and invalid ones reported."""
+        records = [record('One'), record('Two', day=5), {'event_name': 'Bad'}, 'text', record('Three')]
+
+        result = ingest(records, batch_size=2)
+
+        self.assertEqual(result['created'], 3)
+        self.assertEqual(result['failed'], 2)
+        self.assertEqual([error['row'] for error in result['errors']], [3, 4])
+        self.assertIn('city_name', result['errors'][0]['errors'])
+        event = Event.objects.get(event_name='One')
+        self.assertEqual(event.geo_cell, geo.geo_cell(event.latitude, event.longitude))
+
+    def test_ingest_invalidates_listings(self):
+        """Test a batch bumps the generations and counters of its dates."""
+        start, end = date(2024, 4, 1), date(2024, 4, 14)
+        generation = window_generation(start, end)
+        self.assertEqual(window_count(start, end), 0)
+
+        ingest([record('One'), record('Two')])
+
+        self.assertNotEqual(window_generation(start, end), generation)
+        self.assertEqual(cache.get(count_key(date(2024, 4, 4))), 2)
+
+    def test_ingest_stops_on_parse_error(self):
+        """Test the rows before a parse error are kept."""
+        result = ingest(iter_json_array(BytesIO(b'[{"event_name": "x"}, {"a" 1}]')))
+
+        self.assertEqual(result['failed'], 1)
+        self.assertIsNotNone(result['error'])
+
+    def test_max_errors(self):
+        """Test only the first errors are reported."""
+        result = ingest([{}] * 5, max_errors=2)
+
+        self.assertEqual(result['failed'], 5)
+        self.assertEqual(len(result['errors']), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class BulkCreateApiTests(TestCase):
+    """Test the bulk create endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_bulk_create_ndjson(self):
+        """Test creating events from an NDJSON body."""
+        body = '{"event_name": "One", "city_name": "Paris", "date": "2024-04-04", "time": "10:00", "latitude": 1, "longitude": 2}\n[]\n'
+
+        res = self.client.post(BULK_URL, body, content_type='application/x-ndjson')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.json()['created'], 1)
+        self.assertEqual(res.json()['errors'][0]['row'], 2)
+        self.assertFalse(res.json()['success'])
+
+    def test_bulk_create_json(self):
+        """Test creating events from a JSON array body."""
+        res = self.client.post(BULK_URL, [record('One'), record('Two')], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(res.json()['success'])
+        self.assertEqual(Event.objects.count(), 2)
+
+    def test_bulk_create_csv(self):
+        """Test creating events from a CSV body."""
+        body = (
+            'event_name,city_name,date,time,latitude,longitude\r\n'
+            'One,Paris,2024-04-04,10:00,48.8566,2.3522\r\n'
+            '"Two, again",Paris,2024-04-05,10:00,48.8566,2.3522\r\n'
+        )
+
+        res = self.client.post(BULK_URL, body.encode('utf-8-sig'), content_type='text/csv')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(res.json()['success'])
+        self.assertEqual(res.json()['created'], 2)
+        self.assertEqual(Event.objects.get(date='2024-04-05').event_name, 'Two, again')
+
+    def test_bulk_create_unsupported_type(self):
+        """Test other content types are rejected."""
+        res = self.client.post(BULK_URL, 'a', content_type='text/plain')
+
+        self.assertEqual(res.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ImportEventsCommandTests(TestCase):
+    """Test the import_events command."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'events.csv')
+
+    def write_csv(self, rows):
+        """Write a CSV feed with a header line."""
+        with open(self.path, 'w', newline='') as feed:
+            feed.write('event_name,city_name,date,time,latitude,longitude\n')
+            feed.writelines(f'{row}\n' for row in rows)
+
+    def test_import_csv(self):
+        """Test importing a CSV feed."""
+        self.write_csv(['One,Paris,2024-04-04,10:00,48.85,2.35', 'Two,Rome,2024-04-05,11:00,41.9,12.5'])
+        out = StringIO()
+
+        call_command('import_events', self.path, stdout=out)
+
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertIn('imported 2 events', out.getvalue())
+
+    def test_import_csv_with_errors(self):
+        """Test failed rows are reported and make the command fail."""
+        self.write_csv(['One,Paris,2024-04-04,10:00,48.85,2.35', 'Two,Rome,not a date,11:00,41.9,12.5'])
+        err = StringIO()
+
+        with self.assertRaises(CommandError):
+            call_command('import_events', self.path, stdout=StringIO(), stderr=err)
+
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertIn('row 2', err.getvalue())
@@ -0,0 +1,139 @@
+"""
+Tests for the adaptive upstream limiter.
+"""
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, override_settings
+
+from core.limiter import AdaptiveLimiter, LimitExceededError, await_rate, wait_for_rate
+from core.tests import LOCMEM_CACHE
+
+
+def make_limiter(initial=2):
+    """Return a limiter adapting between 1 and 10 slots."""
+    return AdaptiveLimiter('test', initial=initial, minimum=1, maximum=10, latency_target=0.5)
+
+
+class AdaptiveLimiterTests(SimpleTestCase):
+    """Test limiting and adapting the calls in flight."""
+
+    def test_limits_threads(self):
+        """Test threads over the limit queue up."""
+        limiter = make_limiter()
+        lock = threading.Lock()
+        running = []
+
+        def call():
+            limiter.acquire(5)
+            with lock:
+                running.append(limiter.in_flight)
+            time.sleep(0.02)
+            limiter.release()
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(running), 2)
+        self.assertGreater(limiter.stats()['max_waiting'], 0)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_limits_tasks(self):
+        """Test tasks over the limit queue up."""
+        limiter = make_limiter(initial=1)
+        running = []
+
+        async def call():
+            await limiter.aacquire(5)
+            running.append(limiter.in_flight)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        async def main():
+            await asyncio.gather(*(call() for _ in range(4)))
+
+        asyncio.run(main())
+
+        self.assertEqual(running, [1, 1, 1, 1])
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_timeout(self):
+        """Test waiting for a slot stops at the timeout."""
+        limiter = make_limiter(initial=1)
+        limiter.acquire(1)
+
+        with self.assertRaises(LimitExceededError):
+            limiter.acquire(0.05)
+        with self.assertRaises(LimitExceededError):
+            asyncio.run(limiter.aacquire(0.05))
+
+        self.assertEqual(limiter.stats()['timeouts'], 2)
+        self.assertEqual(limiter.waiting, 0)
+
+    def test_adapts(self):
+        """Test the limit grows on fast calls and is cut on 429s, once per interval."""
+        limiter = make_limiter(initial=4)
+        for _ in range(4):
+            limiter.record(0.01)
+        self.assertEqual(limiter.stats()['limit'], 4)
+        self.assertGreater(limiter.limit, 4.9)
+
+        limiter.record(0.01, throttled=True)
+        limiter.record(0.01, throttled=True)
+
+        self.assertEqual(limiter.stats()['limit'], 2)
+        self.assertEqual(limiter.stats()['throttled'], 2)
+
+    def test_slow_calls_decrease(self):
+        """Test calls slower than the target cut the limit."""
+        limiter = make_limiter(initial=10)
+
+        limiter.record(1.0)
+
+        self.assertEqual(limiter.stats()['limit'], 9)
+
+
+@override_settings(CACHES=LOCMEM_CACHE, UPSTREAM_RATE_LIMIT=2)
+class SharedRateTests(SimpleTestCase):
+    """Test the calls per second budget shared through the cache."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_budget_spent(self):
+        """Test calls over the budget wait for the next second, or fail past their timeout."""
+        wait_for_rate(0)
+        wait_for_rate(0)
+
+        with self.assertRaises(LimitExceededError):
+            wait_for_rate(0)
+
+    def test_async_budget_off_the_loop(self):
+        """Test the asynchronous wait counts calls in the cache outside of the event loop."""
+        on_loop = []
+
+        def track(method):
+            def wrapper(*args, **kwargs):
+                on_loop.append(asyncio._get_running_loop() is not None)
+                return method(*args, **kwargs)
+            return wrapper
+
+        async def spend():
+            await await_rate(0)
+            await await_rate(0)
+            with self.assertRaises(LimitExceededError):
+                await await_rate(0)
+
+        with patch.object(LocMemCache, 'add', track(LocMemCache.add)), \
+                patch.object(LocMemCache, 'incr', track(LocMemCache.incr)):
+            asyncio.run(spend())
+
+        self.assertEqual(len(on_loop), 6)
+        self.assertFalse(any(on_loop))
@@ -0,0 +1,249 @@
+"""
+Tests for the event listing engine.
+"""
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.request import Request
+
+from core import weather
+from core.listing import BlockingBackend, EventListing, ListingParamsError
+from core.models import Event
+from core.tests import LOCMEM_CACHE, create_events, reset_caches
+
+LIST_URLS = [reverse('event-list'), reverse('async-event-list'), reverse('thread-event-list')]
+
+
+def listing(**params):
+    """Return the listing of a GET request with `params`."""
+    return EventListing.from_request(Request(APIRequestFactory().get('/', params)))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class EventListingTests(TestCase):
+    """Test parsing listing requests and keying their cache entries."""
+
+    def setUp(self):
+        reset_caches()
+
+    def test_parse(self):
+        """Test the location, filters and window are read from the request."""
+        result = listing(latitude='48.85', longitude='2.35', radius_km='10', nearest='5')
+
+        self.assertEqual((str(result.latitude), str(result.longitude)), ('48.85', '2.35'))
+        self.assertEqual((result.radius_km, result.nearest_k), (10.0, 5))
+        self.assertEqual(result.end - result.start, timedelta(days=14))
+
+    def test_parse_invalid(self):
+        """Test missing or malformed parameters are rejected."""
+        for params in [{'latitude': '1'}, {'latitude': 'x', 'longitude': '1'},
+                       {'latitude': 'nan', 'longitude': '1'}, {'latitude': '1', 'longitude': '1', 'nearest': '0'},
+                       {'latitude': '1e999999', 'longitude': '1'}, {'latitude': '95', 'longitude': '1'},
+                       {'latitude': '1', 'longitude': '-180.5'}]:
+            with self.subTest(params=params), self.assertRaises(ListingParamsError):
+                listing(**params)
+
+    def test_key_per_page(self):
+        """Test pages of the same listing have their own cache keys."""
+        first = listing(latitude='1', longitude='2').cache_key('async')
+
+        self.assertEqual(listing(latitude='1', longitude='2', page='1').cache_key('async'), first)
+        self.assertNotEqual(listing(latitude='1', longitude='2', page='2').cache_key('async'), first)
+        self.assertNotEqual(listing(latitude='1', longitude='2', radius_km='5').cache_key('async'), first)
+        self.assertNotEqual(listing(latitude='1', longitude='2', order='distance').cache_key('async'), first)
+
+    def test_key_ignores_unrelated_params(self):
+        """Test parameter order, formatting and unrelated parameters share the entry."""
+        key = listing(latitude='1.50', longitude='2', page='2').cache_key('sync')
+
+        self.assertEqual(listing(page='2', longitude='2.0', latitude='1.5', utm='x').cache_key('sync'), key)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ListViewTests(TestCase):
+    """Test the list views share the engine."""
+
+    def setUp(self):
+        reset_caches()
+        create_events(15, days=3)
+        today = datetime.now().date()
+        for offset in range(3):
+            weather.store_weather('Paris', str(today + timedelta(days=offset)), 'Sunny 20C')
+
+    def test_views_agree(self):
+        """Test the three views return the same events."""
+        bodies = [APIClient().get(url, {'latitude': 48.85, 'longitude': 2.35}).json() for url in LIST_URLS]
+
+        self.assertEqual(bodies[0]['events'], bodies[1]['events'])
+        self.assertEqual(bodies[0]['events'], bodies[2]['events'])
+        self.assertEqual(bodies[0]['totalEvents'], 15)
+
+    def test_pages_are_cached_apart(self):
+        """Test a cached first page is not served for the second one."""
+        client = APIClient()
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                first = client.get(url, {'latitude': 48.85, 'longitude': 2.35}).json()
+                second = client.get(url, {'latitude': 48.85, 'longitude': 2.35, 'page': 2}).json()
+
+                self.assertEqual((first['page'], second['page']), (1, 2))
+                self.assertEqual(len(first['events']) + len(second['events']), 15)
+
+    @override_settings(LOCATION_BUCKET='geohash', LOCATION_GEOHASH_PRECISION=5)
+    def test_bucket_shared_with_exact_distances(self):
+        """Test nearby users share a cached listing with their own distances and links."""
+        client = APIClient()
+        with patch.object(BlockingBackend, 'compute', autospec=True, side_effect=BlockingBackend.compute) as compute:
+            first = client.get(LIST_URLS[0], {'latitude': '48.8500', 'longitude': '2.3500'}).json()
+            second = client.get(LIST_URLS[0], {'latitude': '48.8600', 'longitude': '2.3600'}).json()
+
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(len(second['events']), 10)
+        self.assertAlmostEqual(first['events'][0]['distance_km'], 0.0)
+        self.assertAlmostEqual(second['events'][0]['distance_km'], 1.33, places=2)
+        self.assertIn('latitude=48.8600', second['next'])
+        self.assertNotIn('latitude', second['events'][0])
+
+    @override_settings(LOCATION_BUCKET='exact')
+    def test_exact_locations_not_shared(self):
+        """Test without buckets every location gets its own listing."""
+        client = APIClient()
+        with patch.object(BlockingBackend, 'compute', autospec=True, side_effect=BlockingBackend.compute) as compute:
+            client.get(LIST_URLS[0], {'latitude': '48.8500', 'longitude': '2.3500'})
+            client.get(LIST_URLS[0], {'latitude': '48.85', 'longitude': '2.35'})
+            client.get(LIST_URLS[0], {'latitude': '48.8600', 'longitude': '2.3600'})
+
+        self.assertEqual(compute.call_count, 2)
+
+    def test_order_by_distance(self):
+        """Test every view pages the whole window by distance, and by distance within dates."""
+        client = APIClient()
+        Event.objects.filter(id__in=Event.objects.values('id')[:5]).update(latitude=49.85)
+        for url in LIST_URLS:
+            for order in ['distance', 'date,distance']:
+                with self.subTest(url=url, order=order):
+                    pages = [
+                        client.get(url, {'latitude': 48.85, 'longitude': 2.35, 'order': order, 'page': page}).json()
+                        for page in (1, 2)
+                    ]
+                    events = pages[0]['events'] + pages[1]['events']
+                    key = (lambda event: event['distance_km']) if order == 'distance' else (
+                        lambda event: (event['date'], event['distance_km']))
+
+                    self.assertEqual(len(events), 15)
+                    self.assertEqual(events, sorted(events, key=key))
+                    self.assertEqual([event['distance_km'] > 100 for event in events][-5:],
+                                     [True] * 5 if order == 'distance' else [False] * 5)
+
+    @override_settings(LIST_SNAPSHOT=False)
+    def test_order_by_distance_from_database(self):
+        """Test rows queried from the table are ranked alike."""
+        Event.objects.filter(id=Event.objects.order_by('date', 'id')[0].id).update(latitude=49.85)
+        events = APIClient().get(
+            LIST_URLS[0], {'latitude': 48.85, 'longitude': 2.35, 'order': 'distance', 'pagination': 'cursor'}).json()
+
+        self.assertEqual(events['totalEvents'], 15)
+        self.assertGreater(events['next'].find('cursor='), 0)
+        self.assertTrue(all(event['distance_km'] < 1 for event in events['events']))
+
+    def test_invalid_params(self):
+        """Test every view answers 400 to invalid parameters."""
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                res = APIClient().get(url, {'latitude': 48.85})
+
+                self.assertEqual(res.status_code, 400)
+                self.assertEqual(res.json(), {'error': 'Latitude and Longitude parameters are required.'})
+
+    def test_location_out_of_range(self):
+        """Test every view answers 400 to coordinates out of range, huge ones included."""
+        for url in LIST_URLS:
+            for params in [{'latitude': '1e999999', 'longitude': 2.35}, {'latitude': 95, 'longitude': 400}]:
+                with self.subTest(url=url, params=params):
+                    res = APIClient().get(url, params)
+
+                    self.assertEqual(res.status_code, 400)
+                    self.assertIn('Latitude must be between -90 and 90', res.json()['error'])
+
+    def test_invalid_order(self):
+        """Test unknown orders are rejected."""
+        res = APIClient().get(LIST_URLS[0], {'latitude': 48.85, 'longitude': 2.35, 'order': 'name'})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('order must be one of', res.json()['error'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ConditionalRequestTests(TestCase):
+    """Test listings answer conditional requests."""
+
+    def setUp(self):
+        reset_caches()
+        self.today = datetime.now().date()
+        create_events(1)
+        weather.store_weather('Paris', str(self.today), 'Sunny 20C')
+        self.params = {'latitude': 48.85, 'longitude': 2.35}
+
+    def test_not_modified_without_work(self):
+        """Test a current ETag is answered 304 without queries or computing the listing."""
+        client = APIClient()
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                res = client.get(url, self.params)
+                with patch.object(BlockingBackend, 'compute') as compute, self.assertNumQueries(0):
+                    conditional = client.get(url, self.params, HTTP_IF_NONE_MATCH=res['ETag'])
+
+                self.assertEqual(conditional.status_code, 304)
+                self.assertEqual(conditional.content, b'')
+                self.assertEqual(conditional['ETag'], res['ETag'])
+                self.assertFalse(compute.called)
+
+    def test_headers(self):
+        """Test listings can be cached by shared caches."""
+        res = APIClient().get(LIST_URLS[1], self.params)
+
+        self.assertTrue(res['ETag'].startswith('"'))
+        self.assertEqual(res['Cache-Control'], 'public, max-age=60')
+        self.assertEqual(res['Vary'], 'Accept')
+        self.assertIn('Last-Modified', res)
+        conditional = APIClient().get(LIST_URLS[1], self.params, HTTP_IF_MODIFIED_SINCE=res['Last-Modified'])
+        self.assertEqual(conditional.status_code, 304)
+
+    def test_no_vary_on_cookie(self):
+        """Test listings requested with a session do not vary on its cookie."""
+        client = APIClient()
+        client.force_login(get_user_model().objects.create_user('user', password='x'))
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                self.assertEqual(client.get(url, self.params)['Vary'], 'Accept')
+
+    def test_etag_changes(self):
+        """Test the ETag changes with the events, the filters, the user's location and the format."""
+        client = APIClient()
+        etag = client.get(LIST_URLS[1], self.params)['ETag']
+
+        self.assertNotEqual(client.get(LIST_URLS[1], {**self.params, 'radius_km': 10})['ETag'], etag)
+        self.assertNotEqual(client.get(LIST_URLS[1], {**self.params, 'latitude': 48.851})['ETag'], etag)
+        self.assertNotEqual(client.get(LIST_URLS[1], {**self.params, 'format': 'ndjson'})['ETag'], etag)
+        self.assertEqual(client.get(LIST_URLS[1], self.params)['ETag'], etag)
+        Event.objects.create(
+            event_name='New', city_name='Paris', date=self.today, time='12:00', latitude=48.85, longitude=2.35)
+        res = client.get(LIST_URLS[1], self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_refreshed_weather_changes_etag(self):
+        """Test a listing recomputed with new weather, under the same generation, gets a new ETag."""
+        client = APIClient()
+        etag = client.get(LIST_URLS[0], self.params)['ETag']
+        reset_caches()
+        weather.store_weather('Paris', str(self.today), 'Rain 12C')
+
+        res = client.get(LIST_URLS[0], self.params, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['events'][0]['weather'], 'Rain 12C')
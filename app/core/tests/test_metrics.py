@@ -0,0 +1,115 @@
+"""
+Tests for the request instrumentation.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import metrics, weather
+from core.tests import LOCMEM_CACHE, create_events, reset_caches
+
+LIST_URL = reverse('event-list')
+METRICS_URL = reverse('metrics')
+
+
+class MetricTests(SimpleTestCase):
+    """Test metric families and stage timing."""
+
+    def setUp(self):
+        self.counter = metrics.Counter('test_total', "Test counter.", ['kind'])
+        self.histogram = metrics.Histogram('test_seconds', "Test histogram.", ['kind'], buckets=(0.1, 1))
+        self.addCleanup(metrics.Metric.instances.remove, self.counter)
+        self.addCleanup(metrics.Metric.instances.remove, self.histogram)
+
+    def test_counter_exposition(self):
+        """Test counters are exposed per label set."""
+        self.counter.inc(kind='a')
+        self.counter.inc(2, kind='a')
+
+        self.assertEqual(self.counter.value(kind='a'), 3)
+        self.assertIn('test_total{kind="a"} 3', self.counter.exposition())
+        self.assertIn('# TYPE test_total counter', self.counter.exposition())
+
+    def test_histogram_buckets(self):
+        """Test observations fill the cumulative buckets, sum and count."""
+        self.histogram.observe(0.05, kind='a')
+        self.histogram.observe(0.5, kind='a')
+        text = self.histogram.exposition()
+
+        self.assertIn('test_seconds_bucket{kind="a",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{kind="a",le="1"} 2', text)
+        self.assertIn('test_seconds_bucket{kind="a",le="+Inf"} 2', text)
+        self.assertIn('test_seconds_count{kind="a"} 2', text)
+        self.assertIn('test_seconds_sum{kind="a"} 0.55', text)
+
+    def test_stages_recorded_in_request_timings(self):
+        """Test stages in threads and tasks of a request land in its timings."""
+        timings = metrics.Timings()
+        token = metrics._timings.set(timings)
+        try:
+            with metrics.stage('cache'):
+                pass
+            with ThreadPoolExecutor(2) as executor:
+                list(executor.map(metrics.carry_timings(metrics.timed('upstream')(lambda _: None)), range(3)))
+
+            @metrics.timed('render')
+            async def render():
+                return 'done'
+            self.assertEqual(asyncio.run(render()), 'done')
+        finally:
+            metrics._timings.reset(token)
+
+        self.assertEqual({name: count for name, (_, count) in timings.stages.items()},
+                         {'cache': 1, 'upstream': 3, 'render': 1})
+        self.assertIn('upstream;dur=', timings.header(0.01))
+        self.assertIn(';desc="3x"', timings.header(0.01))
+        self.assertTrue(timings.header(0.01).endswith('total;dur=10.0'))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class MetricsEndpointTests(TestCase):
+    """Test the middleware and the /metrics endpoint."""
+
+    def setUp(self):
+        reset_caches()
+        create_events(1)
+        weather.store_weather('Paris', str(datetime.now().date()), 'Sunny 20C')
+
+    def test_server_timing(self):
+        """Test listings answer their stage timings."""
+        res = APIClient().get(LIST_URL, {'latitude': 48.85, 'longitude': 2.35})
+
+        stages = [entry.split(';')[0] for entry in res['Server-Timing'].split(', ')]
+        self.assertIn('db', stages)
+        self.assertIn('enrich', stages)
+        self.assertIn('render', stages)
+        self.assertEqual(stages[-1], 'total')
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        """Test the header can be switched off."""
+        res = APIClient().get(LIST_URL, {'latitude': 48.85, 'longitude': 2.35})
+
+        self.assertNotIn('Server-Timing', res)
+
+    def test_metrics(self):
+        """Test /metrics exposes request latencies, cache results and component stats."""
+        before = metrics.cache_requests.value(cache='listings', result='miss')
+        APIClient().get(LIST_URL, {'latitude': 48.85, 'longitude': 2.35})
+        APIClient().get(LIST_URL, {'latitude': 48.85, 'longitude': 2.35})
+
+        res = self.client.get(METRICS_URL)
+        text = res.content.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertEqual(metrics.cache_requests.value(cache='listings', result='miss'), before + 1)
+        self.assertIn('efinder_request_seconds_count{view="event-list",method="GET",status="200"}', text)
+        self.assertIn('efinder_local_cache_entries{name="weather"}', text)
+        self.assertIn('efinder_circuit_state{name="weather",state="closed"} 1', text)
+        self.assertIn('efinder_limiter_in_flight{name="upstream"}', text)
+        self.assertIn('efinder_upstream_executor_running', text)
@@ -5,12 +5,14 @@ Tests for models.
 from decimal import Decimal
 from datetime import date, time
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.core.exceptions import ValidationError
 
 from core.models import Event
+from core.tests import LOCMEM_CACHE
 
 
+@override_settings(CACHES=LOCMEM_CACHE)
 class EventModelTests(TestCase):
     "Test Event model."
 
@@ -0,0 +1,132 @@
+"""
+Tests for keyset pagination.
+"""
+import json
+from base64 import urlsafe_b64encode
+from datetime import date, timedelta
+from urllib.parse import urlparse
+
+from django.test import TestCase, override_settings
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import Event
+from core.pagination import CustomPagination, KeysetPagination, get_paginator
+from core.tests import LOCMEM_CACHE, reset_caches
+
+START = date(2024, 4, 1)
+END = START + timedelta(days=14)
+
+
+def make_request(url):
+    """Return a DRF request for a url."""
+    return Request(APIRequestFactory().get(url))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class KeysetPaginationTests(TestCase):
+    """Test cursor pagination over the events window."""
+
+    def setUp(self):
+        reset_caches()
+        for index in range(25):
+            Event.objects.create(
+                event_name=f'Event {index}', city_name='City', date=START + timedelta(days=index % 4),
+                time='10:00', latitude=0, longitude=0,
+            )
+
+    def walk(self, url):
+        """Follow `next` links from `url`, returning the pages."""
+        pages = []
+        while url:
+            paginator = KeysetPagination(START, END)
+            rows = paginator.paginate_queryset(Event.objects.values('id', 'date'), make_request(url))
+            response = paginator.get_paginated_response([row['id'] for row in rows])
+            pages.append(response.data)
+            url = response.data['next'] and urlparse(response.data['next'])._replace(scheme='', netloc='').geturl()
+        return pages
+
+    def test_walks_every_event_in_order(self):
+        """Test following next links returns every event once, ordered by (date, id)."""
+        pages = self.walk('/api/event/sync/?pagination=cursor')
+
+        ids = [event_id for page in pages for event_id in page['events']]
+        expected = list(Event.objects.order_by('date', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(page['events']) for page in pages], [10, 10, 5])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertEqual(pages[0]['totalEvents'], 25)
+        self.assertEqual(pages[0]['totalPages'], 3)
+
+    def test_previous_link(self):
+        """Test the previous link of the second page returns the first page."""
+        first, second = self.walk('/api/event/sync/?pagination=cursor')[:2]
+        previous = urlparse(second['previous'])._replace(scheme='', netloc='').geturl()
+        paginator = KeysetPagination(START, END)
+
+        rows = paginator.paginate_queryset(Event.objects.values('id', 'date'), make_request(previous))
+
+        self.assertEqual([row['id'] for row in rows], first['events'])
+        self.assertIsNone(paginator.get_previous_link())
+
+    def test_count_is_cached_and_maintained(self):
+        """Test totals come from counters updated on writes, not from COUNT queries."""
+        paginator = KeysetPagination(START, END)
+        request = make_request('/api/event/sync/?pagination=cursor')
+        paginator.paginate_queryset(Event.objects.values('id', 'date'), request)
+        Event.objects.create(
+            event_name='New', city_name='City', date=START, time='10:00', latitude=0, longitude=0,
+        )
+
+        with self.assertNumQueries(1):
+            paginator.paginate_queryset(Event.objects.values('id', 'date'), request)
+
+        self.assertEqual(paginator.total, 26)
+
+    def test_list_results_are_paged_by_position(self):
+        """Test in-memory results keep their order."""
+        events = list(Event.objects.order_by('-id').values('id', 'date'))
+        paginator = KeysetPagination(START, END)
+
+        rows = paginator.paginate_queryset(events, make_request('/api/event/sync/?cursor='))
+
+        self.assertEqual(rows, events[:10])
+        self.assertEqual(paginator.total, 25)
+        self.assertIn('cursor=', paginator.get_next_link())
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is a 404."""
+        paginator = KeysetPagination(START, END)
+
+        with self.assertRaises(NotFound):
+            paginator.paginate_queryset(Event.objects.values('id', 'date'), make_request('/api/event/sync/?cursor=nope'))
+
+    def test_cursor_not_an_object(self):
+        """Test a cursor decoding to JSON other than an object is a 404 on every list view."""
+        for url in ['/api/event/sync/', '/api/event/thread/', '/api/event/async/']:
+            for cursor in ['MQ==', 'WzFd', 'bnVsbA==']:
+                with self.subTest(url=url, cursor=cursor):
+                    res = APIClient().get(url, {'latitude': 0, 'longitude': 0, 'cursor': cursor})
+
+                    self.assertEqual(res.status_code, 404)
+
+    @override_settings(LIST_SNAPSHOT=False)
+    def test_tampered_cursor_on_database(self):
+        """Test a cursor with a malformed date or id is a 404 when paging the table."""
+        cursors = [{'d': 'abc', 'i': 1}, {'d': 'abc', 'i': 1, 'r': 1}, {'d': '2024-04-01', 'i': 'x'}, {'i': 1}]
+        for cursor in cursors:
+            encoded = urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(NotFound):
+                    KeysetPagination(START, END).paginate_queryset(
+                        Event.objects.values('id', 'date'), make_request(f'/api/event/sync/?cursor={encoded}'))
+                for url in ['/api/event/sync/', '/api/event/thread/', '/api/event/async/']:
+                    res = APIClient().get(url, {'latitude': 0, 'longitude': 0, 'cursor': encoded})
+
+                    self.assertEqual(res.status_code, 404)
+
+    def test_get_paginator(self):
+        """Test page numbers stay the default mode."""
+        self.assertIsInstance(get_paginator(make_request('/?page=2'), START, END), CustomPagination)
+        self.assertIsInstance(get_paginator(make_request('/?pagination=cursor'), START, END), KeysetPagination)
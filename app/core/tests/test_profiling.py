@@ -0,0 +1,119 @@
+"""
+Tests for on demand request profiling.
+"""
+import asyncio
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.profiling import task_stack
+from core.upstream_stub import UpstreamServer
+from core.tests import LOCMEM_CACHE, create_events, reset_caches
+
+LIST_URLS = [reverse('event-list'), reverse('async-event-list'), reverse('thread-event-list')]
+
+
+def report_url(profile_id):
+    return reverse('profile-report', args=[profile_id])
+
+
+class TaskStackTests(SimpleTestCase):
+    """Test walking the stacks of asyncio tasks."""
+
+    def test_task_stack(self):
+        """Test a task's stack follows the coroutines it awaits through."""
+        async def inner():
+            await asyncio.sleep(0.05)
+
+        async def outer():
+            await inner()
+
+        async def main():
+            task = asyncio.ensure_future(outer())
+            await asyncio.sleep(0.01)
+            stack = task_stack(task)
+            await task
+            return stack
+
+        stack = asyncio.run(main())
+
+        self.assertEqual([frame.split(':')[1] for frame in stack], ['outer', 'inner', 'sleep'])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, PROFILING_INTERVAL=0.002, PROFILING_TOKEN='')
+class ProfilingTests(TestCase):
+    """Test profiling the list views."""
+
+    def setUp(self):
+        reset_caches()
+        self.server = UpstreamServer(delay=0.05).__enter__()
+        self.addCleanup(self.server.__exit__)
+        settings = override_settings(UPSTREAM_BASE_URL=self.server.url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        create_events(3, days=3, cities=['City 0', 'City 1', 'City 2'])
+        self.staff = APIClient()
+        self.staff.force_authenticate(get_user_model().objects.create_user('staff', password='x', is_staff=True))
+
+    def test_requires_staff(self):
+        """Test other users' requests are not profiled."""
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user('user', password='x'))
+
+        res = client.get(LIST_URLS[0], {'latitude': 48.85, 'longitude': 2.35}, HTTP_X_PROFILE='1')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('X-Profile-Id', res)
+        self.assertEqual(client.get(report_url('x')).status_code, 403)
+
+    def test_staff_session(self):
+        """Test a staff user's session, read only when a profile is asked for, profiles every list view."""
+        client = APIClient()
+        client.force_login(get_user_model().objects.create_user('session', password='x', is_staff=True))
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                res = client.get(url, {'latitude': 48.85, 'longitude': 2.35}, HTTP_X_PROFILE='1')
+
+                self.assertIn('X-Profile-Id', res)
+
+    @override_settings(PROFILING_TOKEN='secret')
+    def test_token(self):
+        """Test the profiling token allows anonymous requests."""
+        res = APIClient().get(LIST_URLS[0], {'latitude': 48.85, 'longitude': 2.35}, HTTP_X_PROFILE='secret')
+
+        self.assertIn('X-Profile-Id', res)
+        self.assertEqual(res['Cache-Control'], 'private, no-store')
+        report = APIClient().get(report_url(res['X-Profile-Id']), HTTP_X_PROFILE='secret')
+        self.assertEqual(report.status_code, 200)
+
+    def test_report(self):
+        """Test every list view stores a report with samples, SQL and the upstream timeline."""
+        for url in LIST_URLS:
+            with self.subTest(url=url):
+                reset_caches()
+
+                res = self.staff.get(url, {'latitude': 48.85, 'longitude': 2.35}, HTTP_X_PROFILE='1')
+                report = self.staff.get(report_url(res['X-Profile-Id'])).json()
+
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(report['status'], 200)
+                self.assertGreater(report['samples'], 0)
+                self.assertTrue(report['stacks'])
+                self.assertTrue(any('core_event' in query['sql'] for query in report['sql']))
+                stages = [entry['stage'] for entry in report['timeline']]
+                self.assertIn('db', stages)
+                self.assertEqual(stages.count('upstream_weather'), 3)
+
+    def test_async_samples_tasks(self):
+        """Test the asyncio path samples where the request's tasks wait."""
+        res = self.staff.get(LIST_URLS[1], {'latitude': 48.85, 'longitude': 2.35}, HTTP_X_PROFILE='1')
+        report = self.staff.get(report_url(res['X-Profile-Id'])).json()
+
+        task_stacks = [entry['stack'] for entry in report['stacks'] if entry['stack'].startswith('<task>')]
+        self.assertTrue(any('aload_weather' in stack for stack in task_stacks))
+
+    def test_unknown_report(self):
+        """Test an expired report answers 404."""
+        self.assertEqual(self.staff.get(report_url('missing')).status_code, 404)
@@ -0,0 +1,26 @@
+"""
+Tests for renderers.
+"""
+from decimal import Decimal
+from datetime import date
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+
+from core.renderers import ORJSONRenderer
+
+
+class ORJSONRendererTests(SimpleTestCase):
+    """Test the orjson backed renderer."""
+
+    def test_render(self):
+        """Test dates, decimals and lazy strings are encoded."""
+        data = {'date': date(2024, 4, 4), 'distance_km': Decimal('1.5'), 'error': gettext_lazy("Invalid")}
+
+        content = ORJSONRenderer().render(data)
+
+        self.assertEqual(content, b'{"date":"2024-04-04","distance_km":1.5,"error":"Invalid"}')
+
+    def test_render_none(self):
+        """Test an empty body is rendered for no data."""
+        self.assertEqual(ORJSONRenderer().render(None), b'')
@@ -0,0 +1,206 @@
+"""
+Tests for upstream resilience, against a local stand-in server.
+"""
+import asyncio
+import time
+
+import httpx
+from django.test import SimpleTestCase, override_settings
+
+from core import resilience, weather
+from core.enrichers import EnrichContext, WeatherEnricher, aenrich, enrich
+from core.metrics import upstream_requests
+from core.resilience import CircuitBreaker, CircuitOpenError, MalformedResponseError
+from core.upstream import weather_url
+from core.upstream_stub import UpstreamServer
+from core.tests import LOCMEM_CACHE, reset_caches
+
+
+class ResilienceTestCase(SimpleTestCase):
+    """Run every test against a fresh upstream stand-in."""
+
+    def setUp(self):
+        self.server = UpstreamServer().__enter__()
+        self.addCleanup(self.server.__exit__)
+        settings = override_settings(
+            UPSTREAM_BASE_URL=self.server.url, UPSTREAM_HTTP2=False, UPSTREAM_HEDGE_AFTER=0, CACHES=LOCMEM_CACHE)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = httpx.Client()
+        self.addCleanup(self.client.close)
+        self.circuit = CircuitBreaker('test', failure_threshold=2, reset_timeout=0.2)
+        self.url = weather_url('Paris', '2024-04-04')
+
+
+class CircuitBreakerTests(ResilienceTestCase):
+    """Test the circuit breaker."""
+
+    def test_success(self):
+        """Test a successful call keeps the circuit closed."""
+        response = resilience.get(self.client, self.url, self.circuit)
+
+        self.assertEqual(response.json(), {'weather': 'Sunny in Paris'})
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+
+    def test_opens_after_failures(self):
+        """Test consecutive failures open the circuit and calls then fail without a request."""
+        self.server.status = 500
+        failed = upstream_requests.value(api='test', outcome='5xx')
+        rejected = upstream_requests.value(api='test', outcome='circuit_open')
+        for _ in range(2):
+            with self.assertRaises(httpx.HTTPStatusError):
+                resilience.get(self.client, self.url, self.circuit)
+
+        with self.assertRaises(CircuitOpenError):
+            resilience.get(self.client, self.url, self.circuit)
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(upstream_requests.value(api='test', outcome='5xx'), failed + 2)
+        self.assertEqual(upstream_requests.value(api='test', outcome='circuit_open'), rejected + 1)
+
+    def test_closes_after_trial(self):
+        """Test a successful trial call closes the circuit once it cooled down."""
+        self.server.status = 500
+        for _ in range(2):
+            with self.assertRaises(httpx.HTTPError):
+                resilience.get(self.client, self.url, self.circuit)
+        self.server.status = 200
+        time.sleep(0.25)
+
+        resilience.get(self.client, self.url, self.circuit)
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+
+    def test_throttled_cuts_limit(self):
+        """Test 429 answers cut the concurrency limit without opening the circuit."""
+        limiter = resilience.upstream_limiter
+        limit = limiter.limit
+        self.addCleanup(setattr, limiter, 'limit', limit)
+        limiter._last_decrease = 0
+        self.server.status = 429
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            resilience.get(self.client, self.url, self.circuit)
+
+        self.assertLess(limiter.limit, limit)
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+
+    def test_client_errors_keep_circuit_closed(self):
+        """Test 4xx answers are not counted as upstream failures."""
+        self.server.status = 404
+        for _ in range(3):
+            with self.assertRaises(httpx.HTTPStatusError):
+                resilience.get(self.client, self.url, self.circuit)
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+
+    def test_malformed_body_is_a_failure(self):
+        """Test an answer whose body cannot be parsed counts as an upstream failure."""
+        failed = upstream_requests.value(api='test', outcome='malformed')
+        self.server.body = b'<html>Bad gateway</html>'
+        with self.assertRaises(MalformedResponseError):
+            resilience.get(self.client, self.url, self.circuit, parse=lambda response: response.json())
+        self.server.body = {'unexpected': 'shape'}
+        with self.assertRaises(MalformedResponseError):
+            resilience.get(self.client, self.url, self.circuit, parse=lambda response: response.json()['weather'])
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.OPEN)
+        self.assertEqual(upstream_requests.value(api='test', outcome='malformed'), failed + 2)
+
+
+class DeadlineTests(ResilienceTestCase):
+    """Test per-call deadlines and hedged calls."""
+
+    def test_deadline(self):
+        """Test a slow call fails at its deadline."""
+        self.server.delay = 0.5
+        started = time.monotonic()
+
+        with self.assertRaises(httpx.TimeoutException):
+            resilience.get(self.client, self.url, self.circuit, deadline=0.1)
+
+        self.assertLess(time.monotonic() - started, 0.4)
+        self.assertEqual(self.circuit.failures, 1)
+
+    def test_async_deadline(self):
+        """Test a slow asynchronous call fails at its deadline."""
+        self.server.delay = 0.5
+
+        async def call():
+            async with httpx.AsyncClient() as client:
+                return await resilience.aget(client, self.url, self.circuit, deadline=0.1)
+
+        with self.assertRaises(httpx.TimeoutException):
+            asyncio.run(call())
+
+    def test_hedged(self):
+        """Test a slow call is hedged and the fast answer wins."""
+        self.server.delays = [1.0]
+        started = time.monotonic()
+
+        with override_settings(UPSTREAM_HEDGE_AFTER=0.05):
+            response = resilience.get(self.client, self.url, self.circuit, deadline=2)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_async_hedged(self):
+        """Test a slow asynchronous call is hedged and the fast answer wins."""
+        self.server.delays = [1.0]
+
+        async def call():
+            async with httpx.AsyncClient() as client:
+                started = time.monotonic()
+                response = await resilience.aget(client, self.url, self.circuit, deadline=2)
+                return response, time.monotonic() - started
+
+        with override_settings(UPSTREAM_HEDGE_AFTER=0.05):
+            response, elapsed = asyncio.run(call())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.5)
+
+
+class DegradedWeatherTests(ResilienceTestCase):
+    """Test listings degrade to events without weather."""
+
+    def setUp(self):
+        super().setUp()
+        reset_caches()
+        resilience.weather_circuit.reset()
+        self.addCleanup(resilience.weather_circuit.reset)
+
+    def test_weather_null_on_failure(self):
+        """Test events get no weather, and nothing is cached, when the upstream fails."""
+        self.server.status = 503
+        events = [{'city_name': 'Paris', 'date': '2024-04-04'}, {'city_name': 'Rome', 'date': '2024-04-04'}]
+
+        enrich(events, EnrichContext(0, 0, self.client), [WeatherEnricher()])
+
+        self.assertEqual([event['weather'] for event in events], [None, None])
+        self.assertEqual(weather.get_cached_weather([('Paris', '2024-04-04')]), {})
+
+    def test_async_weather_null_on_failure(self):
+        """Test the asynchronous lookup degrades the same way."""
+        self.server.status = 503
+        events = [{'city_name': 'Paris', 'date': '2024-04-04'}]
+
+        async def attach():
+            async with httpx.AsyncClient() as client:
+                return await aenrich(events, EnrichContext(0, 0, client), [WeatherEnricher()])
+
+        self.assertIsNone(asyncio.run(attach())[0]['weather'])
+
+    def test_weather_null_on_malformed_body(self):
+        """Test a malformed weather answer degrades to no weather, in both versions."""
+        self.server.body = {'forecast': 'Sunny'}
+
+        async def aload():
+            async with httpx.AsyncClient() as client:
+                return await weather.aload_weather(client, 'Paris', '2024-04-04')
+
+        self.assertIsNone(weather.load_weather(self.client, 'Paris', '2024-04-04'))
+        self.assertIsNone(asyncio.run(aload()))
+        self.assertEqual(weather.get_cached_weather([('Paris', '2024-04-04')]), {})
@@ -0,0 +1,165 @@
+"""
+Tests for request coalescing.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from core.singleflight import (
+    AsyncSingleFlight,
+    SingleFlight,
+    acache_get_or_compute,
+    cache_get_or_compute,
+)
+from core.tests import LOCMEM_CACHE
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Test coalescing across threads."""
+
+    def test_concurrent_calls_share_one_computation(self):
+        """Test concurrent callers of a key wait for the first one."""
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.05)
+            return 'result'
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            first = executor.submit(flight.do, 'key', compute)
+            started.wait()
+            others = [executor.submit(flight.do, 'key', compute) for _ in range(4)]
+            results = [first.result()] + [future.result() for future in others]
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['result'] * 5)
+
+    def test_errors_are_shared(self):
+        """Test followers get the leader's exception."""
+        flight = SingleFlight()
+
+        with self.assertRaises(ValueError):
+            flight.do('key', lambda: (_ for _ in ()).throw(ValueError()))
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+    """Test coalescing across tasks."""
+
+    def test_concurrent_tasks_share_one_computation(self):
+        """Test concurrent tasks for a key await the first one."""
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        async def run():
+            return await asyncio.gather(*(flight.do('key', compute) for _ in range(5)))
+
+        self.assertEqual(asyncio.run(run()), ['result'] * 5)
+        self.assertEqual(calls, [1])
+
+    def test_errors_are_shared(self):
+        """Test waiting tasks get the leader's exception."""
+        flight = AsyncSingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError()
+
+        async def run():
+            return await asyncio.gather(*(flight.do('key', compute) for _ in range(3)), return_exceptions=True)
+
+        results = asyncio.run(run())
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_cancelled_leader_hands_over(self):
+        """Test cancelling the computing task leaves a waiting task to compute the key."""
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 'result'
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do('key', compute))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(flight.do('key', compute))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await asyncio.gather(leader, follower, return_exceptions=True)
+
+        leader, follower = asyncio.run(run())
+
+        self.assertIsInstance(leader, asyncio.CancelledError)
+        self.assertEqual(follower, 'result')
+        self.assertEqual(calls, [1, 1])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CacheGetOrComputeTests(SimpleTestCase):
+    """Test coalesced cache fills."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_value_cached_by_another_worker_is_reused(self):
+        """Test the cache is checked again once the lock is held."""
+        cache.set('key', 'from another worker')
+
+        self.assertEqual(cache_get_or_compute('key', lambda: 'computed', 60), 'from another worker')
+
+    def test_computed_value_is_cached(self):
+        """Test a computed value is stored for the timeout."""
+        self.assertEqual(cache_get_or_compute('key', lambda: 'computed', 60), 'computed')
+        self.assertEqual(cache.get('key'), 'computed')
+
+    def test_redis_lock_is_held_while_computing(self):
+        """Test the Redis lock is taken around the computation and released."""
+        lock = MagicMock()
+        lock.acquire.return_value = True
+        fake_cache = MagicMock()
+        fake_cache.get.return_value = None
+        fake_cache.lock.return_value = lock
+
+        def compute():
+            lock.acquire.assert_called_once()
+            lock.release.assert_not_called()
+            return 'computed'
+
+        with patch('core.singleflight.cache', fake_cache):
+            self.assertEqual(cache_get_or_compute('key', compute, 60), 'computed')
+
+        lock.release.assert_called_once()
+        fake_cache.set.assert_called_once_with('key', 'computed', 60)
+
+    def test_async(self):
+        """Test concurrent asynchronous misses compute once."""
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'computed'
+
+        async def run():
+            return await asyncio.gather(*(acache_get_or_compute('key', compute, 60) for _ in range(3)))
+
+        self.assertEqual(asyncio.run(run()), ['computed'] * 3)
+        self.assertEqual(calls, [1])
+        self.assertEqual(cache.get('key'), 'computed')
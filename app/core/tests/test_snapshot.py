@@ -0,0 +1,121 @@
+"""
+Tests for the in-process events snapshot.
+"""
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core import geo, weather
+from core.listing import LIST_WINDOW_DAYS
+from core.models import Event
+from core.pagination import KeysetPagination
+from core.serializers import EVENT_LIST_FIELDS
+from core.snapshot import SnapshotStore
+from core.tests import LOCMEM_CACHE, create_events, reset_caches
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SnapshotTests(TestCase):
+    """Test loading, refreshing and reading the snapshot."""
+
+    def setUp(self):
+        reset_caches()
+        self.start = datetime.now().date()
+        self.end = self.start + timedelta(days=LIST_WINDOW_DAYS)
+        for index in range(12):
+            Event.objects.create(
+                event_name=f'Event {index}', city_name='Paris', date=self.start + timedelta(days=index % 4),
+                time='10:00', latitude=48 + index / 10, longitude=2 + index / 10,
+            )
+        self.store = SnapshotStore('test')
+        self.addCleanup(SnapshotStore.instances.remove, self.store)
+
+    def window(self):
+        return list(Event.objects.filter(date__range=[self.start, self.end]).order_by('date', 'id')
+                    .values(*EVENT_LIST_FIELDS))
+
+    def test_load(self):
+        """Test the snapshot holds the rows of the window in (date, id) order."""
+        snapshot = self.store.get(self.start, self.end)
+
+        self.assertEqual(len(snapshot), 12)
+        self.assertEqual(snapshot[:], [{**row, 'latitude': float(row['latitude']),
+                                        'longitude': float(row['longitude'])} for row in self.window()])
+        self.assertIs(snapshot.cities[0], snapshot.cities[1])
+
+    def test_reused_until_written(self):
+        """Test an unchanged window is read without queries and a write reloads its date only."""
+        snapshot = self.store.get(self.start, self.end)
+        with self.assertNumQueries(0):
+            self.assertIs(self.store.get(self.start, self.end), snapshot)
+
+        Event.objects.create(
+            event_name='New', city_name='Rome', date=self.start + timedelta(days=1), time='10:00',
+            latitude=41.9, longitude=12.5,
+        )
+        with CaptureQueriesContext(connection) as queries:
+            refreshed = self.store.get(self.start, self.end)
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(refreshed), 13)
+        self.assertEqual([row['id'] for row in refreshed[:]], [row['id'] for row in self.window()])
+        self.assertEqual(self.store.stats(), {'events': 13, 'builds': 1, 'refreshes': 1})
+
+    def test_rebuilt_on_new_window(self):
+        """Test the snapshot of the next day's window is loaded whole."""
+        self.store.get(self.start, self.end)
+
+        snapshot = self.store.get(self.start + timedelta(days=1), self.end + timedelta(days=1))
+
+        self.assertEqual(len(snapshot), 9)
+        self.assertEqual(self.store.builds, 2)
+
+    def test_near_events(self):
+        """Test the radius and nearest filters agree with the database queries."""
+        snapshot = self.store.get(self.start, self.end)
+        queryset = Event.objects.order_by('date', 'id').values(*EVENT_LIST_FIELDS)
+
+        self.assertEqual([row['id'] for row in snapshot.near_events(48.5, 2.5, radius_km=50)],
+                         [row['id'] for row in geo.near_events(queryset, 48.5, 2.5, radius_km=50)])
+        self.assertEqual([row['id'] for row in snapshot.near_events(48.5, 2.5, nearest_k=3)],
+                         [row['id'] for row in geo.near_events(queryset, 48.5, 2.5, nearest_k=3)])
+
+    def test_keyset_pages(self):
+        """Test cursor pages of the snapshot match those of the table, both ways."""
+        snapshot = self.store.get(self.start, self.end)
+        factory = APIRequestFactory()
+        url, pages = '/api/event/sync/?pagination=cursor', []
+        while url:
+            paginator = KeysetPagination(self.start, self.end)
+            pages.append([row['id'] for row in paginator.paginate_queryset(snapshot, Request(factory.get(url)))])
+            previous, url = paginator.get_previous_link(), paginator.get_next_link()
+
+        self.assertEqual(sum(pages, []), [row['id'] for row in self.window()])
+        self.assertEqual(paginator.total, 12)
+        paginator = KeysetPagination(self.start, self.end)
+        self.assertEqual(
+            [row['id'] for row in paginator.paginate_queryset(snapshot, Request(factory.get(previous)))], pages[0])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class SnapshotListingTests(TestCase):
+    """Test listings are served from the snapshot."""
+
+    def test_listing_without_event_queries(self):
+        """Test a listing page reads no event rows once the snapshot is loaded."""
+        reset_caches()
+        create_events(15)
+        weather.store_weather('Paris', str(datetime.now().date()), 'Sunny 20C')
+        client = APIClient()
+        client.get('/api/event/sync/', {'latitude': 48.85, 'longitude': 2.35})
+
+        with CaptureQueriesContext(connection) as queries:
+            res = client.get('/api/event/sync/', {'latitude': 48.85, 'longitude': 2.35, 'page': 2})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.json()['events']), 5)
+        self.assertFalse([query for query in queries if 'core_event' in query['sql']])
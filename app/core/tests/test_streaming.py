@@ -0,0 +1,77 @@
+"""
+Tests for streaming NDJSON listings.
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import httpx
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import weather
+from core.models import Event
+from core.renderers import NDJSONRenderer
+from core.streaming import stream_events
+from core.tests import LOCMEM_CACHE, create_events, reset_caches
+
+ASYNC_URL = reverse('async-event-list')
+
+
+async def collect(stream):
+    """Return the parsed lines of an NDJSON stream."""
+    return [json.loads(line) for chunk in [chunk async for chunk in stream] for line in chunk.splitlines()]
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class StreamEventsTests(TestCase):
+    """Test streaming enriched events."""
+
+    def setUp(self):
+        reset_caches()
+        create_events(7, days=3)
+        today = datetime.now().date()
+        for offset in range(3):
+            weather.store_weather('Paris', str(today + timedelta(days=offset)), f'Sunny {offset}')
+        self.rows = Event.objects.order_by('date', 'id').values('id', 'event_name', 'city_name', 'date', 'latitude', 'longitude')
+
+    def test_stream_in_order(self):
+        """Test every event is streamed enriched and in order, across chunks."""
+        events = asyncio.run(collect(stream_events(list(self.rows), 48.85, 2.35, chunk_size=2, max_in_flight=2)))
+
+        self.assertEqual([event['event_name'] for event in events], [row['event_name'] for row in self.rows])
+        self.assertEqual(events[0]['weather'], 'Sunny 0')
+        self.assertAlmostEqual(events[0]['distance_km'], 0.0)
+
+    def test_stream_upstream_error(self):
+        """Test events are still streamed, without weather, when the upstream fails."""
+        reset_caches()
+
+        async def fail(client, city, date):
+            raise httpx.ConnectError("down")
+
+        with patch('core.weather.afetch_weather', side_effect=fail):
+            events = asyncio.run(collect(stream_events(list(self.rows), 48.85, 2.35, chunk_size=2)))
+
+        self.assertEqual(len(events), 7)
+        self.assertTrue(all(event['weather'] is None for event in events))
+
+    def test_stream_view(self):
+        """Test the async view streams NDJSON with `format=ndjson&stream=1`."""
+        res = APIClient().get(ASYNC_URL, {'latitude': 48.85, 'longitude': 2.35, 'format': 'ndjson', 'stream': '1'})
+
+        self.assertEqual(res['Content-Type'], NDJSONRenderer.media_type)
+        self.assertTrue(res.streaming)
+        events = async_to_sync(collect)(res.streaming_content)
+        self.assertEqual(len(events), 7)
+        self.assertEqual(set(events[0]), {'event_name', 'city_name', 'date', 'weather', 'distance_km'})
+
+    def test_ndjson_page(self):
+        """Test `format=ndjson` without streaming renders the page one event per line."""
+        res = APIClient().get(ASYNC_URL, {'latitude': 48.85, 'longitude': 2.35, 'format': 'ndjson'})
+
+        self.assertEqual(res['Content-Type'], NDJSONRenderer.media_type)
+        self.assertEqual(len(res.content.splitlines()), 7)
@@ -0,0 +1,101 @@
+"""
+Tests for the shared upstream clients.
+"""
+import asyncio
+import threading
+
+from django.test import SimpleTestCase
+
+from core import upstream
+
+
+class UpstreamClientTests(SimpleTestCase):
+    """Test the upstream client lifecycle."""
+
+    def tearDown(self):
+        upstream.close()
+
+    def test_client_is_shared(self):
+        """Test every caller gets the same pooled client."""
+        client = upstream.get_client()
+
+        self.assertIs(upstream.get_client(), client)
+        self.assertFalse(client.is_closed)
+
+    def test_close(self):
+        """Test closing the client replaces it on next use."""
+        client = upstream.get_client()
+        upstream.close()
+
+        self.assertTrue(client.is_closed)
+        self.assertIsNot(upstream.get_client(), client)
+
+    def test_async_client_closed_on_short_lived_loop(self):
+        """Test a request loop that is not a server loop closes its client."""
+        async def use():
+            async with upstream.async_client() as client:
+                async with upstream.async_client() as same:
+                    self.assertIs(same, client)
+                return client
+
+        client = asyncio.run(use())
+
+        self.assertTrue(client.is_closed)
+
+    def test_lifespan(self):
+        """Test the ASGI wrapper keeps clients on the server loop until shutdown."""
+        clients = []
+
+        async def django_app(scope, receive, send):
+            async with upstream.async_client() as client:
+                clients.append(client)
+
+        async def serve():
+            app = upstream.lifespan(django_app)
+            messages = asyncio.Queue()
+            sent = []
+
+            async def send(message):
+                sent.append(message['type'])
+
+            await app({'type': 'http'}, messages.get, send)
+            await app({'type': 'http'}, messages.get, send)
+            self.assertIs(clients[0], clients[1])
+            self.assertFalse(clients[0].is_closed)
+
+            await messages.put({'type': 'lifespan.startup'})
+            await messages.put({'type': 'lifespan.shutdown'})
+            await app({'type': 'lifespan'}, messages.get, send)
+            return sent
+
+        sent = asyncio.run(serve())
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(clients[0].is_closed)
+
+
+class ExecutorStatsTests(SimpleTestCase):
+    """Test the upstream executor counts its calls."""
+
+    def test_running_and_queued(self):
+        """Test calls are counted as queued until a thread runs them, and cancelled ones are dropped."""
+        executor = upstream._CountingExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        running = executor.submit(block)
+        started.wait(5)
+        queued = [executor.submit(lambda: None) for _ in range(2)]
+        self.assertEqual((executor.running, executor.queued), (1, 2))
+
+        queued[0].cancel()
+        self.assertEqual((executor.running, executor.queued), (1, 1))
+
+        release.set()
+        running.result()
+        queued[1].result()
+        self.assertEqual((executor.running, executor.queued), (0, 0))
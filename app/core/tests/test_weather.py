@@ -0,0 +1,114 @@
+"""
+Tests for the weather cache.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase, override_settings
+
+from core import weather
+from core.enrichers import EnrichContext, WeatherEnricher, aenrich, enrich
+from core.tests import LOCMEM_CACHE, reset_caches
+
+
+class FakeResponse:
+    """Response of the fake weather API."""
+    status_code = 200
+
+    def __init__(self, url):
+        self.url = url
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"weather": f"Sunny {len(self.url) % 40}C"}
+
+
+class FakeClient:
+    """Client recording the urls it is asked for."""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        return FakeResponse(url)
+
+
+class FakeAsyncClient(FakeClient):
+    """Asynchronous client recording the urls it is asked for."""
+
+    async def get(self, url, timeout=None):
+        return super().get(url)
+
+
+def make_events():
+    """Three events sharing two (city, date) pairs."""
+    return [
+        {'city_name': 'Paris', 'date': '2024-04-05'},
+        {'city_name': 'Paris', 'date': '2024-04-05'},
+        {'city_name': 'New York', 'date': '2024-04-06'},
+    ]
+
+
+def attach_weather(events, client, executor=None):
+    """Set the weather of the events through the weather enricher."""
+    return enrich(events, EnrichContext(0, 0, client, executor), [WeatherEnricher()])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class WeatherCacheTests(SimpleTestCase):
+    """Test weather deduplication and caching."""
+
+    def setUp(self):
+        reset_caches()
+
+    def test_dedup_within_request(self):
+        """Test events in the same city on the same day cost one call."""
+        client = FakeClient()
+
+        events = attach_weather(make_events(), client)
+
+        self.assertEqual(len(client.urls), 2)
+        self.assertEqual(events[0]['weather'], events[1]['weather'])
+        self.assertIn('weather', events[2])
+
+    def test_cached_across_requests(self):
+        """Test a second request reuses the cached weather."""
+        attach_weather(make_events(), FakeClient())
+        client = FakeClient()
+
+        events = attach_weather(make_events(), client)
+
+        self.assertEqual(client.urls, [])
+        self.assertEqual(len(events), 3)
+
+    def test_shared_cache_survives_local_eviction(self):
+        """Test the shared cache is used when the local tier misses."""
+        attach_weather(make_events(), FakeClient())
+        weather.local_cache.clear()
+        client = FakeClient()
+
+        attach_weather(make_events(), client)
+
+        self.assertEqual(client.urls, [])
+
+    def test_executor(self):
+        """Test missing pairs can be fetched on an executor."""
+        client = FakeClient()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            events = attach_weather(make_events(), client, executor)
+
+        self.assertEqual(len(client.urls), 2)
+        self.assertEqual(events[0]['weather'], events[1]['weather'])
+
+    def test_async(self):
+        """Test the asynchronous lookup deduplicates pairs too."""
+        client = FakeAsyncClient()
+
+        events = asyncio.run(aenrich(make_events(), EnrichContext(0, 0, client), [WeatherEnricher()]))
+
+        self.assertEqual(len(client.urls), 2)
+        self.assertEqual(events[0]['weather'], events[1]['weather'])
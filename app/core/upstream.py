@@ -0,0 +1,199 @@
+"""
+Process-wide HTTP clients for the weather/distance upstream.
+
+One pooled `httpx.Client` is shared by every thread of the process, and one
+`httpx.AsyncClient` by every request running on the same event loop, so TLS
+sessions and keep-alive connections survive across requests. Requests
+fanning calls out to threads share one bounded executor too.
+"""
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import httpx
+
+from django.conf import settings
+
+WCODE = "KfQnTWHJbg1giyB_Q9Ih3Xu3L9QOBDTuU5zwqVikZepCAzFut3rqsg"
+DCODE = "IAKvV2EvJa6Z6dEIUqqd7yGAu7IZ8gaH-a0QO6btjRc1AzFu8Y3IcQ"
+
+_lock = threading.Lock()
+_client = None
+_executor = None
+_async_clients = weakref.WeakKeyDictionary()
+# Loops of an ASGI server live as long as the process; any other loop (e.g.
+# the one `async_to_sync` creates per request under WSGI) gets its client
+# closed at the end of the request.
+_persistent_loops = weakref.WeakSet()
+
+
+def weather_url(city, date):
+    """Url of the remote weather API."""
+    return f"{settings.UPSTREAM_BASE_URL}/api/Weather?code={WCODE}==&city={city}&date={date}"
+
+
+def distance_url(latitude1, longitude1, latitude2, longitude2):
+    """Url of the remote distance API."""
+    return f"{settings.UPSTREAM_BASE_URL}/api/Distance?code={DCODE}==&latitude1={latitude1}&longitude1={longitude1}&latitude2={latitude2}&longitude2={longitude2}"   # noqa
+
+
+def client_options():
+    """Pool, protocol and timeout options shared by both clients."""
+    return {
+        'http2': settings.UPSTREAM_HTTP2,
+        'timeout': httpx.Timeout(settings.UPSTREAM_TIMEOUT, connect=settings.UPSTREAM_CONNECT_TIMEOUT),
+        'limits': httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def get_client():
+    """Return the process-wide synchronous client."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(**client_options())
+    return _client
+
+
+class _CountingExecutor(ThreadPoolExecutor):
+    """Thread pool counting the calls waiting for a thread and those running."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._count_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+
+    def _count(self, queued, running):
+        with self._count_lock:
+            self.queued += queued
+            self.running += running
+
+    def _cancelled(self, future):
+        if future.cancelled():
+            self._count(-1, 0)
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            self._count(-1, 1)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._count(0, -1)
+
+        self._count(1, 0)
+        try:
+            future = super().submit(run)
+        except BaseException:
+            self._count(-1, 0)
+            raise
+        future.add_done_callback(self._cancelled)
+        return future
+
+
+def get_executor():
+    """Return the process-wide executor for concurrent upstream calls."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = _CountingExecutor(
+                    max_workers=settings.UPSTREAM_THREAD_WORKERS, thread_name_prefix='upstream')
+    return _executor
+
+
+def executor_stats():
+    """Running and queued calls of the upstream executor."""
+    executor = _executor
+    if executor is None:
+        return {'running': 0, 'queued': 0}
+    return {'running': executor.running, 'queued': executor.queued}
+
+
+def get_async_client():
+    """Return the asynchronous client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(**client_options())
+    return client
+
+
+def is_persistent_loop(loop):
+    """Whether `loop` is a long-lived ASGI server loop."""
+    return loop in _persistent_loops
+
+
+@asynccontextmanager
+async def async_client():
+    """
+    Yield the asynchronous client of the running event loop, closing it on
+    exit unless the loop is a long-lived ASGI server loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = get_async_client()
+    try:
+        yield client
+    finally:
+        if loop not in _persistent_loops:
+            _async_clients.pop(loop, None)
+            await client.aclose()
+
+
+def close():
+    """Close the synchronous client, e.g. when a WSGI worker exits."""
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+async def aclose():
+    """Close the asynchronous client of the running event loop."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _reset_after_fork():
+    """Drop clients and threads inherited from the parent process, they are not ours."""
+    global _client, _executor, _lock
+    _lock = threading.Lock()
+    _client = None
+    _executor = None
+    _async_clients.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def lifespan(application):
+    """
+    Wrap an ASGI application so the upstream clients follow the server's
+    lifespan: the server loop keeps its client across requests and every
+    client is closed on shutdown.
+    """
+    async def app(scope, receive, send):
+        _persistent_loops.add(asyncio.get_running_loop())
+        if scope['type'] != 'lifespan':
+            return await application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await aclose()
+                await asyncio.get_running_loop().run_in_executor(None, close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    return app
@@ -0,0 +1,88 @@
+"""
+Local stand-in for the weather/distance upstream, for tests and benchmarks.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from core.distance import haversine
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    """Answer like the upstream APIs, with the delay and status the server is set to."""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            delay = server.delays.pop(0) if server.delays else server.delay
+            delay += server.random.uniform(0, server.jitter) if server.jitter else 0
+            status = server.error_status if server.random.random() < server.error_rate else server.status
+        time.sleep(delay)
+
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if server.body is not None:
+            body = server.body
+        elif status != 200:
+            body = {'error': 'Upstream failure.'}
+        elif url.path == '/api/Weather':
+            body = {'weather': f"Sunny in {params['city']}"}
+        elif url.path == '/api/Distance':
+            body = {'distance': haversine(
+                params['latitude1'], params['longitude1'], params['latitude2'], params['longitude2'])}
+        else:
+            self.send_error(404)
+            return
+        content = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UpstreamServer(ThreadingHTTPServer):
+    """
+    Upstream stand-in listening on a free local port by default. `delay` and
+    `status` apply to every request, `delays` to the next requests in turn;
+    on top, every request is delayed by up to `jitter` seconds and answers
+    `error_status` with a probability of `error_rate`, drawn from `seed`.
+    `body`, when set, is answered instead of the API's, raw if it is bytes.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0, jitter=0, error_rate=0, error_status=503, seed=None):
+        super().__init__((host, port), UpstreamHandler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.delay = delay
+        self.delays = []
+        self.status = 200
+        self.body = None
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up on slow answers (deadlines, hedging) are expected.
+        pass
@@ -7,6 +7,8 @@ from . import views
 urlpatterns = [
     path("sync/", views.SyncEventListView.as_view(), name="event-list"),
     path("create/", views.EventCreateView.as_view(), name="event-create"),
+    path("bulk/", views.EventBulkCreateView.as_view(), name="event-bulk-create"),
     path("async/", views.AsyncEventListView.as_view(), name="async-event-list"),
     path("thread/", views.ThreadEventListView.as_view(), name="thread-event-list"),
+    path("profiles/<str:profile_id>/", views.ProfileReportView.as_view(), name="profile-report"),
 ]
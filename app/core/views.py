@@ -1,11 +1,6 @@
 """
 Views for handle event finder APIs.
 """
-from decimal import Decimal
-import httpx
-import time
-from datetime import datetime, timedelta
-
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework import status
@@ -20,90 +15,118 @@ from drf_spectacular.utils import (
     OpenApiTypes,
 )
 
-import asyncio
 from asgiref.sync import sync_to_async
 from adrf.views import APIView as aAPIView
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.core.cache import cache
-
-WCODE = "KfQnTWHJbg1giyB_Q9Ih3Xu3L9QOBDTuU5zwqVikZepCAzFut3rqsg"
-DCODE = "IAKvV2EvJa6Z6dEIUqqd7yGAu7IZ8gaH-a0QO6btjRc1AzFu8Y3IcQ"
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .cache import LRUCache
+from .ingest import ingest, iter_records
+from .limiter import AdaptiveLimiter
+from .listing import BACKENDS, EventListing, ListingParamsError
+from .metrics import exposition, gauge_family
+from .profiling import CanProfile, get_report, profiled
+from .renderers import NDJSONRenderer, ORJSONRenderer
+from .resilience import CircuitBreaker
+from .snapshot import SnapshotStore
+from .streaming import stream_events
+from .upstream import executor_stats
+
+EVENT_LIST_PARAMETERS = [
+    OpenApiParameter(
+        name='latitude',
+        description="User's latitude.",
+        required=True,
+        type=OpenApiTypes.NUMBER,
+    ),
+    OpenApiParameter(
+        name='longitude',
+        description="User's longitude.",
+        required=True,
+        type=OpenApiTypes.NUMBER,
+    ),
+    OpenApiParameter(
+        name='radius_km',
+        description="Only return events within this distance of the user.",
+        required=False,
+        type=OpenApiTypes.NUMBER,
+    ),
+    OpenApiParameter(
+        name='nearest',
+        description="Only return the k events closest to the user, closest first.",
+        required=False,
+        type=OpenApiTypes.INT,
+    ),
+    OpenApiParameter(
+        name='order',
+        description="Order of the events: by `date` (default), by `distance` from the user, or by distance within each date.",
+        required=False,
+        type=OpenApiTypes.STR,
+        enum=['date', 'distance', 'date,distance'],
+    ),
+    OpenApiParameter(
+        name='pagination',
+        description="Set to `cursor` for keyset pagination with approximate totals.",
+        required=False,
+        type=OpenApiTypes.STR,
+        enum=['cursor'],
+    ),
+    OpenApiParameter(
+        name='cursor',
+        description="Cursor of the page to return, taken from a `next`/`previous` link.",
+        required=False,
+        type=OpenApiTypes.STR,
+    ),
+]
+
+STREAM_PARAMETERS = [
+    OpenApiParameter(
+        name='format',
+        description="Set to `ndjson` for one event per line.",
+        required=False,
+        type=OpenApiTypes.STR,
+        enum=['json', 'ndjson'],
+    ),
+    OpenApiParameter(
+        name='stream',
+        description="With `format=ndjson`, set to `1` to stream every event of the window as it is enriched instead of a page.",
+        required=False,
+        type=OpenApiTypes.STR,
+        enum=['1'],
+    ),
+]
+
+
+class LazyAuthenticationMixin:
+    """
+    Authenticate a listing only when it reads `request.user`, to profile it:
+    reading the session of every request would make the public listings vary
+    on Cookie and defeat shared caches.
+    """
+
+    def perform_authentication(self, request):
+        pass
 
 
 @extend_schema(
-    parameters=[
-        OpenApiParameter(
-            name='latitude',
-            description="User's latitude.",
-            required=True,
-            type=OpenApiTypes.NUMBER,
-        ),
-        OpenApiParameter(
-            name='longitude',
-            description="User's longitude.",
-            required=True,
-            type=OpenApiTypes.NUMBER,
-        ),
-    ]
+    parameters=EVENT_LIST_PARAMETERS
 )
-class SyncEventListView(generics.ListAPIView):
+class SyncEventListView(LazyAuthenticationMixin, generics.ListAPIView):
     """Synchronous API view for event list."""
     serializer_class = EventSerializer
     queryset = Event
     pagination_class = CustomPagination
+    backend = BACKENDS['sync']
 
-    @method_decorator(cache_page(60 * 15))
+    @profiled
     def get(self, request):
         """Get the list of events synchronously."""
-        s = time.perf_counter()
-        latitude = request.query_params.get('latitude', None)
-        longitude = request.query_params.get('longitude', None)
-
-        if not all([latitude, longitude]):
-            return Response({"error": "Latitude and Longitude parameters are required."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            latitude = Decimal(latitude)
-            longitude = Decimal(longitude)
-        except Exception as ex:
-            print(ex)
-            return Response({"error": "Invalid paramters."}, status=status.HTTP_400_BAD_REQUEST)
-
-        current_date = datetime.now().date()
-        end_date = current_date + timedelta(days=14)
-        next_14_days_events = self.queryset.objects.filter(
-            date__range=[current_date, end_date])
-        paginator = CustomPagination()
-        result_page = paginator.paginate_queryset(next_14_days_events, request)
-        serializers = self.get_serializer(result_page, many=True)
-        data = serializers.data
-
-        with httpx.Client() as client:
-            for event in data:
-                latitude1 = latitude
-                longitude1 = longitude
-                latitude2 = event['latitude']
-                longitude2 = event['longitude']
-                city = event['city_name']
-                date = event['date']
-                weather_url = f"https://gg-backend-assignment.azurewebsites.net/api/Weather?code={WCODE}==&city={city}&date={date}"    # noqa
-                distance_url = f"https://gg-backend-assignment.azurewebsites.net/api/Distance?code={DCODE}==&latitude1={latitude1}&longitude1={longitude1}&latitude2={latitude2}&longitude2={longitude2}"   # noqa
-                weather_res = client.get(weather_url)
-                distance_res = client.get(distance_url)
-                weather_res_data = weather_res.json()
-                distance_res_data = distance_res.json()
-                event['weather'] = weather_res_data["weather"]
-                event['distance_km'] = distance_res_data["distance"]
-
-        for event in data:
-            del event['time']
-            del event['latitude']
-            del event['longitude']
-        print("Sync Time: ", time.perf_counter()-s)
-        return paginator.get_paginated_response(data)
+            listing = EventListing.from_request(request)
+        except ListingParamsError as ex:
+            return Response({"error": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return self.backend.get(listing)
 
 
 class EventCreateView(generics.CreateAPIView):
@@ -114,7 +137,6 @@ class EventCreateView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            cache.clear()
             self.perform_create(serializer)
             success_data = {
                 "success": True,
@@ -132,203 +154,126 @@ class EventCreateView(generics.CreateAPIView):
             return Response(failed_data, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Feed formats accepted by the bulk create view, by request content type.
+INGEST_CONTENT_TYPES = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+@extend_schema(
+    request={
+        'application/json': EventSerializer(many=True),
+        'application/x-ndjson': EventSerializer,
+        'text/csv': OpenApiTypes.STR,
+    },
+    responses=None,
+)
+class EventBulkCreateView(generics.GenericAPIView):
+    """View for creating events in bulk from a JSON array, NDJSON or CSV feed."""
+    queryset = Event
+    serializer_class = EventSerializer
+
+    def post(self, request, *args, **kwargs):
+        """Stream the request body into the event table in batches."""
+        format = INGEST_CONTENT_TYPES.get(request.content_type.split(';')[0].strip())
+        if format is None:
+            return Response(
+                {"success": False, "status": status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                 "error": f"Unsupported content type, use one of: {', '.join(INGEST_CONTENT_TYPES)}."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        if request.stream is None:
+            return Response(
+                {"success": False, "status": status.HTTP_400_BAD_REQUEST, "error": "Empty request body."},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        result = ingest(iter_records(request.stream, format))
+        success = not result['failed'] and not result['error']
+        code = status.HTTP_201_CREATED if result['created'] else status.HTTP_400_BAD_REQUEST
+        return Response({"success": success, "status": code, **result}, status=code)
+
+
 @extend_schema(
     request=EventSerializer,
     responses=None,
-    parameters=[
-        OpenApiParameter(
-            name='latitude',
-            description="User's latitude.",
-            required=True,
-            type=OpenApiTypes.NUMBER,
-        ),
-        OpenApiParameter(
-            name='longitude',
-            description="User's longitude.",
-            required=True,
-            type=OpenApiTypes.NUMBER,
-        ),
-    ],
+    parameters=EVENT_LIST_PARAMETERS + STREAM_PARAMETERS,
 )
-class AsyncEventListView(aAPIView):
+class AsyncEventListView(LazyAuthenticationMixin, aAPIView):
     """Asynchronous API view for event list."""
+    renderer_classes = [ORJSONRenderer, NDJSONRenderer]
+    backend = BACKENDS['async']
 
+    @profiled
     async def get(self, request):
         """Get the list of events asynchronously."""
-        s = time.perf_counter()
-        latitude = request.query_params.get('latitude', None)
-        longitude = request.query_params.get('longitude', None)
-
-        if not all([latitude, longitude]):
-            return Response({"error": "Latitude and Longitude parameters are required."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            latitude = Decimal(latitude)
-            longitude = Decimal(longitude)
-        except Exception as ex:
-            print(ex)
-            return Response({"error": "Invalid paramters."}, status=status.HTTP_400_BAD_REQUEST)
-
-        async def get_cached_data(sdata):
-            """Get the cached data if otherwise call fetch api."""
-            data = cache.get(f'{latitude}-{longitude}')
-            if data is None:
-                data = await fetch_weather_distance(sdata)
-                cache.set(f'{latitude}-{longitude}', data, timeout=60*15)
-            return data
-
-        async def get_all(url, d_url, event, client):
-            """Async Method for Hit the urls."""
-            weather_res = await client.get(url)
-            weather_res_data = weather_res.json()
-            event['weather'] = weather_res_data["weather"]
-            distance_res = await client.get(d_url)
-            distance_res_data = distance_res.json()
-            event['distance_km'] = distance_res_data["distance"]
-            return event
-
-        async def fetch_weather_distance(data):
-            """
-            Fetch weather and distance for each events from external API asynchronously.
-            """
-            async with httpx.AsyncClient() as client:
-                tasks = []
-                for event in data:
-                    latitude1 = latitude
-                    longitude1 = longitude
-                    latitude2 = event['latitude']
-                    longitude2 = event['longitude']
-                    city = event['city_name']
-                    date = event['date']
-                    w_url = f"https://gg-backend-assignment.azurewebsites.net/api/Weather?code={WCODE}==&city={city}&date={date}"    # noqa
-                    d_url = f"https://gg-backend-assignment.azurewebsites.net/api/Distance?code={DCODE}==&latitude1={latitude1}&longitude1={longitude1}&latitude2={latitude2}&longitude2={longitude2}"   # noqa
-                    tasks.append(asyncio.ensure_future(
-                        get_all(w_url, d_url, event, client)))
-                events_data = await asyncio.gather(*tasks)
-                return events_data
-
-        current_date = datetime.now().date()
-        end_date = current_date + timedelta(days=14)
-        next_14_days_events = await sync_to_async(Event.objects.filter)(date__range=[current_date, end_date])
-        paginator = CustomPagination()
-        result_page = await sync_to_async(paginator.paginate_queryset)(next_14_days_events, request)
-        serializers = EventSerializer(result_page, many=True)
-        data = await self.get_sdata(serializers)
+            listing = EventListing.from_request(request)
+        except ListingParamsError as ex:
+            return Response({"error": str(ex)}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            data = await get_cached_data(data)
-
-            for item in data:
-                del item['time']
-                del item['latitude']
-                del item['longitude']
-            print("Async Time: ", time.perf_counter()-s)
-            return paginator.get_paginated_response(data)
-        except httpx.HTTPError as e:
-            return Response({"error": str(e)},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    @sync_to_async
-    def get_sdata(self, srl):
-        """Get the data from serializers asynchronously."""
-        try:
-            return srl.data
-        except Exception:
-            raise Exception
+        if request.accepted_renderer.format == 'ndjson' and request.query_params.get('stream') == '1':
+            rows = await sync_to_async(listing.rows)(ordered=True)
+            return StreamingHttpResponse(
+                stream_events(rows, listing.latitude, listing.longitude), content_type=NDJSONRenderer.media_type)
+
+        return await self.backend.aget(listing)
 
 
 @extend_schema(
-    parameters=[
-        OpenApiParameter(
-            name='latitude',
-            description="User's latitude.",
-            required=True,
-            type=OpenApiTypes.NUMBER,
-        ),
-        OpenApiParameter(
-            name='longitude',
-            description="User's longitude.",
-            required=True,
-            type=OpenApiTypes.NUMBER,
-        ),
-    ]
+    parameters=EVENT_LIST_PARAMETERS
 )
-class ThreadEventListView(generics.ListAPIView):
+class ThreadEventListView(SyncEventListView):
     """Threading API view for event list."""
+    backend = BACKENDS['thread']
 
-    serializer_class = EventSerializer
-    queryset = Event
-    pagination_class = CustomPagination
 
-    @method_decorator(cache_page(60 * 15))
-    def get(self, request):
-        """Get the list of events using threads."""
-        s = time.perf_counter()
-        latitude = request.query_params.get('latitude', None)
-        longitude = request.query_params.get('longitude', None)
+@extend_schema(responses=None)
+class ProfileReportView(generics.GenericAPIView):
+    """View for the report of a profiled list request, for staff users."""
+    permission_classes = [CanProfile]
 
-        if not all([latitude, longitude]):
-            return Response({"error": "Latitude and Longitude parameters are required."}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            latitude = Decimal(latitude)
-            longitude = Decimal(longitude)
-        except Exception as ex:
-            print(ex)
-            return Response({"error": "Invalid paramters."}, status=status.HTTP_400_BAD_REQUEST)
-
-        current_date = datetime.now().date()
-        end_date = current_date + timedelta(days=14)
-        next_14_days_events = self.queryset.objects.filter(
-            date__range=[current_date, end_date])
-        paginator = CustomPagination()
-        result_page = paginator.paginate_queryset(next_14_days_events, request)
-        serializers = self.get_serializer(result_page, many=True)
-        data = serializers.data
-
-        def get_all(url, d_url, event, client):
-            """Thread Method for Hit the urls."""
-            weather_res = client.get(url)
-            weather_res_data = weather_res.json()
-            event['weather'] = weather_res_data["weather"]
-            distance_res = client.get(d_url)
-            distance_res_data = distance_res.json()
-            event['distance_km'] = distance_res_data["distance"]
-            return event
-
-        def fetch_weather_distance(data):
-            """
-            Fetch weather and distance for each events from external API using threads.
-            """
-            with ThreadPoolExecutor(max_workers=5) as executer:
-                with httpx.Client() as client:
-                    futures = []
-                    for event in data:
-                        latitude1 = latitude
-                        longitude1 = longitude
-                        latitude2 = event['latitude']
-                        longitude2 = event['longitude']
-                        city = event['city_name']
-                        date = event['date']
-                        w_url = f"https://gg-backend-assignment.azurewebsites.net/api/Weather?code={WCODE}==&city={city}&date={date}"    # noqa
-                        d_url = f"https://gg-backend-assignment.azurewebsites.net/api/Distance?code={DCODE}==&latitude1={latitude1}&longitude1={longitude1}&latitude2={latitude2}&longitude2={longitude2}"   # noqa
-                        futures.append(executer.submit(
-                            get_all, w_url, d_url, event, client))
-                    events_data = []
-                    try:
-                        for future in as_completed(futures):
-                            events_data.append(future.result())
-                        return events_data
-                    except Exception as ex:
-                        print(ex)
+    def get(self, request, profile_id):
+        """Get the report stored under the `X-Profile-Id` of a profiled response."""
+        report = get_report(profile_id)
+        if report is None:
+            return Response({"error": "Unknown or expired profile."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(report)
 
-        try:
-            data = fetch_weather_distance(data)
-
-            for item in data:
-                del item['time']
-                del item['latitude']
-                del item['longitude']
-            print("Thread Time: ", time.perf_counter()-s)
-            return paginator.get_paginated_response(data)
-        except httpx.HTTPError as e:
-            return Response({"error": str(e)},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _stats_families(prefix, instances, help):
+    """Gauge families of the `stats()` of named components, one per statistic."""
+    families = {}
+    for instance in instances:
+        for key, value in instance.stats().items():
+            families.setdefault(key, []).append(({'name': instance.name}, value))
+    return [gauge_family(f'efinder_{prefix}_{key}', f"{help}: {key}.", samples) for key, samples in families.items()]
+
+
+def component_families():
+    """Gauge families of the in-process caches, circuit breakers, limiters and upstream executor."""
+    circuits = [
+        ({'name': circuit.name, 'state': state}, int(circuit.state == state))
+        for circuit in CircuitBreaker.instances
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+    ]
+    return [
+        *_stats_families('local_cache', LRUCache.instances, "In-process cache"),
+        gauge_family('efinder_circuit_state', "Current state of the upstream circuit breakers.", circuits),
+        gauge_family(
+            'efinder_circuit_failures', "Consecutive failures of the upstream circuit breakers.",
+            [({'name': circuit.name}, circuit.failures) for circuit in CircuitBreaker.instances]),
+        *_stats_families('limiter', AdaptiveLimiter.instances, "Adaptive upstream limiter"),
+        *_stats_families('snapshot', SnapshotStore.instances, "In-process events snapshot"),
+        *[
+            gauge_family(f'efinder_upstream_executor_{key}', f"Upstream thread pool: {key}.", [({}, value)])
+            for key, value in executor_stats().items()
+        ],
+    ]
+
+
+def metrics(request):
+    """Prometheus metrics of this worker."""
+    return HttpResponse(
+        exposition(component_families()), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,165 @@
+"""
+Weather lookups for events, cached by (city, date).
+
+Weather only depends on the city and the date of an event, so lookups are
+deduplicated inside a request and cached across requests and users: first in
+a small bounded in-process LRU, then in the shared Django cache. Concurrent
+misses for the same pair, in this worker or others, share one upstream call.
+
+When the upstream fails, or its circuit is open, the weather of the missing
+pairs is None and nothing is cached for them.
+"""
+import asyncio
+import logging
+from urllib.parse import quote
+
+import httpx
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import resilience
+from .cache import LRUCache
+from .metrics import cache_requests, carry_timings, stage
+from .singleflight import acache_get_or_compute, cache_get_or_compute
+from .upstream import weather_url
+
+logger = logging.getLogger(__name__)
+
+
+local_cache = LRUCache(
+    'weather', settings.WEATHER_CACHE_MAX_ENTRIES, min(settings.LOCAL_CACHE_TIMEOUT, settings.WEATHER_CACHE_TIMEOUT))
+
+
+def weather_key(city, date):
+    """Cache key of the weather of a city on a date."""
+    return f"weather:{quote(city, safe='')}:{date}"
+
+
+def _get_local_weather(pairs):
+    """The weather of the pairs in the local tier, and the cache keys of the others."""
+    found = {}
+    missing = {}
+    for pair in pairs:
+        weather = local_cache.get(pair)
+        if weather is None:
+            missing[weather_key(*pair)] = pair
+        else:
+            found[pair] = weather
+    return found, missing
+
+
+def _add_cached_weather(pairs, found, missing, cached):
+    for key, weather in cached.items():
+        found[missing[key]] = weather
+        local_cache.set(missing[key], weather)
+    cache_requests.inc(len(pairs) - len(missing), cache='weather', result='local')
+    cache_requests.inc(len(found) - len(pairs) + len(missing), cache='weather', result='redis')
+    cache_requests.inc(len(pairs) - len(found), cache='weather', result='miss')
+    return found
+
+
+def get_cached_weather(pairs):
+    """Return the cached weather of the given (city, date) pairs that have one."""
+    found, missing = _get_local_weather(pairs)
+    cached = {}
+    if missing:
+        with stage('cache'):
+            cached = cache.get_many(list(missing))
+    return _add_cached_weather(pairs, found, missing, cached)
+
+
+async def aget_cached_weather(pairs):
+    """Asynchronous version of `get_cached_weather`."""
+    found, missing = _get_local_weather(pairs)
+    cached = {}
+    if missing:
+        with stage('cache'):
+            cached = await cache.aget_many(list(missing))
+    return _add_cached_weather(pairs, found, missing, cached)
+
+
+def store_weather(city, date, weather):
+    """Cache the weather of a city on a date in both tiers."""
+    cache.set(weather_key(city, date), weather, timeout=settings.WEATHER_CACHE_TIMEOUT)
+    local_cache.set((city, date), weather)
+
+
+def expiring_pairs(pairs, within):
+    """
+    Return the (city, date) pairs whose cached weather is missing or, when
+    the cache reports TTLs, expires in less than `within` seconds.
+    """
+    keys = {weather_key(*pair): pair for pair in pairs}
+    cached = cache.get_many(list(keys))
+    expiring = []
+    for key, pair in keys.items():
+        if key not in cached:
+            expiring.append(pair)
+        elif hasattr(cache, 'ttl'):
+            ttl = cache.ttl(key)
+            if ttl is not None and ttl < within:
+                expiring.append(pair)
+    return expiring
+
+
+def _parse_weather(response):
+    return response.json()["weather"]
+
+
+def fetch_weather(client, city, date):
+    """Fetch the weather of a city on a date from the remote API."""
+    return resilience.get(client, weather_url(city, date), resilience.weather_circuit, parse=_parse_weather)
+
+
+async def afetch_weather(client, city, date):
+    """Fetch the weather of a city on a date from the remote API asynchronously."""
+    return await resilience.aget(client, weather_url(city, date), resilience.weather_circuit, parse=_parse_weather)
+
+
+def load_weather(client, city, date):
+    """Return the weather of a city on a date after a cache miss, None when the upstream fails."""
+    try:
+        weather = cache_get_or_compute(
+            weather_key(city, date), lambda: fetch_weather(client, city, date), settings.WEATHER_CACHE_TIMEOUT)
+    except httpx.HTTPError as ex:
+        logger.warning("No weather for %s on %s: %s", city, date, ex)
+        return None
+    local_cache.set((city, date), weather)
+    return weather
+
+
+async def aload_weather(client, city, date):
+    """Asynchronous version of `load_weather`."""
+    try:
+        weather = await acache_get_or_compute(
+            weather_key(city, date), lambda: afetch_weather(client, city, date), settings.WEATHER_CACHE_TIMEOUT)
+    except httpx.HTTPError as ex:
+        logger.warning("No weather for %s on %s: %s", city, date, ex)
+        return None
+    local_cache.set((city, date), weather)
+    return weather
+
+
+def lookup_weather(pairs, client, executor=None):
+    """
+    Return the weather of every (city, date) pair, calling the remote API once
+    per uncached pair. Pairs are fetched concurrently on `executor` when one
+    is given.
+    """
+    weather = get_cached_weather(pairs)
+    missing = [pair for pair in pairs if pair not in weather]
+    if missing:
+        mapper = executor.map if executor is not None else map
+        weather.update(zip(missing, mapper(carry_timings(lambda pair: load_weather(client, *pair)), missing)))
+    return weather
+
+
+async def alookup_weather(pairs, client):
+    """Asynchronous version of `lookup_weather`."""
+    weather = await aget_cached_weather(pairs)
+    missing = [pair for pair in pairs if pair not in weather]
+    if missing:
+        results = await asyncio.gather(*(aload_weather(client, *pair) for pair in missing))
+        weather.update(zip(missing, results))
+    return weather
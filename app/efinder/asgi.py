@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'efinder.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from core import upstream  # noqa: E402
+
+application = upstream.lifespan(django_application)
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -133,13 +134,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'core.renderers.ORJSONRenderer',
     ),
     'EXCEPTION_HANDLER': 'core.exception_handler.custom_exception_handler',
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'core.pagination.CustomPagination',
     'PAGE_SIZE': 10,
-    'DEFAULT_CACHE_CONTROL': 'max-age=60',
 }
 
 
@@ -153,3 +153,134 @@ CACHES = {
         "KEY_PREFIX": "events_finder",
     }
 }
+
+
+# Event finder
+# Distances are computed locally; the remote Distance API is only called to
+# cross-check them when verification is switched on.
+
+DISTANCE_VERIFY_REMOTE = os.environ.get('DISTANCE_VERIFY_REMOTE', '') == '1'
+DISTANCE_VERIFY_TOLERANCE_KM = 1.0
+# Largest accepted `nearest=k` on the event list endpoints.
+NEAREST_MAX = 100
+
+# Weather only depends on (city, date) and is cached for every user.
+WEATHER_CACHE_TIMEOUT = 60 * 60
+WEATHER_CACHE_MAX_ENTRIES = 10000
+
+# Weather/distance upstream, shared pooled HTTP clients (see core/upstream.py).
+UPSTREAM_BASE_URL = os.environ.get('UPSTREAM_BASE_URL', 'https://gg-backend-assignment.azurewebsites.net')
+UPSTREAM_HTTP2 = True
+UPSTREAM_TIMEOUT = 10.0
+UPSTREAM_CONNECT_TIMEOUT = 5.0
+UPSTREAM_MAX_CONNECTIONS = 100
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = 20
+UPSTREAM_KEEPALIVE_EXPIRY = 30.0
+
+# Concurrent identical computations share one result; across workers through
+# a Redis lock held for at most SINGLE_FLIGHT_LOCK_TIMEOUT seconds.
+SINGLE_FLIGHT_DISTRIBUTED = True
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+SINGLE_FLIGHT_LOCK_WAIT = 15
+
+# Enriched listings are served stale-while-revalidate: refreshed in the
+# background after the soft TTL, recomputed by the request after the hard TTL.
+LIST_CACHE_SOFT_TTL = 60 * 15
+LIST_CACHE_HARD_TTL = 60 * 60
+LIST_CACHE_REFRESH_WORKERS = 2
+
+# In-process LRU tier in front of Redis for weather and listings.
+LOCAL_CACHE_TIMEOUT = 60
+LIST_LOCAL_CACHE_MAX_ENTRIES = 500
+
+# Background weather prefetcher (`manage.py prefetch_weather`).
+WEATHER_PREFETCH_INTERVAL = 60 * 15
+WEATHER_PREFETCH_CONCURRENCY = 10
+
+# Per-date event counters used for cursor pagination totals; updated on
+# every write and recounted from the database once they expire.
+COUNT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# `manage.py archive_events` moves events older than this many days out of
+# the event table.
+EVENT_RETENTION_DAYS = 1
+
+# Events inserted per bulk_create by the bulk ingestion.
+INGEST_BATCH_SIZE = 1000
+
+# Failed rows whose errors are reported by the bulk ingestion.
+INGEST_MAX_ERRORS = 100
+
+# Streaming NDJSON listings (`?format=ndjson&stream=1`): events read and
+# enriched per chunk, and chunks being enriched at once.
+STREAM_CHUNK_SIZE = 100
+STREAM_MAX_IN_FLIGHT = 4
+
+# Upstream resilience: deadline of a single call, circuit breaker opening
+# after consecutive failures and probing again after the reset timeout, and
+# hedging of calls unanswered after UPSTREAM_HEDGE_AFTER seconds (0 disables).
+UPSTREAM_DEADLINE = 2.0
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+UPSTREAM_HEDGE_AFTER = float(os.environ.get('UPSTREAM_HEDGE_AFTER', 0))
+
+# Listings built without weather, while the upstream fails, go stale after
+# this many seconds instead of LIST_CACHE_SOFT_TTL.
+LIST_CACHE_DEGRADED_TTL = 30
+
+# Adaptive limit of the upstream calls in flight per worker: starts at
+# UPSTREAM_CONCURRENCY, grows while calls answer within
+# UPSTREAM_LATENCY_TARGET seconds and shrinks on 429s and slow answers.
+UPSTREAM_CONCURRENCY = 20
+UPSTREAM_CONCURRENCY_MIN = 2
+UPSTREAM_CONCURRENCY_MAX = 100
+UPSTREAM_LATENCY_TARGET = 1.0
+
+# Upstream calls per second shared by all workers through the cache, 0 for no limit.
+UPSTREAM_RATE_LIMIT = int(os.environ.get('UPSTREAM_RATE_LIMIT', 0))
+
+# Threads shared by the requests of the thread view for their upstream calls.
+UPSTREAM_THREAD_WORKERS = 20
+
+# Enrichers run on every listed page (see core/enrichers.py), concurrently
+# and for at most ENRICH_DEADLINE seconds.
+EVENT_ENRICHERS = [
+    'core.enrichers.DistanceEnricher',
+    'core.enrichers.WeatherEnricher',
+    'core.enrichers.DistanceCheckEnricher',
+]
+ENRICH_DEADLINE = 5.0
+
+# Users are grouped in location buckets for the listing cache: 'geohash'
+# cells of LOCATION_GEOHASH_PRECISION characters (6 is about 1.2 x 0.6 km),
+# 'grid' cells of LOCATION_GRID_DEGREES or 'exact' for none. Listings are
+# computed for the centre of the bucket, with distances then recomputed for
+# the user when LOCATION_EXACT_DISTANCES is set.
+LOCATION_BUCKET = os.environ.get('LOCATION_BUCKET', 'geohash')
+LOCATION_GEOHASH_PRECISION = 6
+LOCATION_GRID_DEGREES = 0.01
+LOCATION_EXACT_DISTANCES = True
+
+# Answer the per stage timings of every request in a `Server-Timing` header
+# (see core/metrics.py); the metrics themselves are served on /metrics.
+SERVER_TIMING = True
+
+# On demand profiling of the list views (see core/profiling.py): requests with
+# an `X-Profile` header, from staff users or set to PROFILING_TOKEN, are
+# sampled every PROFILING_INTERVAL seconds and their report kept for
+# PROFILING_REPORT_TIMEOUT seconds.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '1') == '1'
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_INTERVAL = 0.005
+PROFILING_REPORT_TIMEOUT = 60 * 60
+PROFILING_MAX_STACKS = 50
+
+# List views read the events of their window from an in-process snapshot
+# (see core/snapshot.py), refreshed on the writes of every worker and loaded
+# again at least every LIST_SNAPSHOT_MAX_AGE seconds.
+LIST_SNAPSHOT = os.environ.get('LIST_SNAPSHOT', '1') == '1'
+LIST_SNAPSHOT_MAX_AGE = 5 * 60
+
+# Cache-Control of listing responses, which carry an ETag and Last-Modified
+# for conditional requests and are the same for every client of a URL.
+LIST_CACHE_CONTROL = os.environ.get('LIST_CACHE_CONTROL', 'public, max-age=60')